@@ -0,0 +1,240 @@
+"""Candle update throughput on one core, one tick at a time and per packet.
+
+Replays simulated ticks, spaced to cross week, month, quarter and year
+boundaries, through a CandleBook: one update call per tick, and one
+update_ticks call per packet grouped by ticker as PriceFeed does. Both
+must give the candles of every time frame that a brute force grouping by
+calendar dates gives, and the closed ones must survive persist_candles,
+written in two batches, one of them merging into a stored candle.
+
+Usage (from the api directory):
+    python -m benchmarks.candles [--ticks 1000000] [--tickers 50]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import models
+import models.cumulative_ticker_holding  # noqa: F401
+import numpy as np
+from models.candles import TIME_FRAMES, Candle, CandleBook, persist_candles
+from models.journal import Transaction
+from models.price_feed import PriceSimulator
+from models.tick_store import get_datetime, get_timestamp
+from settings.engine import create_profiled_engine
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+MINUTES = {
+    Transaction.TimeFrame.MIN_1: 1,
+    Transaction.TimeFrame.MIN_5: 5,
+    Transaction.TimeFrame.MIN_15: 15,
+    Transaction.TimeFrame.MIN_30: 30,
+    Transaction.TimeFrame.HOUR_1: 60,
+    Transaction.TimeFrame.HOUR_4: 240,
+    Transaction.TimeFrame.HOUR_6: 360,
+    Transaction.TimeFrame.HOUR_12: 720,
+    Transaction.TimeFrame.DAILY: 1440,
+}
+
+
+def get_reference_start(time_frame, at: datetime.datetime) -> datetime.datetime:
+    if time_frame in MINUTES:
+        day = at.replace(hour=0, minute=0, second=0, microsecond=0)
+        minutes = (at - day) // datetime.timedelta(minutes=1)
+        return day + datetime.timedelta(
+            minutes=minutes // MINUTES[time_frame] * MINUTES[time_frame]
+        )
+
+    day = datetime.datetime(at.year, at.month, at.day)
+
+    if time_frame == Transaction.TimeFrame.WEEKLY:
+        return day - datetime.timedelta(days=day.weekday())
+    if time_frame == Transaction.TimeFrame.MONTHLY:
+        return day.replace(day=1)
+    if time_frame == Transaction.TimeFrame.QUARTERLY:
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+
+    return day.replace(month=1, day=1)
+
+
+def get_reference(ticks: np.ndarray) -> dict:
+    """Candles per ticker and time frame, grouped by calendar dates."""
+
+    candles = defaultdict(dict)
+
+    for ticker_id, timestamp, price, volume in ticks.tolist():
+        at = get_datetime(timestamp)
+
+        for time_frame in TIME_FRAMES:
+            start = get_timestamp(get_reference_start(time_frame, at))
+            candle = candles[(ticker_id, time_frame)].get(start)
+
+            if candle is None:
+                candles[(ticker_id, time_frame)][start] = [
+                    price,
+                    price,
+                    price,
+                    price,
+                    volume,
+                    1,
+                ]
+            else:
+                candle[1] = max(candle[1], price)
+                candle[2] = min(candle[2], price)
+                candle[3] = price
+                candle[4] += volume
+                candle[5] += 1
+
+    return candles
+
+
+def get_candles(book: CandleBook, ticker_ids) -> dict:
+    candles = {}
+
+    for ticker_id in ticker_ids:
+        for time_frame in TIME_FRAMES:
+            candles[(ticker_id, time_frame)] = {
+                candle.start: [
+                    candle.open,
+                    candle.high,
+                    candle.low,
+                    candle.close,
+                    candle.volume,
+                    candle.tick_count,
+                ]
+                for candle in book.get_candles(ticker_id, time_frame)
+            }
+
+    return candles
+
+
+def run_single(ticks: np.ndarray, memory_size: int) -> tuple:
+    book = CandleBook(memory_size)
+    rows = ticks.tolist()
+
+    start = time.perf_counter()
+    for ticker_id, timestamp, price, volume in rows:
+        book.update(ticker_id, timestamp, price, volume)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, book
+
+
+def run_packets(packets: list, memory_size: int) -> tuple:
+    book = CandleBook(memory_size)
+
+    start = time.perf_counter()
+    for ticks in packets:
+        ticks = ticks[np.argsort(ticks["ticker_id"], kind="stable")]
+        book.update_ticks(
+            ticks["ticker_id"], ticks["timestamp"], ticks["price"], ticks["volume"]
+        )
+    elapsed = time.perf_counter() - start
+
+    return elapsed, book
+
+
+def check_persisted(url: str, book: CandleBook):
+    pending = book.take_pending()
+    engine = create_profiled_engine(url)
+    models.Base.metadata.create_all(engine)
+
+    # written again with nothing new, as a second process feeding the ticker
+    # would; merged, the candle must not change
+    again = [
+        candle._replace(high=candle.low, low=candle.high, volume=0.0, tick_count=0)
+        for candle in pending[-1:]
+    ]
+
+    with Session(engine) as session:
+        half = len(pending) // 2
+        persist_candles(session, pending[:half])
+        session.commit()
+        persist_candles(session, pending[half:] + again)
+        session.commit()
+
+        stored = {
+            (candle.ticker_id, candle.time_frame, candle.start): (
+                candle.open,
+                candle.high,
+                candle.low,
+                candle.close,
+                candle.volume,
+                candle.tick_count,
+            )
+            for candle in session.scalars(select(Candle))
+        }
+
+    engine.dispose()
+
+    assert len(stored) == len(pending)
+    for candle in pending:
+        expected = tuple(candle[3:9])
+        assert stored[(candle.ticker_id, candle.time_frame, candle.start)] == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=1000000)
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=30, help="seconds")
+    parser.add_argument("--packet-size", type=int, default=2048)
+    parser.add_argument("--single-ticks", type=int, default=200000)
+    parser.add_argument("--check-ticks", type=int, default=100000)
+    args = parser.parse_args()
+
+    ticker_ids = list(range(1, args.tickers + 1))
+    packets = list(
+        PriceSimulator(
+            ticker_ids,
+            seed=11,
+            start=datetime.datetime(2023, 11, 20, 9, 30),
+            interval=datetime.timedelta(seconds=args.interval),
+        ).ticks(args.ticks, args.packet_size)
+    )
+    ticks = np.concatenate(packets)
+    # every candle in memory, so all of them can be compared
+    memory_size = args.ticks
+
+    single, single_book = run_single(ticks[: args.single_ticks], memory_size)
+    packed, packed_book = run_packets(packets, memory_size)
+
+    check = ticks[: args.check_ticks]
+    reference = get_reference(check)
+    _, check_single = run_single(check, memory_size)
+    _, check_packed = run_packets(
+        [
+            check[i : i + args.packet_size]
+            for i in range(0, len(check), args.packet_size)
+        ],
+        memory_size,
+    )
+    assert get_candles(check_single, ticker_ids) == reference
+    assert get_candles(check_packed, ticker_ids) == reference
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_persisted(
+            f"sqlite:///{os.path.join(tmp_dir, 'candles.sqlite3')}", check_packed
+        )
+
+    first, last = get_datetime(int(ticks["timestamp"][0])), get_datetime(
+        int(ticks["timestamp"][-1])
+    )
+    print(f"ticks from {first} to {last}, {len(TIME_FRAMES)} time frames")
+    print(f"{'path':>14}{'ticks':>10}{'seconds':>9}{'ticks/s':>11}{'closed':>9}")
+    for name, count, elapsed, book in (
+        ("single ticks", min(args.single_ticks, len(ticks)), single, single_book),
+        ("packets", len(ticks), packed, packed_book),
+    ):
+        print(
+            f"{name:>14}{count:>10}{elapsed:>9.2f}{count / elapsed:>11.0f}"
+            f"{book.closed:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Stress test of many workers trading one position at the same time.
+
+Every worker is a separate process with its own engine on a shared SQLite
+file, as the API workers are. Each buys and sells one ticker of one
+investment account through the same unit of work the transaction routes
+run, and deposits into the liquid asset account the trades settle against,
+so the holding and the balance are both contended. Positions close and open
+again all the time, which races on the one open holding index.
+
+The final state must match the trades exactly: every trade recorded once,
+at most one open holding, holding totals and the balance equal to the sums
+of the trades.
+
+Usage (from the api directory):
+    python -m benchmarks.concurrent_trades [--workers 8] [--trades 50]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import models
+import models.cumulative_ticker_holding  # noqa: F401
+from models.common import (
+    Currency,
+    LiquidAssetAccount,
+    LiquidAssetTransaction,
+    Market,
+    Platform,
+    Ticker,
+)
+from models.cumulative_ticker_holding import CumulativeTickerHolding
+from models.journal import Transaction
+from models.ledger import record_liquid_asset_transaction, record_transaction
+from models.user import InvestmentAccount, User
+from settings.database import run_unit_of_work
+from settings.engine import create_profiled_engine
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+# every n-th trade of a worker is followed by a deposit
+DEPOSIT_EVERY = 5
+DEPOSIT_AMOUNT = 100.0
+
+
+def seed(url: str) -> dict:
+    engine = create_profiled_engine(url)
+    models.Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        owner = User(
+            email="bench@monfaristo", hashed_password="", first_name="", last_name=""
+        )
+        currency = Currency(title="US Dollar", code="USD", symbol="$")
+        ticker = Ticker(
+            title="Apple",
+            code="AAPL",
+            market=Market(title="Nasdaq", code="NASDAQGS", currency=currency),
+        )
+        platform = Platform(title="bench")
+        investment_account = InvestmentAccount(title="bench", owner=owner)
+        liquid_asset_account = LiquidAssetAccount(
+            currency=currency, owner=owner, platform=platform, balance=0
+        )
+        session.add_all((ticker, investment_account, liquid_asset_account))
+        session.commit()
+
+        ids = {
+            "owner_id": owner.id,
+            "ticker_id": ticker.id,
+            "platform_id": platform.id,
+            "investment_account_id": investment_account.id,
+            "liquid_asset_account_id": liquid_asset_account.id,
+        }
+
+    engine.dispose()
+
+    return ids
+
+
+def get_trades(worker: int, trades: int, ids: dict):
+    executed_at = datetime.datetime(2024, 1, 1)
+
+    for i in range(trades):
+        price = 100.0 + worker + i % 10
+
+        for type in (Transaction.Type.BUY, Transaction.Type.SELL):
+            yield record_transaction, {
+                "ticker_id": ids["ticker_id"],
+                "price": price,
+                "count": 1.0,
+                "commission": 0.0,
+                "type": type,
+                "investment_account_id": ids["investment_account_id"],
+                "platform_id": ids["platform_id"],
+                "executed_at": executed_at,
+                "executed_by_id": ids["owner_id"],
+            }
+
+        if i % DEPOSIT_EVERY == 0:
+            yield record_liquid_asset_transaction, {
+                "liquid_asset_account_id": ids["liquid_asset_account_id"],
+                "amount": DEPOSIT_AMOUNT,
+                "type": LiquidAssetTransaction.Type.DEPOSIT,
+                "executed_at": executed_at,
+            }
+
+
+def run_worker(url: str, worker: int, trades: int, ids: dict) -> dict:
+    engine = create_profiled_engine(url)
+    attempts = 0
+    units = 0
+    max_attempts = 0
+
+    def counted(session, work, fields):
+        nonlocal attempts
+        attempts += 1
+        return work(session, fields)
+
+    start = time.perf_counter()
+
+    with Session(engine, autoflush=False) as session:
+        for work, fields in get_trades(worker, trades, ids):
+            previous_attempts = attempts
+            run_unit_of_work(session, counted, work, fields)
+            units += 1
+            max_attempts = max(max_attempts, attempts - previous_attempts)
+
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    return {
+        "units": units,
+        "retries": attempts - units,
+        "max_attempts": max_attempts,
+        "elapsed": elapsed,
+    }
+
+
+def check(url: str, ids: dict, workers: int, trades: int):
+    engine = create_profiled_engine(url)
+
+    with Session(engine) as session:
+        holdings = session.scalars(
+            select(CumulativeTickerHolding).where(
+                CumulativeTickerHolding.investment_account_id
+                == ids["investment_account_id"]
+            )
+        ).all()
+        transaction_count = session.scalar(select(func.count(Transaction.id)))
+        unlinked_count = session.scalar(
+            select(func.count(Transaction.id)).where(
+                Transaction.cumulative_ticker_holding_id.is_(None)
+            )
+        )
+        deposit_count = session.scalar(select(func.count(LiquidAssetTransaction.id)))
+        balance = session.scalar(
+            select(LiquidAssetAccount.balance).where(
+                LiquidAssetAccount.id == ids["liquid_asset_account_id"]
+            )
+        )
+
+    engine.dispose()
+
+    expected_deposits = workers * len(range(0, trades, DEPOSIT_EVERY))
+    # every buy is sold again at the same price
+    expected_balance = expected_deposits * DEPOSIT_AMOUNT
+
+    open_holdings = [holding for holding in holdings if not holding.is_completed]
+
+    assert transaction_count == workers * trades * 2, transaction_count
+    assert unlinked_count == 0, unlinked_count
+    assert deposit_count == expected_deposits, deposit_count
+    assert len(open_holdings) <= 1, len(open_holdings)
+    assert sum(holding.count for holding in holdings) == 0
+    assert sum(holding.total_buys for holding in holdings) == workers * trades
+    assert sum(holding.total_sells for holding in holdings) == workers * trades
+    net_amount = sum(
+        holding.total_buy_amount - holding.total_sell_amount for holding in holdings
+    )
+    assert abs(net_amount) < 1e-6, net_amount
+    assert abs(balance - expected_balance) < 1e-6, (balance, expected_balance)
+
+    return len(holdings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--trades", type=int, default=50, help="round trips each")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = f"sqlite:///{os.path.join(tmp_dir, 'bench.sqlite3')}"
+        ids = seed(url)
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(args.workers) as executor:
+            results = list(
+                executor.map(
+                    run_worker,
+                    [url] * args.workers,
+                    range(args.workers),
+                    [args.trades] * args.workers,
+                    [ids] * args.workers,
+                )
+            )
+        elapsed = time.perf_counter() - start
+
+        holding_count = check(url, ids, args.workers, args.trades)
+
+    units = sum(result["units"] for result in results)
+    retries = sum(result["retries"] for result in results)
+    max_attempts = max(result["max_attempts"] for result in results)
+
+    print(f"{'worker':>8}{'units':>8}{'retries':>9}{'max tries':>11}{'units/s':>10}")
+    for worker, result in enumerate(results):
+        print(
+            f"{worker:>8}{result['units']:>8}{result['retries']:>9}"
+            f"{result['max_attempts']:>11}{result['units'] / result['elapsed']:>10.0f}"
+        )
+    print(
+        f"{'total':>8}{units:>8}{retries:>9}{max_attempts:>11}"
+        f"{units / elapsed:>10.0f}  ({holding_count} holdings, state consistent)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Read/write throughput of each engine profile against a scratch database.
+
+Usage (from the api directory):
+    python -m benchmarks.engine_profiles [--url sqlite:////tmp/bench.sqlite3]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import models
+from models.common import Currency
+from settings.engine import ENGINE_PROFILES, create_profiled_engine
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+
+def run_profile(url: str, profile: str, writers: int, readers: int, duration: float):
+    engine = create_profiled_engine(url, profile=profile)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def write(worker_id: int):
+        i = 0
+        while time.perf_counter() < deadline:
+            try:
+                with Session.begin() as session:
+                    session.add(Currency(title="bench", code=f"W{worker_id}-{i}"))
+                key = "writes"
+            except OperationalError:
+                key = "errors"
+            with lock:
+                counts[key] += 1
+            i += 1
+
+    def read():
+        while time.perf_counter() < deadline:
+            try:
+                with Session() as session:
+                    session.scalar(select(func.count(Currency.id)))
+                key = "reads"
+            except OperationalError:
+                key = "errors"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    engine.dispose()
+
+    return {key: value / duration for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="defaults to temp SQLite files")
+    parser.add_argument("--profiles", default=",".join(ENGINE_PROFILES))
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'profile':<12}{'writes/s':>12}{'reads/s':>12}{'errors/s':>12}")
+        for profile in args.profiles.split(","):
+            # journal_mode=WAL sticks to the file, so each profile gets its own
+            url = args.url or f"sqlite:///{os.path.join(tmp_dir, profile)}.sqlite3"
+            result = run_profile(
+                url, profile, args.writers, args.readers, args.duration
+            )
+            print(
+                f"{profile:<12}{result['writes']:>12.1f}"
+                f"{result['reads']:>12.1f}{result['errors']:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Queries and time of a cumulative ticker holdings response by row count.
+
+The query count must not grow with the number of rows; the run fails if it
+does.
+
+Usage (from the api directory):
+    python -m benchmarks.holding_queries [--rows 10,100,1000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import models
+from benchmarks.seed import get_owner_and_market
+from models.common import Ticker
+from models.cumulative_ticker_holding import (
+    CumulativeTickerHolding,
+    CumulativeTickerHoldingFilter,
+    CumulativeTickerHoldingOrderingOptions,
+    CumulativeTickerHoldingRepository,
+)
+from models.user import InvestmentAccount
+from routers.journal import CumulativeTickerHoldingsSchema
+from settings.engine import create_profiled_engine
+from sqlalchemy import asc, event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+async def run(url: str, rows: int, **kwargs) -> dict:
+    """Holdings response of rows holdings, get_all called with kwargs."""
+
+    kwargs = {
+        "filter": CumulativeTickerHoldingFilter(market_code="NASDAQGS"),
+        "ordering": CumulativeTickerHoldingOrderingOptions(ticker_code=asc),
+        **kwargs,
+    }
+    engine = create_profiled_engine(url, is_async=True)
+
+    async with engine.begin() as connection:
+        await connection.run_sync(models.Base.metadata.drop_all)
+        await connection.run_sync(models.Base.metadata.create_all)
+
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with Session.begin() as session:
+        owner, market = get_owner_and_market()
+        # distinct related rows, so nothing is served from the identity map
+        session.add_all(
+            CumulativeTickerHolding(
+                ticker=Ticker(title=f"Ticker {i}", code=f"T{i}", market=market),
+                investment_account=InvestmentAccount(title=f"{i}", owner=owner),
+                count=i + 1,
+            )
+            for i in range(rows)
+        )
+
+    statements = []
+    event.listen(
+        engine.sync_engine,
+        "before_cursor_execute",
+        lambda *args: statements.append(args[2]),
+    )
+
+    async with Session() as session:
+        start = time.perf_counter()
+        holdings = await CumulativeTickerHoldingRepository(session).get_all(
+            schema=CumulativeTickerHoldingsSchema, **kwargs
+        )
+        if isinstance(holdings, dict):
+            holdings = holdings["results"]
+        response = [
+            CumulativeTickerHoldingsSchema.model_validate(holding).model_dump()
+            for holding in holdings
+        ]
+        elapsed = time.perf_counter() - start
+
+    await engine.dispose()
+
+    assert len(response) == rows
+
+    return {"queries": len(statements), "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="10,100,1000")
+    args = parser.parse_args()
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'rows':>8}{'queries':>10}{'ms':>10}")
+        for rows in map(int, args.rows.split(",")):
+            url = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, str(rows))}.sqlite3"
+            results[rows] = asyncio.run(run(url, rows))
+            print(
+                f"{rows:>8}{results[rows]['queries']:>10}"
+                f"{results[rows]['seconds'] * 1000:>10.1f}"
+            )
+
+    if len({result["queries"] for result in results.values()}) > 1:
+        raise SystemExit("query count depends on the number of rows")
+
+
+if __name__ == "__main__":
+    main()
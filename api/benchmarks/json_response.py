@@ -0,0 +1,136 @@
+"""Throughput of the cumulative ticker holdings response body by row count.
+
+Serializes the same loaded holdings the way FastAPI does for a route with a
+response_model, validation then jsonable_encoder then json.dumps, and
+through schema_response, one validation dumped straight to JSON bytes. Both
+bodies must decode to the same data.
+
+Usage (from the api directory):
+    python -m benchmarks.json_response [--rows 100,1000,10000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import List, Union
+
+import models
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from models.common import Currency, Market, Ticker
+from models.cumulative_ticker_holding import (
+    CumulativeTickerHolding,
+    CumulativeTickerHoldingFilter,
+    CumulativeTickerHoldingOrderingOptions,
+    CumulativeTickerHoldingRepository,
+)
+from models.pagination import Page
+from models.user import InvestmentAccount, User
+from routers.journal import CumulativeTickerHoldingsSchema
+from routers.utils import schema_response
+from settings.engine import create_profiled_engine
+from sqlalchemy import asc
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+RESPONSE_FIELD = create_response_field(
+    name="Response_get_cumulative_ticker_holdings",
+    type_=Union[
+        Page[CumulativeTickerHoldingsSchema], List[CumulativeTickerHoldingsSchema]
+    ],
+)
+
+
+async def load(url: str, rows: int) -> list:
+    engine = create_profiled_engine(url, is_async=True)
+
+    async with engine.begin() as connection:
+        await connection.run_sync(models.Base.metadata.create_all)
+
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with Session.begin() as session:
+        owner = User(
+            email="bench@monfaristo", hashed_password="", first_name="", last_name=""
+        )
+        currency = Currency(title="US Dollar", code="USD", symbol="$")
+        market = Market(title="Nasdaq", code="NASDAQGS", currency=currency)
+        investment_account = InvestmentAccount(title="bench", owner=owner)
+        session.add_all(
+            CumulativeTickerHolding(
+                ticker=Ticker(title=f"Ticker {i}", code=f"T{i}", market=market),
+                investment_account=investment_account,
+                count=i + 1,
+                total_buy_amount=(i + 1) * 10.0,
+                total_sell_amount=(i + 1) * 11.0,
+                is_completed=i % 2 == 0,
+            )
+            for i in range(rows)
+        )
+
+    async with Session() as session:
+        holdings = await CumulativeTickerHoldingRepository(session).get_all(
+            filter=CumulativeTickerHoldingFilter(),
+            ordering=CumulativeTickerHoldingOrderingOptions(ticker_code=asc),
+            schema=CumulativeTickerHoldingsSchema,
+        )
+
+    await engine.dispose()
+
+    return holdings
+
+
+async def get_current_body(holdings: list) -> bytes:
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=holdings)
+    return JSONResponse(content).body
+
+
+async def get_schema_response_body(holdings: list) -> bytes:
+    return schema_response(List[CumulativeTickerHoldingsSchema], holdings).body
+
+
+async def measure(get_body, holdings: list, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await get_body(holdings)
+    return (time.perf_counter() - start) / repeat
+
+
+async def run(url: str, rows: int, repeat: int) -> dict:
+    holdings = await load(url, rows)
+
+    assert json.loads(await get_current_body(holdings)) == json.loads(
+        await get_schema_response_body(holdings)
+    )
+
+    return {
+        "current": await measure(get_current_body, holdings, repeat),
+        "schema_response": await measure(get_schema_response_body, holdings, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(
+            f"{'rows':>8}{'current ms':>12}{'rows/s':>10}"
+            f"{'schema ms':>12}{'rows/s':>10}{'speedup':>10}"
+        )
+        for rows in map(int, args.rows.split(",")):
+            url = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, str(rows))}.sqlite3"
+            result = asyncio.run(run(url, rows, args.repeat))
+            current, fast = result["current"], result["schema_response"]
+            print(
+                f"{rows:>8}{current * 1000:>12.1f}{rows / current:>10.0f}"
+                f"{fast * 1000:>12.1f}{rows / fast:>10.0f}{current / fast:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Trade ingest throughput, one transaction per trade against the ledger queue.
+
+Applies the same trades over a few positions once through record_transaction
+with a unit of work per trade, as create_transaction does, and once through
+trade receipts drained by a LedgerQueue in coalesced batches. Accepting the
+receipts, one commit each as enqueue_transaction does, is timed apart from
+draining them. Both runs must end with the same holdings.
+
+Usage (from the api directory):
+    python -m benchmarks.ledger_queue [--trades 5000] [--positions 10]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from typing import Tuple
+
+import models
+import models.cumulative_ticker_holding  # noqa: F401
+from models.common import Currency, Market, Platform, Ticker
+from models.cumulative_ticker_holding import CumulativeTickerHolding
+from models.journal import Transaction
+from models.ledger import record_transaction
+from models.ledger_queue import LedgerQueue, TradeReceipt
+from models.user import InvestmentAccount, User
+from settings.database import run_unit_of_work
+from settings.engine import create_profiled_engine
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+
+
+def seed(url: str, positions: int) -> Tuple:
+    engine = create_profiled_engine(url)
+    models.Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        owner = User(
+            email="bench@monfaristo", hashed_password="", first_name="", last_name=""
+        )
+        market = Market(
+            title="Nasdaq",
+            code="NASDAQGS",
+            currency=Currency(title="US Dollar", code="USD", symbol="$"),
+        )
+        tickers = [
+            Ticker(title=f"Ticker {i}", code=f"T{i}", market=market)
+            for i in range(positions)
+        ]
+        platform = Platform(title="bench")
+        investment_account = InvestmentAccount(title="bench", owner=owner)
+        session.add_all((*tickers, platform, investment_account))
+        session.commit()
+
+        ids = (
+            owner.id,
+            [ticker.id for ticker in tickers],
+            platform.id,
+            investment_account.id,
+        )
+
+    return engine, ids
+
+
+def get_trades(trades: int, ids: Tuple) -> list:
+    owner_id, ticker_ids, platform_id, investment_account_id = ids
+    executed_at = datetime.datetime(2024, 1, 1)
+
+    return [
+        {
+            "ticker_id": ticker_ids[i % len(ticker_ids)],
+            "price": 100.0 + i % 7,
+            "count": 1.0,
+            "commission": 0.5,
+            # every third trade of a position sells one of the two bought before
+            "type": "SELL" if i // len(ticker_ids) % 3 == 2 else "BUY",
+            "investment_account_id": investment_account_id,
+            "platform_id": platform_id,
+            "executed_at": (executed_at + datetime.timedelta(seconds=i)).isoformat(),
+            "executed_by_id": owner_id,
+        }
+        for i in range(trades)
+    ]
+
+
+def get_holdings(engine) -> list:
+    with Session(engine) as session:
+        return session.execute(
+            select(
+                CumulativeTickerHolding.ticker_id,
+                CumulativeTickerHolding.count,
+                CumulativeTickerHolding.avg_cost,
+                CumulativeTickerHolding.total_commission_cost,
+            ).order_by(CumulativeTickerHolding.ticker_id)
+        ).all()
+
+
+def run_per_trade(url: str, trades: int, positions: int):
+    engine, ids = seed(url, positions)
+    payloads = get_trades(trades, ids)
+
+    start = time.perf_counter()
+    with Session(engine, autoflush=False) as session:
+        for payload in payloads:
+            run_unit_of_work(
+                session,
+                record_transaction,
+                TradeReceipt(payload=payload).get_candidate_transaction(),
+            )
+    elapsed = time.perf_counter() - start
+
+    holdings = get_holdings(engine)
+    engine.dispose()
+
+    return elapsed, holdings, None
+
+
+def run_queued(url: str, trades: int, positions: int):
+    engine, ids = seed(url, positions)
+    payloads = get_trades(trades, ids)
+    ledger_queue = LedgerQueue(sessionmaker(engine, autoflush=False))
+
+    start = time.perf_counter()
+    with Session(engine) as session:
+        # what enqueue_transaction does per trade before it answers
+        receipt_ids = []
+        for payload in payloads:
+            receipt = TradeReceipt(payload=payload)
+            session.add(receipt)
+            session.commit()
+            receipt_ids.append(receipt.id)
+    accepted = time.perf_counter() - start
+
+    # the backlog a burst leaves behind, drained on its own
+    start = time.perf_counter()
+    for receipt_id in receipt_ids:
+        ledger_queue.submit(receipt_id)
+    ledger_queue.join()
+    elapsed = time.perf_counter() - start
+    ledger_queue.stop()
+
+    with Session(engine) as session:
+        assert all(
+            status == TradeReceipt.Status.APPLIED
+            for status in session.scalars(select(TradeReceipt.status))
+        )
+
+    holdings = get_holdings(engine)
+    engine.dispose()
+
+    return elapsed, holdings, (accepted, ledger_queue.get_stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=5000)
+    parser.add_argument("--positions", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        per_trade, per_trade_holdings, _ = run_per_trade(
+            f"sqlite:///{os.path.join(tmp_dir, 'per_trade.sqlite3')}",
+            args.trades,
+            args.positions,
+        )
+        queued, queued_holdings, (accepted, stats) = run_queued(
+            f"sqlite:///{os.path.join(tmp_dir, 'queued.sqlite3')}",
+            args.trades,
+            args.positions,
+        )
+
+    assert per_trade_holdings == queued_holdings
+
+    print(
+        f"{'mode':>10}{'apply s':>10}{'trades/s':>10}{'accept s':>10}{'trades/s':>10}"
+    )
+    print(f"{'per trade':>10}{per_trade:>10.2f}{args.trades / per_trade:>10.0f}")
+    print(
+        f"{'queued':>10}{queued:>10.2f}{args.trades / queued:>10.0f}"
+        f"{accepted:>10.2f}{args.trades / accepted:>10.0f}"
+    )
+    print(
+        f"batches {stats['batches']}, mean size {stats['mean_batch_size']:.1f}, "
+        f"mean apply {stats['mean_apply_seconds'] * 1000:.1f} ms, "
+        f"max wait {stats['max_wait_seconds'] * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Latency of an unrelated endpoint while a burst of logins hashes passwords.
+
+Runs the app in process against a scratch database and probes GET
+/currencies in a loop, first alone, then during a login storm with bcrypt on
+the password hash executor, then during one with bcrypt inline on the event
+loop as it used to run.
+
+Usage (from the api directory):
+    python -m benchmarks.login_storm [--logins 32] [--duration 5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+
+async def probe(client, headers: dict, deadline: float) -> list:
+    latencies = []
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/currencies", headers=headers)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.005)
+
+    return latencies
+
+
+async def login(client, email: str, deadline: float, counts: dict):
+    while time.perf_counter() < deadline:
+        response = await client.post(
+            "/user/token", data={"username": email, "password": "bench"}
+        )
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+        if response.status_code == 503:
+            await asyncio.sleep(0.05)
+
+
+async def run(app, email: str, logins: int, duration: float) -> dict:
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench"
+    ) as client:
+        await client.post(
+            "/user/create",
+            json={
+                "email": email,
+                "first_name": "bench",
+                "last_name": "bench",
+                "password": "bench",
+            },
+        )
+        token = (
+            await client.post(
+                "/user/token",
+                data={"username": email, "password": "bench"},
+            )
+        ).json()["access_token"]
+
+        deadline = time.perf_counter() + duration
+        counts = {}
+        latencies, *_ = await asyncio.gather(
+            probe(client, {"Authorization": f"Bearer {token}"}, deadline),
+            *(login(client, email, deadline, counts) for _ in range(logins)),
+        )
+
+    latencies.sort()
+
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "probes": len(latencies),
+        "logins": counts.get(200, 0),
+        "rejected": counts.get(503, 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.sqlite3"
+
+        import main as app_module
+        from routers import auth
+
+        executor_hasher = auth.run_password_hasher
+
+        async def inline_hasher(function, *args):
+            return function(*args)
+
+        print(
+            f"{'mode':<12}{'p50 ms':>10}{'p99 ms':>10}{'probes':>8}{'logins':>8}"
+            f"{'503s':>8}"
+        )
+
+        for mode, logins, hasher in (
+            ("idle", 0, executor_hasher),
+            ("executor", args.logins, executor_hasher),
+            ("inline", args.logins, inline_hasher),
+        ):
+            auth.run_password_hasher = hasher
+            result = asyncio.run(
+                run(app_module.app, f"{mode}@monfaristo", logins, args.duration)
+            )
+            print(
+                f"{mode:<12}{result['p50'] * 1000:>10.1f}{result['p99'] * 1000:>10.1f}"
+                f"{result['probes']:>8}{result['logins']:>8}{result['rejected']:>8}"
+            )
+
+        auth.run_password_hasher = executor_hasher
+
+
+if __name__ == "__main__":
+    main()
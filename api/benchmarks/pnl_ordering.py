@@ -0,0 +1,140 @@
+"""Top-N cumulative ticker holdings by PnL over many closed positions.
+
+Prints the query plan and the time of the first and a deep keyset page
+ordered by pnl_ratio and pnl_amount.
+
+Usage (from the api directory):
+    python -m benchmarks.pnl_ordering [--holdings 50000] [--limit 50]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import models
+from models.common import Currency, Market, Ticker
+from models.cumulative_ticker_holding import (
+    CumulativeTickerHolding,
+    CumulativeTickerHoldingFilter,
+    CumulativeTickerHoldingOrderingOptions,
+    CumulativeTickerHoldingRepository,
+)
+from models.user import InvestmentAccount, User
+from settings.engine import create_profiled_engine
+from sqlalchemy import desc, insert, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+async def seed(session, holdings: int):
+    owner = User(email="bench@monfaristo", hashed_password="")
+    currency = Currency(title="US Dollar", code="USD", symbol="$")
+    market = Market(title="Nasdaq", code="NASDAQGS", currency=currency)
+    ticker = Ticker(title="Bench", code="BNCH", market=market)
+    investment_account = InvestmentAccount(title="bench", owner=owner)
+    session.add_all([ticker, investment_account])
+    await session.flush()
+
+    rows = []
+    for _ in range(holdings):
+        total_buy_amount = random.uniform(100, 10000)
+        is_completed = random.random() < 0.9
+        rows.append(
+            {
+                "ticker_id": ticker.id,
+                "investment_account_id": investment_account.id,
+                "is_completed": is_completed,
+                "total_buy_amount": total_buy_amount,
+                "total_sell_amount": (
+                    total_buy_amount * random.uniform(0.5, 1.5) if is_completed else 0
+                ),
+                "total_commission_cost": random.uniform(0, 10),
+            }
+        )
+
+    await session.execute(insert(CumulativeTickerHolding), rows)
+
+
+async def run(url: str, holdings: int, limit: int):
+    engine = create_profiled_engine(url, is_async=True)
+
+    async with engine.begin() as connection:
+        await connection.run_sync(models.Base.metadata.create_all)
+
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with Session.begin() as session:
+        await seed(session, holdings)
+
+    async with Session() as session:
+        await session.execute(text("ANALYZE"))
+        repo = CumulativeTickerHoldingRepository(session)
+
+        for field in ("pnl_ratio", "pnl_amount"):
+            ordering = CumulativeTickerHoldingOrderingOptions(**{field: desc})
+            after = None
+
+            for page in range(1, 6):
+                start = time.perf_counter()
+                result = await repo.get_all(
+                    filter=CumulativeTickerHoldingFilter(),
+                    ordering=ordering,
+                    limit=limit,
+                    after=after,
+                )
+                elapsed = time.perf_counter() - start
+                print(f"-{field:<12}page {page:<4}{elapsed * 1000:>8.2f} ms")
+
+                # skip ahead to exercise a deep page
+                for _ in range(holdings // limit // 5):
+                    after = result["next"]
+                    if after is None:
+                        break
+                    result = await repo.get_all(
+                        filter=CumulativeTickerHoldingFilter(),
+                        ordering=ordering,
+                        limit=limit,
+                        after=after,
+                    )
+
+                if result["next"] is None:
+                    break
+
+    await engine.dispose()
+
+
+async def explain(url: str, limit: int):
+    engine = create_profiled_engine(url, is_async=True)
+
+    async with engine.connect() as connection:
+        for field in ("pnl_ratio", "pnl_amount"):
+            expression = getattr(CumulativeTickerHolding, field)
+            query = (
+                CumulativeTickerHolding.__table__.select()
+                .order_by(desc(expression).nulls_last(), desc("id"))
+                .limit(limit)
+            )
+            compiled = query.compile(
+                engine.sync_engine, compile_kwargs={"literal_binds": True}
+            )
+            plan = await connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+            print(f"-{field:<12}{' | '.join(row[-1] for row in plan)}")
+
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--holdings", type=int, default=50000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp_dir, 'pnl')}.sqlite3"
+        asyncio.run(run(url, args.holdings, args.limit))
+        asyncio.run(explain(url, args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Price feed ingest throughput on one core, with and without persistence.
+
+Replays the same simulated ticks through PriceFeed: decoded from packets
+into the per-ticker rings only, then with every batch appended to a tick
+store and closed candles written to SQLite, then one tick at a time as the
+JSON WebSocket path does, and finally over a UDP socket on the loopback.
+The simulator must give the same ticks for the same seed, and the rings and
+the tick store must hold what was sent.
+
+Usage (from the api directory):
+    python -m benchmarks.price_feed [--ticks 1000000] [--tickers 50]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import models
+import models.cumulative_ticker_holding  # noqa: F401
+import numpy as np
+from models.price_feed import (
+    PRICE_PACKET_SIZE,
+    PriceFeed,
+    PriceSimulator,
+    decode_ticks,
+    serve_price_feed,
+)
+from models.tick_store import TickStore
+from settings.engine import create_profiled_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def check_rings(feed: PriceFeed, ticks: np.ndarray):
+    for ticker_id in np.unique(ticks["ticker_id"]).tolist():
+        last = ticks[ticks["ticker_id"] == ticker_id][-1]
+        assert feed.get_ring(ticker_id).latest() == (
+            int(last["timestamp"]),
+            float(last["price"]),
+            float(last["volume"]),
+        )
+
+
+def run_rings(packets: list, ticks: np.ndarray) -> float:
+    feed = PriceFeed(session_factory=None)
+
+    start = time.perf_counter()
+    for packet in packets:
+        feed.ingest_packet(packet)
+    elapsed = time.perf_counter() - start
+
+    check_rings(feed, ticks)
+
+    return elapsed
+
+
+def run_persisted(url: str, root: str, packets: list, ticks: np.ndarray) -> float:
+    engine = create_profiled_engine(url)
+    models.Base.metadata.create_all(engine)
+    store = TickStore(root)
+    feed = PriceFeed(session_factory=sessionmaker(engine), store=store)
+
+    start = time.perf_counter()
+    for packet in packets:
+        feed.ingest_packet(packet)
+        if feed.pending >= feed.batch_size:
+            feed.flush()
+    feed.flush()
+    elapsed = time.perf_counter() - start
+
+    check_rings(feed, ticks)
+    for ticker_id in np.unique(ticks["ticker_id"]).tolist():
+        stored = store.read(ticker_id)
+        sent = ticks[ticks["ticker_id"] == ticker_id]
+        assert (stored.timestamp == sent["timestamp"]).all()
+        assert (stored.price == sent["price"]).all()
+
+    engine.dispose()
+
+    return elapsed
+
+
+def run_single(ticks: np.ndarray) -> float:
+    feed = PriceFeed(session_factory=None)
+    rows = ticks.tolist()
+
+    start = time.perf_counter()
+    for ticker_id, timestamp, price, volume in rows:
+        feed.ingest(ticker_id, timestamp, price, volume)
+    elapsed = time.perf_counter() - start
+
+    check_rings(feed, ticks)
+
+    return elapsed
+
+
+def run_udp(
+    url: str, root: str, packets: list, tick_count: int, port: int, rate: float
+):
+    engine = create_profiled_engine(url)
+    models.Base.metadata.create_all(engine)
+    store = TickStore(root)
+    feed = PriceFeed(session_factory=sessionmaker(engine), store=store)
+
+    def send():
+        time.sleep(0.2)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        start = time.perf_counter()
+        sent = 0
+
+        for packet in packets:
+            sender.sendto(packet, ("127.0.0.1", port))
+            sent += len(decode_ticks(packet))
+            # paced like a live feed, a burst would only test the socket buffer
+            ahead = sent / rate - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    async def receive():
+        server = asyncio.create_task(
+            serve_price_feed(feed, "127.0.0.1", port, interval=0.1)
+        )
+        sender = threading.Thread(target=send)
+        sender.start()
+
+        start = time.perf_counter()
+        # done once every tick is written, or nothing moved for a second
+        last_progress, last_change = None, start
+        while feed.persisted < tick_count and time.perf_counter() - last_change < 1:
+            await asyncio.sleep(0.01)
+            if (feed.ticks, feed.persisted) != last_progress:
+                last_progress = feed.ticks, feed.persisted
+                last_change = time.perf_counter()
+
+        elapsed = last_change - start
+        server.cancel()
+        sender.join()
+
+        return elapsed
+
+    elapsed = asyncio.run(receive())
+
+    persisted = sum(
+        len(store.read(ticker_id).timestamp) for ticker_id in store.ticker_ids()
+    )
+    engine.dispose()
+
+    return elapsed, feed.ticks, persisted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=1000000)
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--packet-size", type=int, default=PRICE_PACKET_SIZE)
+    parser.add_argument("--single-ticks", type=int, default=100000)
+    parser.add_argument("--udp-ticks", type=int, default=500000)
+    parser.add_argument("--udp-rate", type=float, default=60000, help="ticks/s")
+    parser.add_argument("--port", type=int, default=19999)
+    args = parser.parse_args()
+
+    ticker_ids = range(1, args.tickers + 1)
+    packets = list(
+        PriceSimulator(ticker_ids, seed=7).packets(args.ticks, args.packet_size)
+    )
+    assert packets == list(
+        PriceSimulator(ticker_ids, seed=7).packets(args.ticks, args.packet_size)
+    )
+    ticks = np.concatenate([decode_ticks(packet) for packet in packets])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rings = run_rings(packets, ticks)
+        persisted = run_persisted(
+            f"sqlite:///{os.path.join(tmp_dir, 'ticks.sqlite3')}",
+            os.path.join(tmp_dir, "ticks"),
+            packets,
+            ticks,
+        )
+        single = run_single(ticks[: args.single_ticks])
+        udp_packets = packets[: -(-args.udp_ticks // args.packet_size)]
+        udp_ticks = sum(len(decode_ticks(packet)) for packet in udp_packets)
+        udp, received, udp_persisted = run_udp(
+            f"sqlite:///{os.path.join(tmp_dir, 'udp.sqlite3')}",
+            os.path.join(tmp_dir, "udp"),
+            udp_packets,
+            udp_ticks,
+            args.port,
+            args.udp_rate,
+        )
+
+    print(f"{'path':>22}{'ticks':>10}{'seconds':>9}{'ticks/s':>11}")
+    for name, count, elapsed in (
+        ("packets to rings", len(ticks), rings),
+        ("packets, persisted", len(ticks), persisted),
+        ("single ticks", min(args.single_ticks, len(ticks)), single),
+        ("udp, persisted", udp_persisted, udp),
+    ):
+        print(f"{name:>22}{count:>10}{elapsed:>9.2f}{count / elapsed:>11.0f}")
+    print(
+        f"udp received {received} of {udp_ticks} ticks "
+        f"sent at {args.udp_rate:.0f}/s, persisted {udp_persisted}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Ticker search latency, LIKE contains against the FTS5 prefix index.
+
+Usage (from the api directory):
+    python -m benchmarks.reference_search [--tickers 100000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+import models
+from models.common import Currency, Market, Ticker
+from models.search import select_search
+from settings.engine import create_profiled_engine
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import sessionmaker
+
+SUFFIXES = ("Inc", "Corp", "Holdings", "Group", "Ltd", "Bancorp", "Energy")
+
+QUERIES = ("a", "ba", "bar", "bar ko", "corp", "holdings gr", "zzq")
+
+
+def get_word() -> str:
+    syllables = random.choices(("ba", "ko", "ri", "ten", "sol", "mar", "vi"), k=3)
+    return "".join(syllables).title() + random.choice(string.ascii_lowercase)
+
+
+def seed(session, tickers: int):
+    currency = Currency(title="US Dollar", code="USD", symbol="$")
+    market = Market(title="Nasdaq", code="NASDAQGS", currency=currency)
+    session.add(market)
+    session.flush()
+
+    codes = set()
+    while len(codes) < tickers:
+        codes.add("".join(random.choices(string.ascii_uppercase, k=5)))
+
+    session.execute(
+        insert(Ticker),
+        [
+            {
+                "code": code,
+                "title": f"{get_word()} {get_word()} {random.choice(SUFFIXES)}",
+                "market_id": market.id,
+            }
+            for code in codes
+        ],
+    )
+
+
+def measure(session, query, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        session.scalars(query).all()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickers", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_profiled_engine(
+            f"sqlite:///{os.path.join(tmp_dir, 'search')}.sqlite3"
+        )
+        models.Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+
+        with Session.begin() as session:
+            seed(session, args.tickers)
+
+        # the route returns every match unless a limit is given
+        print(f"{'q':<12}{'matches':>10}{'contains':>12}{'contains':>12}{'prefix':>12}")
+        print(f"{'':<12}{'':>10}{'all ms':>12}{'limit ms':>12}{'limit ms':>12}")
+
+        with Session() as session:
+            for q in QUERIES:
+                contains = select(Ticker).where(
+                    or_(Ticker.title.like(f"%{q}%"), Ticker.code.like(f"%{q}%"))
+                )
+                prefix = select_search(Ticker, q, "sqlite")
+                timings = [
+                    measure(session, query, args.repeat) * 1000
+                    for query in (
+                        contains,
+                        contains.limit(args.limit),
+                        prefix.limit(args.limit),
+                    )
+                ]
+
+                print(
+                    f"{q:<12}{len(session.scalars(prefix).all()):>10}"
+                    + "".join(f"{timing:>12.2f}" for timing in timings)
+                )
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
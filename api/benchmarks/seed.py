@@ -0,0 +1,16 @@
+from typing import Tuple
+
+from models.common import Currency, Market
+from models.user import User
+
+
+def get_owner_and_market() -> Tuple[User, Market]:
+    """A user and a US dollar market to hang the rows of a run on, not added
+    to any session yet."""
+
+    owner = User(
+        email="bench@monfaristo", hashed_password="", first_name="", last_name=""
+    )
+    currency = Currency(title="US Dollar", code="USD", symbol="$")
+
+    return owner, Market(title="Nasdaq", code="NASDAQGS", currency=currency)
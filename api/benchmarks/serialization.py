@@ -0,0 +1,235 @@
+"""Time to serialize rows with Base.to_dict, against the previous version.
+
+Serializes in memory User rows with their defaults and Transaction rows with
+their ticker, through the precompiled plan and through the previous
+implementation, which walked dir() and round-tripped properties through json
+for every row. The previous version also grew User._default_fields on every
+call, so it is timed with and without that leak. The outputs must match.
+
+Usage (from the api directory):
+    python -m benchmarks.serialization [--rows 10000] [--repeat 1]
+"""
+import argparse
+import datetime
+import json
+import time
+
+from models.common import Currency, Market, Ticker
+
+# maps the holding a transaction refers to
+from models.cumulative_ticker_holding import CumulativeTickerHolding  # noqa: F401
+from models.journal import Transaction
+from models.user import User
+from sqlalchemy.orm.attributes import QueryableAttribute
+
+TRANSACTION_SHOW = ["ticker", "ticker.code", "price", "count", "type", "executed_at"]
+
+
+def legacy_to_dict(self, show=None, _hide=[], _path=None):
+    """Base.to_dict as it used to run, for comparison."""
+
+    show = show or []
+
+    hidden = self._hidden_fields if hasattr(self, "_hidden_fields") else []
+    default = self._default_fields if hasattr(self, "_default_fields") else []
+    default.extend(["id", "modified_at", "created_at"])
+
+    if not _path:
+        _path = self.__tablename__.lower()
+
+        def prepend_path(item):
+            item = item.lower()
+            if item.split(".", 1)[0] == _path:
+                return item
+            if len(item) == 0:
+                return item
+            if item[0] != ".":
+                item = ".%s" % item
+            item = "%s%s" % (_path, item)
+            return item
+
+        _hide[:] = [prepend_path(x) for x in _hide]
+        show[:] = [prepend_path(x) for x in show]
+
+    columns = self.__table__.columns.keys()
+    relationships = self.__mapper__.relationships.keys()
+    properties = dir(self)
+
+    ret_data = {}
+
+    for key in columns:
+        if key.startswith("_"):
+            continue
+        check = "%s.%s" % (_path, key)
+        if check in _hide or key in hidden:
+            continue
+        if check in show or key in default:
+            ret_data[key] = getattr(self, key)
+
+    for key in relationships:
+        if key.startswith("_"):
+            continue
+        check = "%s.%s" % (_path, key)
+        if check in _hide or key in hidden:
+            continue
+        if check in show or key in default:
+            _hide.append(check)
+            is_list = self.__mapper__.relationships[key].uselist
+            if is_list:
+                items = getattr(self, key)
+                if self.__mapper__.relationships[key].query_class is not None:
+                    if hasattr(items, "all"):
+                        items = items.all()
+                ret_data[key] = []
+                for item in items:
+                    ret_data[key].append(
+                        legacy_to_dict(
+                            item,
+                            show=list(show),
+                            _hide=list(_hide),
+                            _path=("%s.%s" % (_path, key.lower())),
+                        )
+                    )
+            else:
+                if (
+                    self.__mapper__.relationships[key].query_class is not None
+                    or self.__mapper__.relationships[key].instrument_class is not None
+                ):
+                    item = getattr(self, key)
+                    if item is not None:
+                        ret_data[key] = legacy_to_dict(
+                            item,
+                            show=list(show),
+                            _hide=list(_hide),
+                            _path=("%s.%s" % (_path, key.lower())),
+                        )
+                    else:
+                        ret_data[key] = None
+                else:
+                    ret_data[key] = getattr(self, key)
+
+    for key in list(set(properties) - set(columns) - set(relationships)):
+        if key.startswith("_"):
+            continue
+        if not hasattr(self.__class__, key):
+            continue
+        attr = getattr(self.__class__, key)
+        if not (isinstance(attr, property) or isinstance(attr, QueryableAttribute)):
+            continue
+        check = "%s.%s" % (_path, key)
+        if check in _hide or key in hidden:
+            continue
+        if check in show or key in default:
+            val = getattr(self, key)
+            if hasattr(val, "to_dict"):
+                ret_data[key] = legacy_to_dict(
+                    val,
+                    show=list(show),
+                    _hide=list(_hide),
+                    _path=("%s.%s" % (_path, key.lower())),
+                )
+            else:
+                try:
+                    ret_data[key] = json.loads(json.dumps(val))
+                except:
+                    pass
+
+    return ret_data
+
+
+def get_rows(rows: int) -> dict:
+    now = datetime.datetime.utcnow()
+    currency = Currency(id=1, title="US Dollar", code="USD", symbol="$")
+    market = Market(id=1, title="Nasdaq", code="NASDAQGS", currency=currency)
+    tickers = [
+        Ticker(id=i, title=f"Ticker {i}", code=f"T{i}", market=market)
+        for i in range(100)
+    ]
+
+    return {
+        "user": [
+            User(
+                id=i,
+                email=f"user{i}@monfaristo",
+                hashed_password="",
+                first_name="bench",
+                last_name="bench",
+                is_active=True,
+                created_at=now,
+                modified_at=now,
+            )
+            for i in range(rows)
+        ],
+        "transaction": [
+            Transaction(
+                id=i,
+                ticker=tickers[i % len(tickers)],
+                price=10.0 + i % 7,
+                count=1.0,
+                commission=0.1,
+                type=Transaction.Type.BUY,
+                executed_at=now,
+            )
+            for i in range(rows)
+        ],
+    }
+
+
+def measure(serialize, rows: list, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for row in rows:
+            serialize(row)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    rows = get_rows(args.rows)
+    show = {"user": None, "transaction": TRANSACTION_SHOW}
+    default_fields = list(User._default_fields)
+
+    def previous(row, show):
+        # a fresh _hide, the shared default one collects hidden paths too
+        return legacy_to_dict(row, show=list(show or []), _hide=[])
+
+    def previous_without_leak(row, show):
+        User._default_fields[:] = default_fields
+        return previous(row, show)
+
+    print(
+        f"{'model':<14}{'rows':>8}{'plan ms':>12}{'previous ms':>14}"
+        f"{'without leak':>14}"
+    )
+
+    for name, model_rows in rows.items():
+        for row in model_rows[:100]:
+            assert row.to_dict(show=show[name]) == previous_without_leak(
+                row, show[name]
+            )
+
+        timings = [
+            measure(lambda row: serialize(row, show[name]), model_rows, args.repeat)
+            for serialize in (
+                lambda row, show: row.to_dict(show=show),
+                previous,
+                previous_without_leak,
+            )
+        ]
+        User._default_fields[:] = default_fields
+
+        print(
+            f"{name:<14}{len(model_rows):>8}"
+            + "".join(
+                f"{timing * 1000:>{width}.1f}"
+                for timing, width in zip(timings, (12, 14, 14))
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
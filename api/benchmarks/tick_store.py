@@ -0,0 +1,179 @@
+"""Tick history in the tick store against rows in a SQLite table.
+
+Appends the same simulated ticks, in feed-sized batches, to a TickStore and
+to a SQLite table shaped as price ticks were once stored, (ticker_id,
+timestamp, price, volume) indexed on (ticker_id, timestamp). Then reads the
+same random time windows from both, the store's as views of its files.
+Finally replays a batch out of order, which the store must still read in
+time order, and compacts it back to exactly the ticks first appended.
+
+Usage (from the api directory):
+    python -m benchmarks.tick_store [--ticks 2000000] [--tickers 20]
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+from models.price_feed import PriceSimulator
+from models.tick_store import TickStore
+
+
+def get_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+        if not os.path.islink(os.path.join(root, name))
+    )
+
+
+def run_store(root: str, batches: list, windows: list) -> tuple:
+    store = TickStore(root)
+
+    start = time.perf_counter()
+    for ticks in batches:
+        store.append_ticks(ticks)
+    appended = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total = 0.0
+    for ticker_id, first, last in windows:
+        # summed, so the pages are read as the SQLite rows are
+        total += float(store.read(ticker_id, first, last).price.sum())
+    elapsed = time.perf_counter() - start
+
+    # views of the files, not copies
+    ticks = store.read(*windows[0])
+    assert isinstance(ticks.price, np.memmap) and not ticks.price.flags.owndata
+
+    return store, appended, elapsed, total
+
+
+def run_sqlite(path: str, batches: list, windows: list) -> tuple:
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(
+        "CREATE TABLE price_tick (id INTEGER PRIMARY KEY, ticker_id INTEGER, "
+        "timestamp BIGINT, price FLOAT, volume FLOAT)"
+    )
+    connection.execute(
+        "CREATE INDEX ix_price_tick_ticker_id_timestamp "
+        "ON price_tick (ticker_id, timestamp)"
+    )
+
+    start = time.perf_counter()
+    for ticks in batches:
+        connection.executemany(
+            "INSERT INTO price_tick (ticker_id, timestamp, price, volume) "
+            "VALUES (?, ?, ?, ?)",
+            ticks.tolist(),
+        )
+        connection.commit()
+    appended = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total = 0.0
+    for ticker_id, first, last in windows:
+        rows = connection.execute(
+            "SELECT timestamp, price, volume FROM price_tick "
+            "WHERE ticker_id = ? AND timestamp >= ? AND timestamp < ? "
+            "ORDER BY timestamp",
+            (ticker_id, first, last),
+        ).fetchall()
+        total += float(np.array([row[1] for row in rows]).sum())
+    elapsed = time.perf_counter() - start
+
+    connection.close()
+
+    return appended, elapsed, total
+
+
+def check_compaction(store: TickStore, ticks: np.ndarray, replayed: np.ndarray):
+    ticker_id = int(replayed["ticker_id"][0])
+    expected = ticks[ticks["ticker_id"] == ticker_id]
+
+    store.append_ticks(replayed)
+    assert not store.is_sorted(ticker_id)
+    unsorted = store.read(ticker_id)
+    assert (np.diff(unsorted.timestamp) >= 0).all()
+
+    start = time.perf_counter()
+    removed = store.compact(ticker_id)
+    elapsed = time.perf_counter() - start
+
+    compacted = store.read(ticker_id)
+    assert store.is_sorted(ticker_id)
+    assert removed == len(replayed)
+    assert (compacted.timestamp == expected["timestamp"]).all()
+    assert (compacted.price == expected["price"]).all()
+    assert (compacted.volume == expected["volume"]).all()
+
+    return elapsed, len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=2000000)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--windows", type=int, default=500)
+    parser.add_argument("--window", type=float, default=60, help="seconds")
+    args = parser.parse_args()
+
+    ticker_ids = list(range(1, args.tickers + 1))
+    batches = list(
+        PriceSimulator(ticker_ids, seed=5).ticks(args.ticks, args.batch_size)
+    )
+    ticks = np.concatenate(batches)
+
+    rng = random.Random(5)
+    first, last = int(ticks["timestamp"][0]), int(ticks["timestamp"][-1])
+    window = int(args.window * 1e9)
+    windows = []
+    for _ in range(args.windows):
+        start = rng.randrange(first, max(first + 1, last - window))
+        windows.append((rng.choice(ticker_ids), start, start + window))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, "ticks")
+        store, store_appended, store_read, store_total = run_store(
+            root, batches, windows
+        )
+        store_size = get_size(root)
+        path = os.path.join(tmp_dir, "ticks.sqlite3")
+        sqlite_appended, sqlite_read, sqlite_total = run_sqlite(path, batches, windows)
+        sqlite_size = get_size(path)
+        assert store_total == sqlite_total
+
+        # the second batch of the first ticker again, behind the whole run
+        replayed = batches[1][batches[1]["ticker_id"] == ticker_ids[0]]
+        compacted, compacted_ticks = check_compaction(store, ticks, replayed)
+
+    print(
+        f"{len(ticks)} ticks of {args.tickers} tickers, "
+        f"{args.windows} reads of {datetime.timedelta(seconds=args.window)}"
+    )
+    print(f"{'store':>8}{'append/s':>12}{'reads/s':>10}{'MB':>8}{'B/tick':>8}")
+    for name, appended, read, size in (
+        ("tick", store_appended, store_read, store_size),
+        ("sqlite", sqlite_appended, sqlite_read, sqlite_size),
+    ):
+        print(
+            f"{name:>8}{len(ticks) / appended:>12.0f}"
+            f"{args.windows / read:>10.0f}{size / 1e6:>8.1f}"
+            f"{size / len(ticks):>8.1f}"
+        )
+    print(f"compacted {compacted_ticks} ticks in {compacted * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
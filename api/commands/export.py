@@ -0,0 +1,77 @@
+"""Export transactions or cumulative ticker holdings as Parquet or Arrow.
+
+Usage (from the api directory):
+    python -m commands.export transactions transactions.parquet --account 1
+    python -m commands.export cumulative_ticker_holdings holdings.arrow
+
+The format follows the file extension unless --format is given. Rows are
+read and written in batches, so memory does not grow with the table.
+"""
+import argparse
+
+from models.cumulative_ticker_holding import CumulativeTickerHoldingFilter
+from models.export import (
+    CUMULATIVE_TICKER_HOLDING_EXPORT_COLUMNS,
+    EXPORT_BATCH_SIZE,
+    EXPORT_MEDIA_TYPES,
+    TRANSACTION_EXPORT_COLUMNS,
+    filter_transactions,
+    select_cumulative_ticker_holding_export,
+    select_transaction_export,
+    write_export,
+)
+from settings.database import SessionLocal
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("table", choices=("transactions", "cumulative_ticker_holdings"))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=EXPORT_MEDIA_TYPES, default=None)
+    parser.add_argument("--account", type=int, default=None, dest="account_id")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--executed-by", type=int, default=None, help="transactions")
+    parser.add_argument("--type", default=None, help="transactions")
+    parser.add_argument("--ticker-code", default=None, help="holdings")
+    parser.add_argument("--market-code", default=None, help="holdings")
+    parser.add_argument(
+        "--completed",
+        default=None,
+        action=argparse.BooleanOptionalAction,
+        help="holdings",
+    )
+    args = parser.parse_args()
+
+    format = args.format
+    if format is None:
+        format = "arrow" if args.path.endswith((".arrow", ".arrows")) else "parquet"
+
+    if args.table == "transactions":
+        columns = TRANSACTION_EXPORT_COLUMNS
+        query = filter_transactions(
+            select_transaction_export(),
+            investment_account=args.account_id,
+            executed_by=args.executed_by,
+            type=args.type,
+        )
+    else:
+        columns = CUMULATIVE_TICKER_HOLDING_EXPORT_COLUMNS
+        query = select_cumulative_ticker_holding_export(
+            CumulativeTickerHoldingFilter(
+                investment_account_id=args.account_id,
+                ticker_code=args.ticker_code,
+                market_code=args.market_code,
+                is_completed=args.completed,
+            )
+        )
+
+    with SessionLocal() as session, open(args.path, "wb") as file:
+        rows = write_export(
+            session, query, columns, file, format=format, batch_size=args.batch_size
+        )
+
+    print(f"Exported {rows} rows to {args.path} ({format})")
+
+
+if __name__ == "__main__":
+    main()
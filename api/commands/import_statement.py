@@ -0,0 +1,63 @@
+"""Import a broker statement CSV into an investment account.
+
+Usage (from the api directory):
+    python -m commands.import_statement statement.csv --account 1
+
+Re-running the same command resumes an interrupted import.
+"""
+import argparse
+import os
+
+import models
+from models.statement_import import (
+    STATEMENT_CHUNK_SIZE,
+    STATEMENT_COLUMNS,
+    import_statement,
+)
+from settings.database import SessionLocal, engine
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        epilog=f"CSV columns: {', '.join(STATEMENT_COLUMNS)}",
+    )
+    parser.add_argument("path")
+    parser.add_argument("--account", type=int, required=True, dest="account_id")
+    parser.add_argument(
+        "--executed-by", type=int, default=None, help="defaults to the account owner"
+    )
+    parser.add_argument("--chunk-size", type=int, default=STATEMENT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+
+    with SessionLocal() as session, open(args.path, "rb") as file:
+        statement_import = None
+
+        try:
+            for statement_import, errors in import_statement(
+                session,
+                file,
+                args.account_id,
+                executed_by_id=args.executed_by,
+                filename=os.path.basename(args.path),
+                chunk_size=args.chunk_size,
+            ):
+                for error in errors:
+                    print(f"row {error['index']}: {error['detail']}")
+                print(f"{statement_import.committed_rows} rows committed")
+        except ValueError as e:
+            parser.error(str(e))
+
+        if statement_import is None:
+            print("Statement was already imported")
+        else:
+            print(
+                f"Imported {statement_import.committed_rows} rows "
+                f"with {statement_import.error_count} errors"
+            )
+
+
+if __name__ == "__main__":
+    main()
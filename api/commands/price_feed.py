@@ -0,0 +1,93 @@
+"""Listen to a UDP price feed, or replay simulated ticks to one.
+
+Usage (from the api directory):
+    python -m commands.price_feed serve [--port 9999]
+    python -m commands.price_feed simulate --tickers 1,2,3 --count 100000
+
+serve keeps the latest ticks per ticker in memory and appends every tick to
+the tick store in batches. simulate sends a seeded random walk, the same ticks
+for the same arguments, as packets of encoded ticks.
+"""
+import argparse
+import asyncio
+import socket
+import time
+
+import models
+from models.price_feed import (
+    PRICE_FEED_HOST,
+    PRICE_FEED_PORT,
+    PRICE_PACKET_SIZE,
+    PRICE_PERSIST_INTERVAL,
+    PriceSimulator,
+    price_feed,
+    serve_price_feed,
+)
+from settings.database import engine
+
+
+def serve(args):
+    models.Base.metadata.create_all(bind=engine)
+    print(f"Listening on udp://{args.host}:{args.port}")
+
+    try:
+        asyncio.run(serve_price_feed(price_feed, args.host, args.port, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+    stats = price_feed.get_stats()
+    print(f"Received {stats['ticks']} ticks, persisted {stats['persisted']}")
+
+
+def simulate(args):
+    simulator = PriceSimulator(
+        [int(ticker_id) for ticker_id in args.tickers.split(",")], seed=args.seed
+    )
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.perf_counter()
+    sent = 0
+
+    for packet in simulator.packets(args.count, args.packet_size):
+        sender.sendto(packet, (args.host, args.port))
+        sent += args.packet_size
+
+        if args.rate:
+            # paced per packet, sleeping whenever ahead of the rate
+            ahead = min(sent, args.count) / args.rate - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    elapsed = time.perf_counter() - start
+    print(f"Sent {args.count} ticks in {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(required=True)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--host", default=PRICE_FEED_HOST)
+    serve_parser.add_argument("--port", type=int, default=PRICE_FEED_PORT)
+    serve_parser.add_argument(
+        "--interval", type=float, default=PRICE_PERSIST_INTERVAL, help="seconds"
+    )
+    serve_parser.set_defaults(command=serve)
+
+    simulate_parser = subparsers.add_parser("simulate")
+    simulate_parser.add_argument("--tickers", required=True, help="ticker ids")
+    simulate_parser.add_argument("--count", type=int, default=100000)
+    simulate_parser.add_argument("--seed", type=int, default=0)
+    simulate_parser.add_argument(
+        "--rate", type=float, default=0, help="ticks per second, 0 for no limit"
+    )
+    simulate_parser.add_argument("--packet-size", type=int, default=PRICE_PACKET_SIZE)
+    simulate_parser.add_argument("--host", default=PRICE_FEED_HOST)
+    simulate_parser.add_argument("--port", type=int, default=PRICE_FEED_PORT)
+    simulate_parser.set_defaults(command=simulate)
+
+    args = parser.parse_args()
+    args.command(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compact the tick store, or show what it holds.
+
+Usage (from the api directory):
+    python -m commands.tick_store compact [--tickers 1,2,3] [--unsorted]
+    python -m commands.tick_store show [--tickers 1,2,3]
+
+compact rewrites every given ticker, or every ticker held, in time order
+without repeated ticks and rebuilds its index. With --unsorted only the
+tickers given ticks out of order are rewritten. Run it while the feed is
+quiet; appends to a ticker wait for its compaction.
+"""
+import argparse
+import time
+
+from models.tick_store import TICK_STORE_DIR, TickStore, get_datetime
+
+
+def get_ticker_ids(store: TickStore, args) -> list:
+    if args.tickers:
+        return [int(ticker_id) for ticker_id in args.tickers.split(",")]
+
+    return store.ticker_ids()
+
+
+def compact(store: TickStore, args):
+    for ticker_id in get_ticker_ids(store, args):
+        if args.unsorted and store.is_sorted(ticker_id):
+            continue
+
+        start = time.perf_counter()
+        removed = store.compact(ticker_id)
+        elapsed = time.perf_counter() - start
+        print(f"Compacted {ticker_id} in {elapsed:.2f}s, removed {removed} ticks")
+
+
+def show(store: TickStore, args):
+    for ticker_id in get_ticker_ids(store, args):
+        ticks = store.read(ticker_id)
+
+        if not len(ticks.timestamp):
+            print(f"{ticker_id}: no ticks")
+            continue
+
+        print(
+            f"{ticker_id}: {len(ticks.timestamp)} ticks from "
+            f"{get_datetime(int(ticks.timestamp.min()))} to "
+            f"{get_datetime(int(ticks.timestamp.max()))}"
+            f"{'' if store.is_sorted(ticker_id) else ', unsorted'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", default=TICK_STORE_DIR)
+    subparsers = parser.add_subparsers(required=True)
+
+    compact_parser = subparsers.add_parser("compact")
+    compact_parser.add_argument("--tickers", help="ticker ids, all if not given")
+    compact_parser.add_argument("--unsorted", action="store_true")
+    compact_parser.set_defaults(command=compact)
+
+    show_parser = subparsers.add_parser("show")
+    show_parser.add_argument("--tickers", help="ticker ids, all if not given")
+    show_parser.set_defaults(command=show)
+
+    args = parser.parse_args()
+    args.command(TickStore(args.root), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,37 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import models
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from models.ledger_queue import ledger_queue
+from models.pagination import InvalidCursor
+from models.price_feed import persist_periodically, price_feed
 from routers import auth, common, journal
 from settings.database import engine
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    persist_prices = asyncio.create_task(persist_periodically(price_feed))
+    yield
+    persist_prices.cancel()
+    # trades and ticks accepted by this process, and the candles open, are
+    # written before it exits
+    await run_in_threadpool(ledger_queue.stop)
+    await run_in_threadpool(price_feed.flush, include_open=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)}
+    )
 
 
 # TODO: move these to env vars
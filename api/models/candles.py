@@ -0,0 +1,415 @@
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from models import Base
+from models.journal import Transaction
+from sqlalchemy import (
+    BigInteger,
+    Enum,
+    ForeignKey,
+    Select,
+    UniqueConstraint,
+    func,
+    insert,
+    select,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+# closed candles kept in memory per ticker and time frame
+CANDLE_MEMORY_SIZE = int(os.environ.get("CANDLE_MEMORY_SIZE", 500))
+
+TIME_FRAMES = tuple(Transaction.TimeFrame)
+# shorter runs of ticks are cheaper one tick at a time than as arrays
+CANDLE_ARRAY_MIN_TICKS = 64
+
+SECOND = 1_000_000_000
+DAY = 86400 * SECOND
+
+# time frames of a fixed length, as (length, offset of the first bucket from
+# the epoch) in nanoseconds; the epoch is a Thursday, weeks start on Monday
+FIXED_TIME_FRAMES = {
+    Transaction.TimeFrame.MIN_1: (60 * SECOND, 0),
+    Transaction.TimeFrame.MIN_5: (300 * SECOND, 0),
+    Transaction.TimeFrame.MIN_15: (900 * SECOND, 0),
+    Transaction.TimeFrame.MIN_30: (1800 * SECOND, 0),
+    Transaction.TimeFrame.HOUR_1: (3600 * SECOND, 0),
+    Transaction.TimeFrame.HOUR_4: (4 * 3600 * SECOND, 0),
+    Transaction.TimeFrame.HOUR_6: (6 * 3600 * SECOND, 0),
+    Transaction.TimeFrame.HOUR_12: (12 * 3600 * SECOND, 0),
+    Transaction.TimeFrame.DAILY: (DAY, 0),
+    Transaction.TimeFrame.WEEKLY: (7 * DAY, 4 * DAY),
+}
+# calendar time frames, in months
+MONTH_TIME_FRAMES = {
+    Transaction.TimeFrame.MONTHLY: 1,
+    Transaction.TimeFrame.QUARTERLY: 3,
+    Transaction.TimeFrame.YEARLY: 12,
+}
+
+
+def get_bucket_bounds(time_frame: Transaction.TimeFrame, timestamp: int) -> Tuple:
+    """Start and end, in nanoseconds, of the candle timestamp falls in."""
+
+    if time_frame in FIXED_TIME_FRAMES:
+        length, offset = FIXED_TIME_FRAMES[time_frame]
+        start = (timestamp - offset) // length * length + offset
+        return start, start + length
+
+    months = MONTH_TIME_FRAMES[time_frame]
+    month = int(np.datetime64(timestamp, "ns").astype("datetime64[M]").astype(np.int64))
+    first = month // months * months
+
+    return (
+        int(np.datetime64(first, "M").astype("datetime64[ns]").astype(np.int64)),
+        int(
+            np.datetime64(first + months, "M").astype("datetime64[ns]").astype(np.int64)
+        ),
+    )
+
+
+def get_bucket_starts(
+    time_frame: Transaction.TimeFrame, timestamps: np.ndarray
+) -> np.ndarray:
+    """get_bucket_bounds starts for an array of timestamps."""
+
+    if time_frame in FIXED_TIME_FRAMES:
+        length, offset = FIXED_TIME_FRAMES[time_frame]
+        return (timestamps - offset) // length * length + offset
+
+    months = MONTH_TIME_FRAMES[time_frame]
+    month = timestamps.astype("datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+
+    return (
+        (month // months * months)
+        .astype("datetime64[M]")
+        .astype("datetime64[ns]")
+        .astype(np.int64)
+    )
+
+
+class Candle(Base):
+    __tablename__ = "candle"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    ticker_id: Mapped[int] = mapped_column(ForeignKey("ticker.id"))
+    time_frame: Mapped[Transaction.TimeFrame] = mapped_column(
+        Enum(Transaction.TimeFrame)
+    )
+    # nanoseconds since the epoch, as tick store timestamps
+    start: Mapped[int] = mapped_column(BigInteger)
+    open: Mapped[float] = mapped_column()
+    high: Mapped[float] = mapped_column()
+    low: Mapped[float] = mapped_column()
+    close: Mapped[float] = mapped_column()
+    volume: Mapped[float] = mapped_column()
+    tick_count: Mapped[int] = mapped_column()
+
+    __table_args__ = (
+        UniqueConstraint(
+            "ticker_id",
+            "time_frame",
+            "start",
+            name="_candle__ticker_time_frame_start_uc",
+        ),
+    )
+
+
+class CandleBar(NamedTuple):
+    ticker_id: int
+    time_frame: Transaction.TimeFrame
+    start: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    tick_count: int
+    is_closed: bool = True
+
+
+# the open bar of a ticker and time frame, a list as it changes on every tick
+START, END, OPEN, HIGH, LOW, CLOSE, VOLUME, TICK_COUNT = range(8)
+
+
+class CandleBook:
+    """Open and recently closed candles of every time frame, per ticker.
+
+    Every tick updates the open candle of each time frame in place. A tick
+    past the end of a candle closes it, and closed candles wait in pending
+    until they are written. Ticks are expected in time order per ticker; a
+    tick before the open candle of a time frame is dropped for it.
+
+    The open candles are written when the book is done with, see take_open.
+    A later tick of one of them, in another process, opens a candle with
+    only the ticks from then on, which persist_candles merges into the
+    written one.
+    """
+
+    def __init__(self, memory_size: int = CANDLE_MEMORY_SIZE):
+        self.memory_size = memory_size
+        self._open: Dict[int, List[Optional[list]]] = {}
+        self._closed: Dict[Tuple[int, Transaction.TimeFrame], Deque[CandleBar]] = {}
+        self._pending: List[CandleBar] = []
+        self._lock = threading.Lock()
+        self.closed = 0
+        self.late_ticks = 0
+
+    @staticmethod
+    def _get_candle(
+        ticker_id: int, time_frame, bar: list, is_closed: bool = True
+    ) -> CandleBar:
+        return CandleBar(
+            ticker_id,
+            time_frame,
+            bar[START],
+            bar[OPEN],
+            bar[HIGH],
+            bar[LOW],
+            bar[CLOSE],
+            bar[VOLUME],
+            bar[TICK_COUNT],
+            is_closed,
+        )
+
+    def _close(self, ticker_id: int, time_frame, bar: list):
+        candle = self._get_candle(ticker_id, time_frame, bar)
+        closed = self._closed.get((ticker_id, time_frame))
+
+        if closed is None:
+            closed = self._closed[(ticker_id, time_frame)] = deque(
+                maxlen=self.memory_size
+            )
+
+        closed.append(candle)
+        self._pending.append(candle)
+        self.closed += 1
+
+    def update(self, ticker_id: int, timestamp: int, price: float, volume: float):
+        """Apply one tick to every time frame, O(1) unless candles close."""
+
+        with self._lock:
+            bars = self._open.get(ticker_id)
+
+            if bars is None:
+                bars = self._open[ticker_id] = [None] * len(TIME_FRAMES)
+
+            for i, bar in enumerate(bars):
+                if bar is not None and bar[START] <= timestamp < bar[END]:
+                    if price > bar[HIGH]:
+                        bar[HIGH] = price
+                    elif price < bar[LOW]:
+                        bar[LOW] = price
+                    bar[CLOSE] = price
+                    bar[VOLUME] += volume
+                    bar[TICK_COUNT] += 1
+                    continue
+
+                if bar is not None:
+                    if timestamp < bar[START]:
+                        self.late_ticks += 1
+                        continue
+
+                    self._close(ticker_id, TIME_FRAMES[i], bar)
+
+                start, end = get_bucket_bounds(TIME_FRAMES[i], timestamp)
+                bars[i] = [start, end, price, price, price, price, volume, 1]
+
+    def update_ticks(
+        self,
+        ticker_ids: np.ndarray,
+        timestamps: np.ndarray,
+        prices: np.ndarray,
+        volumes: np.ndarray,
+    ):
+        """update for a run of ticks grouped by ticker, in time order each.
+
+        Every time frame takes a few array operations for the whole run,
+        then one step per candle the run touches.
+        """
+
+        count = len(timestamps)
+
+        if count < CANDLE_ARRAY_MIN_TICKS:
+            for tick in zip(
+                ticker_ids.tolist(),
+                timestamps.tolist(),
+                prices.tolist(),
+                volumes.tolist(),
+            ):
+                self.update(*tick)
+            return
+
+        is_new_ticker = np.empty(count, dtype=bool)
+        is_new_ticker[0] = True
+        np.not_equal(ticker_ids[1:], ticker_ids[:-1], out=is_new_ticker[1:])
+
+        with self._lock:
+            for i, time_frame in enumerate(TIME_FRAMES):
+                starts = get_bucket_starts(time_frame, timestamps)
+                is_new = is_new_ticker.copy()
+                is_new[1:] |= starts[1:] != starts[:-1]
+                firsts = np.flatnonzero(is_new)
+                lasts = np.append(firsts[1:], count) - 1
+
+                for ticker_id, start, open, high, low, close, volume, tick_count in zip(
+                    ticker_ids[firsts].tolist(),
+                    starts[firsts].tolist(),
+                    prices[firsts].tolist(),
+                    np.maximum.reduceat(prices, firsts).tolist(),
+                    np.minimum.reduceat(prices, firsts).tolist(),
+                    prices[lasts].tolist(),
+                    np.add.reduceat(volumes, firsts).tolist(),
+                    (lasts - firsts + 1).tolist(),
+                ):
+                    bars = self._open.get(ticker_id)
+
+                    if bars is None:
+                        bars = self._open[ticker_id] = [None] * len(TIME_FRAMES)
+
+                    bar = bars[i]
+
+                    if bar is not None and bar[START] == start:
+                        bar[HIGH] = max(bar[HIGH], high)
+                        bar[LOW] = min(bar[LOW], low)
+                        bar[CLOSE] = close
+                        bar[VOLUME] += volume
+                        bar[TICK_COUNT] += tick_count
+                        continue
+
+                    if bar is not None:
+                        if start < bar[START]:
+                            self.late_ticks += tick_count
+                            continue
+
+                        self._close(ticker_id, time_frame, bar)
+
+                    _, end = get_bucket_bounds(time_frame, start)
+                    bars[i] = [start, end, open, high, low, close, volume, tick_count]
+
+    def get_candles(
+        self, ticker_id: int, time_frame: Transaction.TimeFrame
+    ) -> List[CandleBar]:
+        """Candles held in memory oldest first, the open one last."""
+
+        with self._lock:
+            candles = list(self._closed.get((ticker_id, time_frame), ()))
+            bars = self._open.get(ticker_id)
+            bar = bars and bars[TIME_FRAMES.index(time_frame)]
+
+            if bar is not None:
+                candles.append(
+                    self._get_candle(ticker_id, time_frame, bar, is_closed=False)
+                )
+
+        return candles
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def take_pending(self) -> List[CandleBar]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        return pending
+
+    def restore_pending(self, candles: List[CandleBar]):
+        """Put back candles taken but not written, ahead of newer ones."""
+
+        with self._lock:
+            self._pending[:0] = candles
+
+    def take_open(self) -> List[CandleBar]:
+        """Take the open candles out of the book, to be written before it
+        goes away.
+
+        Each tick is in one taken candle only: a later tick of a taken
+        candle opens it again with just the ticks from then on.
+        """
+
+        candles = []
+
+        with self._lock:
+            for ticker_id, bars in self._open.items():
+                for i, bar in enumerate(bars):
+                    if bar is not None:
+                        candles.append(
+                            self._get_candle(
+                                ticker_id, TIME_FRAMES[i], bar, is_closed=False
+                            )
+                        )
+                        bars[i] = None
+
+        return candles
+
+    def get_stats(self) -> dict:
+        return {
+            "tickers": len(self._open),
+            "memory_size": self.memory_size,
+            "closed": self.closed,
+            "pending": len(self._pending),
+            "late_ticks": self.late_ticks,
+        }
+
+
+def persist_candles(session: Session, candles: List[CandleBar]):
+    """Write candles, merged into one stored by another process or taken
+    open before a restart."""
+
+    if not candles:
+        return
+
+    rows = [candle._asdict() for candle in candles]
+    for row in rows:
+        del row["is_closed"]
+
+    dialect = session.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        statement, greatest, least = sqlite_insert(Candle), func.max, func.min
+    elif dialect == "postgresql":
+        statement, greatest, least = (
+            postgresql_insert(Candle),
+            func.greatest,
+            func.least,
+        )
+    else:
+        session.execute(insert(Candle), rows)
+        return
+
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["ticker_id", "time_frame", "start"],
+            set_={
+                "high": greatest(Candle.high, statement.excluded.high),
+                "low": least(Candle.low, statement.excluded.low),
+                "close": statement.excluded.close,
+                "volume": Candle.volume + statement.excluded.volume,
+                "tick_count": Candle.tick_count + statement.excluded.tick_count,
+            },
+        ),
+        rows,
+    )
+
+
+def select_candles(
+    ticker_id: int,
+    time_frame: Transaction.TimeFrame,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Select:
+    query = select(Candle).where(
+        Candle.ticker_id == ticker_id, Candle.time_frame == time_frame
+    )
+
+    if start is not None:
+        query = query.where(Candle.start >= start)
+    if end is not None:
+        query = query.where(Candle.start < end)
+
+    return query
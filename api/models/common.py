@@ -4,11 +4,28 @@ import platform
 from typing import Optional
 
 from models import Base
+from models.portfolio_snapshot import LiquidAssetSnapshot
+from models.tick_store import TickColumns, TickStore, get_timestamp, tick_store
 from models.user import InvestmentAccount, User
-from settings.database import TimeStampedBase
-from sqlalchemy import Enum, ForeignKey, String, UniqueConstraint, desc
+from settings.database import TimeStampedBase, get_or_create
+from sqlalchemy import (
+    Enum,
+    ForeignKey,
+    Index,
+    String,
+    UniqueConstraint,
+    desc,
+    event,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
 
+DEFAULT_LIQUID_ASSET_ACCOUNT_IDS = "default_liquid_asset_account_ids"
+
 
 class Currency(Base):
     __tablename__ = "currency"
@@ -60,6 +77,19 @@ class Ticker(Base):
         UniqueConstraint("code", "market_id", name="_ticker__code_market_uc"),
     )
 
+    def get_ticks(
+        self,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        store: TickStore = tick_store,
+    ) -> TickColumns:
+        """Price history in [start, end) from the tick store, as views of
+        its files; the database is not queried."""
+
+        return store.read(
+            self.id, start and get_timestamp(start), end and get_timestamp(end)
+        )
+
 
 class LiquidAssetAccount(TimeStampedBase):
     __tablename__ = "liquid_asset_account"
@@ -75,7 +105,9 @@ class LiquidAssetAccount(TimeStampedBase):
     currency: Mapped["Currency"] = relationship()
     owner_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     owner: Mapped["User"] = relationship()
+    version_id: Mapped[int] = mapped_column(default=1)
 
+    __mapper_args__ = {"version_id_col": version_id}
     __table_args__ = (
         UniqueConstraint(
             "title",
@@ -84,8 +116,83 @@ class LiquidAssetAccount(TimeStampedBase):
             "platform_id",
             name="_liquid_asset__title_currency_owner_platform_uc",
         ),
+        # NULL titles never collide in the constraint above, the default
+        # account needs its own uniqueness for upserts to conflict on
+        Index(
+            "_liquid_asset__default_currency_owner_platform_uc",
+            "currency_id",
+            "owner_id",
+            "platform_id",
+            unique=True,
+            sqlite_where=text("title IS NULL"),
+            postgresql_where=text("title IS NULL"),
+        ),
     )
 
+    @classmethod
+    def get_default_id(
+        cls, session: Session, currency_id: int, owner_id: int, platform_id: int
+    ) -> int:
+        """Id of the default account, created if missing. Cached per session."""
+
+        cached_ids = session.info.setdefault(DEFAULT_LIQUID_ASSET_ACCOUNT_IDS, {})
+        key = (currency_id, owner_id, platform_id)
+
+        if key in cached_ids:
+            return cached_ids[key]
+
+        values = dict(
+            title=None,
+            currency_id=currency_id,
+            owner_id=owner_id,
+            platform_id=platform_id,
+        )
+        liquid_asset_account_id = session.scalar(select(cls.id).filter_by(**values))
+
+        if liquid_asset_account_id is None:
+            liquid_asset_account_id = cls._insert_default(session, values)
+
+        cached_ids[key] = liquid_asset_account_id
+
+        return liquid_asset_account_id
+
+    @classmethod
+    def _insert_default(cls, session: Session, values: dict) -> int:
+        insert = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}.get(
+            session.get_bind().dialect.name
+        )
+
+        if insert is None:
+            return get_or_create(session, cls, **values)[0].id
+
+        liquid_asset_account_id = session.scalar(
+            insert(cls)
+            .values(**values)
+            .on_conflict_do_nothing(
+                index_elements=["currency_id", "owner_id", "platform_id"],
+                index_where=cls.title.is_(None),
+            )
+            .returning(cls.id)
+        )
+
+        if liquid_asset_account_id is None:
+            # created concurrently since the lookup
+            liquid_asset_account_id = session.scalar(select(cls.id).filter_by(**values))
+
+        return liquid_asset_account_id
+
+    @classmethod
+    def add_to_balance(
+        cls, session: Session, liquid_asset_account_id: int, amount: float
+    ) -> None:
+        # a single UPDATE, so concurrent trades can not overwrite each other;
+        # the version moves too, so a stale loaded account can not either
+        session.execute(
+            update(cls)
+            .where(cls.id == liquid_asset_account_id)
+            .values(balance=cls.balance + amount, version_id=cls.version_id + 1)
+        )
+
     def add_transaction(
         self, session: Session, transaction: "LiquidAssetTransaction"
     ) -> bool:
@@ -106,6 +213,17 @@ class LiquidAssetAccount(TimeStampedBase):
         else:
             raise ValueError(f"Invalid transaction type: {transaction.type}")
 
+        LiquidAssetSnapshot.record(
+            session,
+            self.id,
+            transaction.executed_at.date(),
+            (
+                -transaction.amount
+                if transaction.type == LiquidAssetTransaction.Type.WITHDRAW
+                else transaction.amount
+            ),
+        )
+
         session.flush()
 
         return True
@@ -132,3 +250,9 @@ class LiquidAssetTransaction(Base):
     description: Mapped[Optional[str]] = mapped_column(
         String, default=None, nullable=True
     )
+
+
+@event.listens_for(Session, "after_rollback")
+def clear_default_liquid_asset_account_ids(session: Session):
+    # accounts inserted by the rolled back transaction are gone
+    session.info.pop(DEFAULT_LIQUID_ASSET_ACCOUNT_IDS, None)
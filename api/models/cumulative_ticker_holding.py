@@ -1,16 +1,32 @@
 import datetime
 import enum
 from functools import cached_property
-from typing import Callable, List, Optional
+from operator import attrgetter
+from typing import Callable, List, Optional, Tuple, Type, Union
 
 import ipdb
 from models import Base, TimeStampedBase
 from models.common import LiquidAssetAccount, Market, Platform, Ticker
 from models.journal import Transaction
+from models.pagination import SortKey, fetch_page, get_loader_options, get_sort_keys
+from models.portfolio_snapshot import LiquidAssetSnapshot, PortfolioSnapshot
 from models.user import InvestmentAccount, User
 from pydantic import BaseModel
 from settings.database import SessionLocal, get_db, get_or_create
-from sqlalchemy import Enum, ForeignKey, String
+from sqlalchemy import (
+    ColumnElement,
+    Enum,
+    ForeignKey,
+    Index,
+    String,
+    case,
+    func,
+    literal_column,
+    null,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
 
@@ -44,6 +60,22 @@ class CumulativeTickerHolding(TimeStampedBase):
     transactions: Mapped[List["Transaction"]] = relationship(
         back_populates="cumulative_ticker_holding"
     )
+    # checked on every update, so concurrent trades on one position conflict
+    # instead of overwriting each other
+    version_id: Mapped[int] = mapped_column(default=1)
+
+    __mapper_args__ = {"version_id_col": version_id}
+    __table_args__ = (
+        # a trade either extends the open holding or opens the only one
+        Index(
+            "_cumulative_ticker_holding__open_account_ticker_uc",
+            "investment_account_id",
+            "ticker_id",
+            unique=True,
+            sqlite_where=text("NOT is_completed"),
+            postgresql_where=text("NOT is_completed"),
+        ),
+    )
 
     @cached_property
     def adjusted_avg_cost(self) -> Optional[float]:
@@ -53,6 +85,10 @@ class CumulativeTickerHolding(TimeStampedBase):
             else None
         )
 
+    @property
+    def cost_basis(self) -> float:
+        return 0 if self.is_completed else self.avg_cost * self.count
+
     @hybrid_property
     def pnl_amount(self) -> Optional[float]:
         return (
@@ -65,6 +101,19 @@ class CumulativeTickerHolding(TimeStampedBase):
             else None
         )
 
+    @pnl_amount.inplace.expression
+    @classmethod
+    def _pnl_amount_expression(cls) -> ColumnElement[Optional[float]]:
+        return case(
+            (
+                cls.is_completed,
+                cls.total_sell_amount
+                - cls.total_buy_amount
+                - cls.total_commission_cost,
+            ),
+            else_=null(),
+        )
+
     @hybrid_property
     def pnl_ratio(self) -> Optional[float]:
         return (
@@ -73,48 +122,69 @@ class CumulativeTickerHolding(TimeStampedBase):
             else None
         )
 
-    def add_transaction(self, session: Session, transaction: Transaction) -> bool:
+    @pnl_ratio.inplace.expression
+    @classmethod
+    def _pnl_ratio_expression(cls) -> ColumnElement[Optional[float]]:
+        # NULL for open holdings through pnl_amount
+        return cls.pnl_amount / func.nullif(
+            cls.total_buy_amount + cls.total_commission_cost,
+            # inlined, a bound 0 would not match the index expression
+            literal_column("0"),
+        )
+
+    def __init__(self, **kwargs):
+        # column defaults are only applied on flush, but holdings built by the
+        # bulk paths are updated in memory before they are inserted
+        for key in (
+            "avg_cost",
+            "count",
+            "total_buys",
+            "total_sells",
+            "total_commission_cost",
+            "total_buy_amount",
+            "total_sell_amount",
+        ):
+            kwargs.setdefault(key, 0)
+        kwargs.setdefault("is_completed", False)
+
+        super().__init__(**kwargs)
+
+    def apply_transaction(self, transaction: Transaction) -> Optional[float]:
+        """Apply a trade to the holding in memory.
+
+        Returns the change it causes on the liquid asset account balance, or
+        None if the trade does not belong to this holding or can not be applied.
+        """
+
         if not (
             self.ticker_id == transaction.ticker_id
             and self.investment_account_id == transaction.investment_account_id
         ):
-            return False
-
-        liquid_asset_account, created = get_or_create(
-            session,
-            LiquidAssetAccount,
-            title=None,
-            currency_id=self.ticker.market.currency_id,
-            owner_id=self.investment_account.owner_id,
-            platform_id=transaction.platform_id,
-        )
-        session.flush()
+            return None
 
         if transaction.type == Transaction.Type.BUY:
             self.avg_cost = (
                 self.total_buys * self.avg_cost + transaction.price * transaction.count
             ) / (self.total_buys + transaction.count)
 
-            # update liquid asset account balance
-            liquid_asset_account.balance -= transaction.price * transaction.count
-            liquid_asset_account.balance -= transaction.commission
+            balance_delta = -transaction.price * transaction.count
 
             # do following updates at the end
             self.count += transaction.count
             self.total_buys += transaction.count
             self.total_buy_amount += transaction.price * transaction.count
 
-            self.first_transaction_at = min(
-                self.first_transaction_at, transaction.executed_at
+            self.first_transaction_at = (
+                min(self.first_transaction_at, transaction.executed_at)
+                if self.first_transaction_at is not None
+                else transaction.executed_at
             )
 
         elif transaction.type == Transaction.Type.SELL:
             if transaction.count > self.count:
-                return False
+                return None
 
-            # update liquid asset account balance
-            liquid_asset_account.balance += transaction.price * transaction.count
-            liquid_asset_account.balance -= transaction.commission
+            balance_delta = transaction.price * transaction.count
 
             # do following updates at the end
             self.count -= transaction.count
@@ -133,11 +203,77 @@ class CumulativeTickerHolding(TimeStampedBase):
                     self.last_transaction_at, transaction.executed_at
                 )
 
+        return balance_delta - transaction.commission
+
+    def add_transaction(self, session: Session, transaction: Transaction) -> bool:
+        count, cost_basis = self.count, self.cost_basis
+        balance_delta = self.apply_transaction(transaction)
+
+        if balance_delta is None:
+            return False
+
+        currency_id, owner_id = get_liquid_asset_currency_owner_ids(
+            session, self.ticker_id, self.investment_account_id
+        )
+        liquid_asset_account_id = LiquidAssetAccount.get_default_id(
+            session, currency_id, owner_id, transaction.platform_id
+        )
+
+        # update liquid asset account balance
+        LiquidAssetAccount.add_to_balance(
+            session, liquid_asset_account_id, balance_delta
+        )
+
+        PortfolioSnapshot.record(
+            session,
+            self.investment_account_id,
+            self.ticker_id,
+            transaction.executed_at.date(),
+            self.count - count,
+            self.cost_basis - cost_basis,
+        )
+        LiquidAssetSnapshot.record(
+            session,
+            liquid_asset_account_id,
+            transaction.executed_at.date(),
+            balance_delta,
+        )
+
         session.flush()
 
         return True
 
 
+# expression indexes, used when the same expressions are sorted on
+Index("ix_cumulative_ticker_holding_pnl_amount", CumulativeTickerHolding.pnl_amount)
+Index("ix_cumulative_ticker_holding_pnl_ratio", CumulativeTickerHolding.pnl_ratio)
+
+
+def get_liquid_asset_currency_owner_ids(
+    session: Session, ticker_id: int, investment_account_id: int
+) -> Tuple[int, int]:
+    """Currency and owner of the liquid asset accounts a holding trades against.
+
+    Resolved with one query instead of lazy loading ticker.market and
+    investment_account, and cached per session.
+    """
+
+    cached_ids = session.info.setdefault("liquid_asset_currency_owner_ids", {})
+    key = (ticker_id, investment_account_id)
+
+    if key not in cached_ids:
+        cached_ids[key] = tuple(
+            session.execute(
+                select(Market.currency_id, InvestmentAccount.owner_id)
+                .join_from(Ticker, Ticker.market)
+                .join(InvestmentAccount, InvestmentAccount.id == investment_account_id)
+                .where(Ticker.id == ticker_id)
+            ).one()
+        )
+
+    return cached_ids[key]
+
+
 class CumulativeTickerHoldingFilter(BaseModel):
     ticker_id: Optional[int] = None
     ticker_code: Optional[str] = None
@@ -157,7 +293,7 @@ class CumulativeTickerHoldingOrderingOptions(BaseModel):
 
 
 class CumulativeTickerHoldingRepository:
-    def __init__(self, session: Session):
+    def __init__(self, session: AsyncSession):
         self._session = session
         self._simple_ordering_options = (
             "id",
@@ -173,49 +309,73 @@ class CumulativeTickerHoldingRepository:
             "is_completed",
         )
 
-    def get_all(
+    async def get_all(
         self,
         filter: CumulativeTickerHoldingFilter,
         ordering: CumulativeTickerHoldingOrderingOptions,
-    ) -> List[CumulativeTickerHolding]:
-        query = self._session.query(CumulativeTickerHolding)
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        schema: Optional[Type[BaseModel]] = None,
+    ) -> Union[List[CumulativeTickerHolding], dict]:
+        """Holdings matching filter, with the relationships schema reads loaded."""
+
+        query = select(CumulativeTickerHolding)
 
         for fpk, fpv in filter.model_dump().items():
             if fpv is not None and fpk in self._simple_filters:
-                query = query.filter(getattr(CumulativeTickerHolding, fpk) == fpv)
+                query = query.where(getattr(CumulativeTickerHolding, fpk) == fpv)
+
+        # filters and ordering share a single join of Ticker
+        ticker_conditions = []
 
         if filter.ticker_code is not None:
-            query = query.join(CumulativeTickerHolding.ticker).filter(
-                Ticker.code == filter.ticker_code.upper()
-            )
+            ticker_conditions.append(Ticker.code == filter.ticker_code.upper())
 
         if filter.market_code is not None:
-            market = (
-                self._session.query(Market)
-                .filter(Market.code == filter.market_code.upper())
-                .first()
+            market = await self._session.scalar(
+                select(Market).where(Market.code == filter.market_code.upper()).limit(1)
             )
 
             if market is not None:
-                query = query.join(CumulativeTickerHolding.ticker).filter(
-                    Ticker.market_id == market.id
-                )
+                ticker_conditions.append(Ticker.market_id == market.id)
 
-        orders = []
+        ordering_dict = {
+            opk: opv
+            for opk, opv in ordering.model_dump().items()
+            if opv is not None
+            and (opk == "ticker_code" or opk in self._simple_ordering_options)
+        }
 
-        if ordering.ticker_code is not None:
-            orders.append(ordering.ticker_code(Ticker.code))
-            query = query.join(CumulativeTickerHolding.ticker)
+        joined = []
 
-        orders.extend(
-            [
-                opv(getattr(CumulativeTickerHolding, opk))
-                for opk, opv in ordering.model_dump().items()
-                if opv is not None and opk in self._simple_ordering_options
-            ]
-        )
+        if ticker_conditions or "ticker_code" in ordering_dict:
+            query = query.join(CumulativeTickerHolding.ticker).where(*ticker_conditions)
+            joined.append(CumulativeTickerHolding.ticker)
 
-        if orders:
-            query = query.order_by(*orders)
+        # relationships can not be lazy loaded under an AsyncSession
+        if schema is not None:
+            query = query.options(
+                *get_loader_options(CumulativeTickerHolding, schema, joined)
+            )
+
+        sort_keys = get_sort_keys(
+            CumulativeTickerHolding,
+            ordering_dict,
+            {
+                "ticker_code": SortKey(
+                    Ticker.code, get_value=lambda holding: holding.ticker.code
+                ),
+                "pnl_amount": SortKey(
+                    CumulativeTickerHolding.pnl_amount,
+                    get_value=attrgetter("pnl_amount"),
+                    nullable=True,
+                ),
+                "pnl_ratio": SortKey(
+                    CumulativeTickerHolding.pnl_ratio,
+                    get_value=attrgetter("pnl_ratio"),
+                    nullable=True,
+                ),
+            },
+        )
 
-        return query.all()
+        return await fetch_page(self._session, query, sort_keys, limit, after)
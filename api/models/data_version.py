@@ -0,0 +1,84 @@
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from models import Base
+from settings.database import get_or_create
+from sqlalchemy import String, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+# the scope of a version counting every change to its table
+ALL_SCOPES = 0
+
+
+class DataVersion(Base):
+    """Change counter of a table, or of the rows of a table in one scope.
+
+    Responses built from a table are identified by the versions they were
+    read at, so a client holding a response can be told it is still current
+    without building it again.
+    """
+
+    __tablename__ = "data_version"
+
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    scope_id: Mapped[int] = mapped_column(primary_key=True, default=ALL_SCOPES)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+def get_version_keys(
+    name: str, scope_ids: Iterable[Optional[int]] = ()
+) -> List[Tuple[str, int]]:
+    # a change in any scope is also a change of the whole table
+    return [(name, ALL_SCOPES)] + [
+        (name, scope_id) for scope_id in sorted(set(scope_ids) - {None, ALL_SCOPES})
+    ]
+
+
+def bump_data_versions(session: Session, name: str, scope_ids: Iterable[int] = ()):
+    """Count a change to table name, and to the given scopes of it.
+
+    Runs in the transaction of the change, so the new versions are seen
+    together with the changed rows. Nothing is committed.
+    """
+
+    keys = get_version_keys(name, scope_ids)
+    insert = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}.get(
+        session.get_bind().dialect.name
+    )
+
+    if insert is None:
+        for name, scope_id in keys:
+            get_or_create(session, DataVersion, name=name, scope_id=scope_id)
+        session.execute(
+            update(DataVersion)
+            .where(tuple_(DataVersion.name, DataVersion.scope_id).in_(keys))
+            .values(version=DataVersion.version + 1)
+        )
+        return
+
+    statement = insert(DataVersion).values(
+        [{"name": name, "scope_id": scope_id, "version": 1} for name, scope_id in keys]
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["name", "scope_id"],
+            set_={"version": DataVersion.version + 1},
+        )
+    )
+
+
+async def get_data_versions(
+    db: AsyncSession, keys: Sequence[Tuple[str, int]]
+) -> List[int]:
+    """Versions of keys in their order, 0 for what never changed."""
+
+    rows = await db.execute(
+        select(DataVersion.name, DataVersion.scope_id, DataVersion.version).where(
+            tuple_(DataVersion.name, DataVersion.scope_id).in_(keys)
+        )
+    )
+    versions = {(name, scope_id): version for name, scope_id, version in rows}
+
+    return [versions.get(key, 0) for key in keys]
@@ -0,0 +1,305 @@
+import enum
+import os
+from typing import Any, AsyncIterator, BinaryIO, Callable, NamedTuple, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from models.common import Currency, Market, Ticker
+from models.cumulative_ticker_holding import (
+    CumulativeTickerHolding,
+    CumulativeTickerHoldingFilter,
+)
+from models.journal import Transaction
+from sqlalchemy import Select, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# rows per fetch from the database, written as one record batch or row group
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 10000))
+
+EXPORT_MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# codes repeat across rows, so they are stored once per batch
+CODE_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def get_enum_value(value: Optional[enum.Enum]) -> Optional[str]:
+    return None if value is None else value.value
+
+
+class ExportColumn(NamedTuple):
+    name: str
+    expression: Any
+    type: pa.DataType
+    # applied to each fetched value before it is written
+    convert: Optional[Callable[[Any], Any]] = None
+
+
+TRANSACTION_EXPORT_COLUMNS = (
+    ExportColumn("id", Transaction.id, pa.int64()),
+    ExportColumn("ticker_id", Transaction.ticker_id, pa.int64()),
+    ExportColumn("ticker_code", Ticker.code, CODE_TYPE),
+    ExportColumn("market_code", Market.code, CODE_TYPE),
+    ExportColumn("currency_code", Currency.code, CODE_TYPE),
+    ExportColumn("type", Transaction.type, CODE_TYPE, get_enum_value),
+    ExportColumn("price", Transaction.price, pa.float64()),
+    ExportColumn("count", Transaction.count, pa.float64()),
+    ExportColumn("commission", Transaction.commission, pa.float64()),
+    ExportColumn(
+        "investment_account_id", Transaction.investment_account_id, pa.int64()
+    ),
+    ExportColumn("platform_id", Transaction.platform_id, pa.int64()),
+    ExportColumn("executed_at", Transaction.executed_at, pa.timestamp("us")),
+    ExportColumn("executed_by_id", Transaction.executed_by_id, pa.int64()),
+    ExportColumn("description", Transaction.description, pa.string()),
+    ExportColumn("notes", Transaction.notes, pa.string()),
+    ExportColumn("time_frame", Transaction.time_frame, CODE_TYPE, get_enum_value),
+    ExportColumn("pattern", Transaction.pattern, pa.string()),
+    ExportColumn("is_active", Transaction.is_active, pa.bool_()),
+    ExportColumn(
+        "cumulative_ticker_holding_id",
+        Transaction.cumulative_ticker_holding_id,
+        pa.int64(),
+    ),
+)
+
+CUMULATIVE_TICKER_HOLDING_EXPORT_COLUMNS = (
+    ExportColumn("id", CumulativeTickerHolding.id, pa.int64()),
+    ExportColumn("ticker_id", CumulativeTickerHolding.ticker_id, pa.int64()),
+    ExportColumn("ticker_code", Ticker.code, CODE_TYPE),
+    ExportColumn("market_code", Market.code, CODE_TYPE),
+    ExportColumn("currency_code", Currency.code, CODE_TYPE),
+    ExportColumn(
+        "investment_account_id",
+        CumulativeTickerHolding.investment_account_id,
+        pa.int64(),
+    ),
+    ExportColumn("avg_cost", CumulativeTickerHolding.avg_cost, pa.float64()),
+    ExportColumn("count", CumulativeTickerHolding.count, pa.float64()),
+    ExportColumn("total_buys", CumulativeTickerHolding.total_buys, pa.float64()),
+    ExportColumn(
+        "total_buy_amount", CumulativeTickerHolding.total_buy_amount, pa.float64()
+    ),
+    ExportColumn("total_sells", CumulativeTickerHolding.total_sells, pa.float64()),
+    ExportColumn(
+        "total_sell_amount", CumulativeTickerHolding.total_sell_amount, pa.float64()
+    ),
+    ExportColumn(
+        "total_commission_cost",
+        CumulativeTickerHolding.total_commission_cost,
+        pa.float64(),
+    ),
+    ExportColumn("is_completed", CumulativeTickerHolding.is_completed, pa.bool_()),
+    ExportColumn(
+        "first_transaction_at",
+        CumulativeTickerHolding.first_transaction_at,
+        pa.timestamp("us"),
+    ),
+    ExportColumn(
+        "last_transaction_at",
+        CumulativeTickerHolding.last_transaction_at,
+        pa.timestamp("us"),
+    ),
+    ExportColumn("pnl_amount", CumulativeTickerHolding.pnl_amount, pa.float64()),
+    ExportColumn("pnl_ratio", CumulativeTickerHolding.pnl_ratio, pa.float64()),
+)
+
+
+def get_export_schema(columns) -> pa.Schema:
+    return pa.schema([(column.name, column.type) for column in columns])
+
+
+def select_transaction_export() -> Select:
+    return (
+        select(*(column.expression for column in TRANSACTION_EXPORT_COLUMNS))
+        .join_from(Transaction, Transaction.ticker)
+        .join(Ticker.market)
+        .join(Market.currency)
+        .order_by(Transaction.id)
+    )
+
+
+def filter_transactions(
+    query,
+    q: Optional[str] = None,
+    investment_account: Optional[int] = None,
+    executed_by: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    type: Optional[str] = None,
+):
+    if q:
+        query = query.where(
+            or_(
+                Transaction.ticker_id == Ticker.code.like(f"%{q}%"),
+                # Transaction.ticker.code.like(f"%{q}%"),
+                # Transaction.ticker.market.code.like(f"%{q}%"),
+                # Transaction.ticker.market.title.like(f"%{q}%"),
+                # Transaction.ticker.market.currency.code.like(f"%{q}%"),
+            )
+        )
+
+    if investment_account:
+        query = query.where(Transaction.investment_account_id == investment_account)
+
+    if executed_by:
+        query = query.where(Transaction.executed_by_id == executed_by)
+
+    if is_active:
+        query = query.where(Transaction.is_active == is_active)
+
+    if type:
+        query = query.where(Transaction.type == type)
+
+    return query
+
+
+def select_cumulative_ticker_holding_export(
+    filter: CumulativeTickerHoldingFilter,
+) -> Select:
+    """Holding export rows matching filter, as the holdings list route does."""
+
+    query = (
+        select(
+            *(column.expression for column in CUMULATIVE_TICKER_HOLDING_EXPORT_COLUMNS)
+        )
+        .join_from(CumulativeTickerHolding, CumulativeTickerHolding.ticker)
+        .join(Ticker.market)
+        .join(Market.currency)
+        .order_by(CumulativeTickerHolding.id)
+    )
+
+    for expression, value in (
+        (CumulativeTickerHolding.ticker_id, filter.ticker_id),
+        (Ticker.market_id, filter.market_id),
+        (CumulativeTickerHolding.investment_account_id, filter.investment_account_id),
+        (CumulativeTickerHolding.is_completed, filter.is_completed),
+        (Ticker.code, filter.ticker_code and filter.ticker_code.upper()),
+        (Market.code, filter.market_code and filter.market_code.upper()),
+    ):
+        if value is not None:
+            query = query.where(expression == value)
+
+    return query
+
+
+def get_record_batch(columns, rows) -> pa.RecordBatch:
+    arrays = []
+
+    for column, values in zip(columns, zip(*rows)):
+        if column.convert is not None:
+            values = [column.convert(value) for value in values]
+
+        if pa.types.is_dictionary(column.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, column.type))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=get_export_schema(columns))
+
+
+class ExportBuffer:
+    """Write only file object holding what was written since the last drain."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ExportWriter:
+    """Writes record batches to sink as an Arrow IPC stream or as Parquet.
+
+    Each batch becomes a record batch of the stream or a row group of the
+    Parquet file, so readers never need more than one batch in memory.
+    """
+
+    def __init__(self, sink: BinaryIO, columns, format: str = "parquet"):
+        schema = get_export_schema(columns)
+        self.columns = columns
+        self.format = format
+        self.rows = 0
+
+        if format == "arrow":
+            self._writer = pa.ipc.new_stream(sink, schema)
+        elif format == "parquet":
+            self._writer = pq.ParquetWriter(sink, schema)
+        else:
+            raise ValueError(f"Unknown export format: {format}")
+
+    def write(self, rows):
+        batch = get_record_batch(self.columns, rows)
+
+        if self.format == "arrow":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_table(pa.Table.from_batches([batch]))
+
+        self.rows += len(rows)
+
+    def close(self):
+        self._writer.close()
+
+
+def write_export(
+    session: Session,
+    query: Select,
+    columns,
+    sink: BinaryIO,
+    format: str = "parquet",
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> int:
+    """Write the rows of query to sink batch by batch, returns the row count."""
+
+    writer = ExportWriter(sink, columns, format)
+    result = session.execute(query.execution_options(yield_per=batch_size))
+
+    for rows in result.partitions():
+        writer.write(rows)
+
+    writer.close()
+
+    return writer.rows
+
+
+async def stream_export(
+    db: AsyncSession,
+    query: Select,
+    columns,
+    format: str = "parquet",
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """The rows of query as export file chunks, one per fetched batch."""
+
+    buffer = ExportBuffer()
+    writer = ExportWriter(buffer, columns, format)
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+
+    async for rows in result.partitions():
+        writer.write(rows)
+        yield buffer.drain()
+
+    writer.close()
+    yield buffer.drain()
@@ -0,0 +1,351 @@
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from models.common import (
+    LiquidAssetAccount,
+    LiquidAssetTransaction,
+    Market,
+    Ticker,
+)
+from models.cumulative_ticker_holding import CumulativeTickerHolding
+from models.data_version import bump_data_versions
+from models.journal import Transaction
+from models.portfolio_snapshot import LiquidAssetSnapshot, PortfolioSnapshot
+from models.user import InvestmentAccount
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+
+def load_transaction_arrays(
+    session: Session, investment_account_id: int, ticker_id: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """Transactions of an account as columns, ordered by ticker and execution."""
+
+    query = (
+        select(
+            Transaction.id,
+            Transaction.ticker_id,
+            Transaction.type,
+            Transaction.price,
+            Transaction.count,
+            Transaction.commission,
+            Transaction.executed_at,
+            Transaction.is_active,
+        )
+        .where(Transaction.investment_account_id == investment_account_id)
+        .order_by(Transaction.ticker_id, Transaction.executed_at, Transaction.id)
+    )
+
+    if ticker_id is not None:
+        query = query.where(Transaction.ticker_id == ticker_id)
+
+    rows = session.execute(query).all()
+    columns = list(zip(*rows)) or [()] * 8
+
+    return {
+        "id": np.array(columns[0], dtype=np.int64),
+        "ticker_id": np.array(columns[1], dtype=np.int64),
+        "is_buy": np.array(
+            [type == Transaction.Type.BUY for type in columns[2]], dtype=bool
+        ),
+        "price": np.array(columns[3], dtype=np.float64),
+        "count": np.array(columns[4], dtype=np.float64),
+        "commission": np.array(columns[5], dtype=np.float64),
+        "executed_at": np.array(columns[6], dtype="datetime64[us]"),
+        "is_active": np.array(columns[7], dtype=bool),
+    }
+
+
+def _running_counts(
+    signed_counts: np.ndarray, is_buy: np.ndarray, applied: np.ndarray
+) -> np.ndarray:
+    # Sells bigger than the open count are rejected by apply_transaction, which
+    # changes every count after them; settle them one at a time. A position
+    # that returns to exactly zero continues from 0.0, so a single running sum
+    # over the whole history equals the per holding counts.
+    while True:
+        running_counts = np.cumsum(signed_counts)
+        overdrawn = np.flatnonzero(running_counts < 0)
+
+        if overdrawn.size == 0:
+            return running_counts
+
+        rejected = overdrawn[0]
+        assert not is_buy[rejected]
+        applied[rejected] = False
+        signed_counts[rejected] = 0
+
+
+def _replay_ticker(columns: Dict[str, np.ndarray], start: int, end: int):
+    is_buy = columns["is_buy"][start:end]
+    price = columns["price"][start:end]
+    count = columns["count"][start:end]
+    commission = columns["commission"][start:end]
+    executed_at = columns["executed_at"][start:end]
+    applied = columns["is_active"][start:end].copy()
+
+    signed_counts = np.where(is_buy, count, -count) * applied
+    running_counts = _running_counts(signed_counts, is_buy, applied)
+
+    completed = applied & (running_counts == 0)
+    # the first applied trade after a completed holding opens the next one;
+    # rejected and inactive trades in between stay on the completed holding
+    applied_positions = np.flatnonzero(applied)
+    boundaries = applied_positions[1:][completed[applied_positions[:-1]]]
+
+    buys = applied & is_buy
+    sells = applied & ~is_buy
+    amounts = price * count
+
+    holdings = []
+
+    for holding_start, holding_end in zip(
+        np.concatenate(([0], boundaries)), np.concatenate((boundaries, [end - start]))
+    ):
+        s = slice(holding_start, holding_end)
+        holding_buys = buys[s]
+        # at most one, the holding ends at its first completion
+        completions = np.flatnonzero(completed[s])
+
+        # avg_cost depends on its previous value, it is the only sequential part
+        avg_cost = 0
+        total_buys = 0
+        for buy_price, buy_count in zip(price[s][holding_buys], count[s][holding_buys]):
+            avg_cost = (total_buys * avg_cost + buy_price * buy_count) / (
+                total_buys + buy_count
+            )
+            total_buys += buy_count
+
+        # cumsum adds strictly in order, so the totals are bit-identical to
+        # the += chains in CumulativeTickerHolding.apply_transaction
+        holding = {
+            "avg_cost": float(avg_cost),
+            "count": float(running_counts[holding_end - 1]),
+            "total_buys": float(np.cumsum(count[s] * holding_buys)[-1]),
+            "total_sells": float(np.cumsum(count[s] * sells[s])[-1]),
+            "total_commission_cost": float(np.cumsum(commission[s] * applied[s])[-1]),
+            "total_buy_amount": float(np.cumsum(amounts[s] * holding_buys)[-1]),
+            "total_sell_amount": float(np.cumsum(amounts[s] * sells[s])[-1]),
+            "is_completed": bool(completions.size),
+            "last_transaction_at": (
+                executed_at[s][completions[0]].item() if completions.size else None
+            ),
+        }
+
+        holding["first_transaction_at"] = (
+            executed_at[s][holding_buys].min()
+            if holding_buys.any()
+            # only rejected or inactive trades, there is no first buy
+            else executed_at[holding_start]
+        ).item()
+
+        holdings.append(
+            (holding, columns["id"][start + holding_start : start + holding_end])
+        )
+
+    return holdings
+
+
+def replay_holdings(columns: Dict[str, np.ndarray]) -> List[tuple]:
+    """Rebuild holdings from transaction columns.
+
+    Returns (ticker_id, holding fields, transaction ids) per holding; once the
+    count of a ticker returns to zero, the next applied trade opens a new
+    holding.
+    """
+
+    ticker_ids = columns["ticker_id"]
+    ticker_starts = np.flatnonzero(np.diff(ticker_ids)) + 1
+    starts = np.concatenate(([0], ticker_starts)) if ticker_ids.size else []
+    ends = np.concatenate((ticker_starts, [ticker_ids.size]))
+
+    return [
+        (int(ticker_ids[start]), holding, transaction_ids)
+        for start, end in zip(starts, ends)
+        for holding, transaction_ids in _replay_ticker(columns, start, end)
+    ]
+
+
+def rebuild_holdings(
+    session: Session, investment_account_id: int, ticker_id: Optional[int] = None
+) -> int:
+    """Replace the holdings of an account with ones replayed from its trades.
+
+    Liquid asset balances are left untouched. Nothing is committed. Returns the
+    number of holdings written.
+    """
+
+    replayed = replay_holdings(
+        load_transaction_arrays(session, investment_account_id, ticker_id)
+    )
+
+    previous_holdings = delete(CumulativeTickerHolding).where(
+        CumulativeTickerHolding.investment_account_id == investment_account_id
+    )
+    if ticker_id is not None:
+        previous_holdings = previous_holdings.where(
+            CumulativeTickerHolding.ticker_id == ticker_id
+        )
+    session.execute(previous_holdings)
+    bump_data_versions(
+        session, CumulativeTickerHolding.__tablename__, [investment_account_id]
+    )
+
+    if not replayed:
+        return 0
+
+    holding_ids = session.scalars(
+        insert(CumulativeTickerHolding).returning(
+            CumulativeTickerHolding.id, sort_by_parameter_order=True
+        ),
+        [
+            {
+                "ticker_id": replayed_ticker_id,
+                "investment_account_id": investment_account_id,
+                **holding,
+            }
+            for replayed_ticker_id, holding, _ in replayed
+        ],
+    ).all()
+
+    session.execute(
+        update(Transaction),
+        [
+            {"id": int(transaction_id), "cumulative_ticker_holding_id": holding_id}
+            for holding_id, (_, _, transaction_ids) in zip(holding_ids, replayed)
+            for transaction_id in transaction_ids
+        ],
+    )
+
+    return len(holding_ids)
+
+
+def rebuild_snapshots(session: Session, owner_id: int) -> Tuple[int, int]:
+    """Replace the portfolio and liquid asset snapshots of an owner.
+
+    Trades are applied in execution order with the holding logic and written
+    with bulk inserts. Nothing is committed. Returns the number of portfolio
+    and liquid asset snapshots written.
+    """
+
+    session.execute(
+        delete(PortfolioSnapshot).where(
+            PortfolioSnapshot.investment_account_id.in_(
+                select(InvestmentAccount.id).where(
+                    InvestmentAccount.owner_id == owner_id
+                )
+            )
+        )
+    )
+    session.execute(
+        delete(LiquidAssetSnapshot).where(
+            LiquidAssetSnapshot.liquid_asset_account_id.in_(
+                select(LiquidAssetAccount.id).where(
+                    LiquidAssetAccount.owner_id == owner_id
+                )
+            )
+        )
+    )
+
+    open_holdings: Dict[Tuple[int, int], CumulativeTickerHolding] = {}
+    positions: Dict[Tuple[int, int, datetime.date], Tuple[float, float]] = {}
+    balance_deltas: Dict[Tuple[int, datetime.date], float] = {}
+
+    # rows carry every field apply_transaction reads
+    for transaction in session.execute(
+        select(
+            Transaction.ticker_id,
+            Transaction.investment_account_id,
+            Transaction.platform_id,
+            Transaction.type,
+            Transaction.price,
+            Transaction.count,
+            Transaction.commission,
+            Transaction.executed_at,
+            Market.currency_id,
+        )
+        .join(Transaction.ticker)
+        .join(Ticker.market)
+        .join(Transaction.investment_account)
+        .where(InvestmentAccount.owner_id == owner_id)
+        .where(Transaction.is_active == True)
+        .order_by(Transaction.executed_at, Transaction.id)
+    ):
+        holding_key = (transaction.investment_account_id, transaction.ticker_id)
+        holding = open_holdings.get(holding_key)
+
+        if holding is None:
+            holding = open_holdings[holding_key] = CumulativeTickerHolding(
+                ticker_id=transaction.ticker_id,
+                investment_account_id=transaction.investment_account_id,
+            )
+
+        balance_delta = holding.apply_transaction(transaction)
+
+        if balance_delta is None:
+            continue
+
+        day = transaction.executed_at.date()
+        positions[(*holding_key, day)] = (holding.count, holding.cost_basis)
+
+        balance_key = (
+            LiquidAssetAccount.get_default_id(
+                session, transaction.currency_id, owner_id, transaction.platform_id
+            ),
+            day,
+        )
+        balance_deltas[balance_key] = balance_deltas.get(balance_key, 0) + balance_delta
+
+        if holding.is_completed:
+            del open_holdings[holding_key]
+
+    for liquid_asset_account_id, amount, type, executed_at in session.execute(
+        select(
+            LiquidAssetTransaction.liquid_asset_account_id,
+            LiquidAssetTransaction.amount,
+            LiquidAssetTransaction.type,
+            LiquidAssetTransaction.executed_at,
+        )
+        .join(LiquidAssetTransaction.liquid_asset_account)
+        .where(LiquidAssetAccount.owner_id == owner_id)
+    ):
+        balance_key = (liquid_asset_account_id, executed_at.date())
+        balance_deltas[balance_key] = balance_deltas.get(balance_key, 0) + (
+            -amount if type == LiquidAssetTransaction.Type.WITHDRAW else amount
+        )
+
+    balances = []
+    running_balances: Dict[int, float] = {}
+
+    for (liquid_asset_account_id, day), balance_delta in sorted(balance_deltas.items()):
+        running_balances[liquid_asset_account_id] = (
+            running_balances.get(liquid_asset_account_id, 0) + balance_delta
+        )
+        balances.append(
+            {
+                "liquid_asset_account_id": liquid_asset_account_id,
+                "day": day,
+                "balance": running_balances[liquid_asset_account_id],
+            }
+        )
+
+    if positions:
+        session.execute(
+            insert(PortfolioSnapshot),
+            [
+                {
+                    "investment_account_id": key[0],
+                    "ticker_id": key[1],
+                    "day": key[2],
+                    "count": position[0],
+                    "cost_basis": position[1],
+                }
+                for key, position in positions.items()
+            ],
+        )
+
+    if balances:
+        session.execute(insert(LiquidAssetSnapshot), balances)
+
+    return len(positions), len(balances)
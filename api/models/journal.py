@@ -49,7 +49,7 @@ class Transaction(Base):
     platform_id: Mapped[int] = mapped_column(ForeignKey("platform.id"), index=True)
     platform: Mapped[Platform] = relationship()
     executed_at: Mapped[datetime.datetime] = mapped_column(
-        default=datetime.datetime.utcnow()
+        default=datetime.datetime.utcnow(), index=True
     )
     executed_by_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     executed_by: Mapped[User] = relationship()
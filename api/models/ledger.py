@@ -0,0 +1,237 @@
+import datetime
+from typing import Dict, List, Tuple
+
+from models.common import (
+    LiquidAssetAccount,
+    LiquidAssetTransaction,
+    Market,
+    Platform,
+    Ticker,
+)
+from models.cumulative_ticker_holding import CumulativeTickerHolding
+from models.data_version import bump_data_versions
+from models.journal import Transaction
+from models.portfolio_snapshot import record_snapshot_deltas
+from models.user import InvestmentAccount
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+
+def record_transaction(session: Session, candidate_transaction: dict) -> Transaction:
+    """Add one trade to the open holding of its account and ticker.
+
+    The holding is opened if there is none; a concurrent trade opening it
+    too fails on the unique open holding index. Nothing is committed.
+    """
+
+    cumulative_ticker_holding = session.scalar(
+        select(CumulativeTickerHolding)
+        .where(CumulativeTickerHolding.ticker_id == candidate_transaction["ticker_id"])
+        .where(
+            CumulativeTickerHolding.investment_account_id
+            == candidate_transaction["investment_account_id"]
+        )
+        .where(CumulativeTickerHolding.is_completed == False)
+        .limit(1)
+    )
+
+    if cumulative_ticker_holding is None:
+        cumulative_ticker_holding = CumulativeTickerHolding(
+            ticker_id=candidate_transaction["ticker_id"],
+            investment_account_id=candidate_transaction["investment_account_id"],
+        )
+        session.add(cumulative_ticker_holding)
+        session.flush()
+
+    created_transaction = Transaction(
+        **candidate_transaction,
+        cumulative_ticker_holding_id=cumulative_ticker_holding.id,
+    )
+    session.add(created_transaction)
+    session.flush()
+
+    cumulative_ticker_holding.add_transaction(session, created_transaction)
+    bump_data_versions(
+        session,
+        CumulativeTickerHolding.__tablename__,
+        [created_transaction.investment_account_id],
+    )
+
+    return created_transaction
+
+
+def record_liquid_asset_transaction(
+    session: Session, candidate_transaction: dict
+) -> LiquidAssetTransaction:
+    """Add one deposit, withdrawal or dividend to its liquid asset account.
+
+    The balance is changed on the loaded account, so a concurrent change of
+    it fails on the version check. Nothing is committed.
+    """
+
+    created_transaction = LiquidAssetTransaction(**candidate_transaction)
+    session.add(created_transaction)
+    session.flush()
+
+    liquid_asset_account = session.get(
+        LiquidAssetAccount, created_transaction.liquid_asset_account_id
+    )
+    liquid_asset_account.add_transaction(session, created_transaction)
+
+    return created_transaction
+
+
+def apply_transactions(
+    session: Session, candidate_transactions: List[Tuple[int, dict]]
+) -> Tuple[List[Transaction], List[dict]]:
+    """Apply an ordered batch of trades with a handful of queries.
+
+    Every lookup add_transaction does per trade (open holding, ticker
+    currency, account owner) is loaded once for the whole batch. Holdings are
+    then updated in memory per (investment_account_id, ticker_id), all rows are
+    written with batched inserts on flush and every liquid asset account gets
+    a single balance update.
+
+    candidate_transactions holds (index, transaction fields) pairs; the index
+    is only used to report the rows that were rejected. Nothing is committed.
+    """
+
+    ticker_ids = {c["ticker_id"] for _, c in candidate_transactions}
+    investment_account_ids = {
+        c["investment_account_id"] for _, c in candidate_transactions
+    }
+    platform_ids = {c["platform_id"] for _, c in candidate_transactions}
+
+    ticker_currencies = dict(
+        session.execute(
+            select(Ticker.id, Market.currency_id)
+            .join(Ticker.market)
+            .where(Ticker.id.in_(ticker_ids))
+        ).all()
+    )
+    account_owners = dict(
+        session.execute(
+            select(InvestmentAccount.id, InvestmentAccount.owner_id).where(
+                InvestmentAccount.id.in_(investment_account_ids)
+            )
+        ).all()
+    )
+    platform_ids = set(
+        session.scalars(select(Platform.id).where(Platform.id.in_(platform_ids)))
+    )
+
+    open_holdings: Dict[Tuple[int, int], CumulativeTickerHolding] = {}
+    for holding in session.scalars(
+        select(CumulativeTickerHolding)
+        .where(CumulativeTickerHolding.is_completed == False)
+        .where(CumulativeTickerHolding.ticker_id.in_(ticker_ids))
+        .where(
+            CumulativeTickerHolding.investment_account_id.in_(investment_account_ids)
+        )
+        .order_by(CumulativeTickerHolding.id)
+    ):
+        open_holdings.setdefault(
+            (holding.investment_account_id, holding.ticker_id), holding
+        )
+
+    # summed per default liquid asset account, applied with one UPDATE each
+    balance_deltas: Dict[Tuple[int, int, int], float] = {}
+    # summed per day for the portfolio snapshots
+    holding_day_deltas: Dict[Tuple[int, int, datetime.date], Tuple[float, float]] = {}
+    balance_day_deltas: Dict[Tuple[Tuple[int, int, int], datetime.date], float] = {}
+
+    applied: List[Tuple[Transaction, CumulativeTickerHolding]] = []
+    errors = []
+
+    for index, candidate in candidate_transactions:
+        if candidate["ticker_id"] not in ticker_currencies:
+            errors.append({"index": index, "detail": "Ticker not found"})
+            continue
+        if candidate["investment_account_id"] not in account_owners:
+            errors.append({"index": index, "detail": "Investment account not found"})
+            continue
+        if candidate["platform_id"] not in platform_ids:
+            errors.append({"index": index, "detail": "Platform not found"})
+            continue
+
+        holding_key = (candidate["investment_account_id"], candidate["ticker_id"])
+        holding = open_holdings.get(holding_key)
+
+        if holding is None:
+            holding = CumulativeTickerHolding(
+                ticker_id=candidate["ticker_id"],
+                investment_account_id=candidate["investment_account_id"],
+            )
+            open_holdings[holding_key] = holding
+
+        transaction = Transaction(**candidate)
+        count, cost_basis = holding.count, holding.cost_basis
+        balance_delta = holding.apply_transaction(transaction)
+
+        if balance_delta is None:
+            errors.append(
+                {"index": index, "detail": "Sell count exceeds the holding count"}
+            )
+            continue
+
+        liquid_asset_key = (
+            ticker_currencies[candidate["ticker_id"]],
+            account_owners[candidate["investment_account_id"]],
+            candidate["platform_id"],
+        )
+        balance_deltas[liquid_asset_key] = (
+            balance_deltas.get(liquid_asset_key, 0) + balance_delta
+        )
+
+        day = transaction.executed_at.date()
+        count_delta, cost_basis_delta = holding_day_deltas.get(
+            (*holding_key, day), (0, 0)
+        )
+        holding_day_deltas[(*holding_key, day)] = (
+            count_delta + holding.count - count,
+            cost_basis_delta + holding.cost_basis - cost_basis,
+        )
+        balance_day_deltas[(liquid_asset_key, day)] = (
+            balance_day_deltas.get((liquid_asset_key, day), 0) + balance_delta
+        )
+
+        if holding.is_completed:
+            # the next trade of this ticker opens a new holding
+            del open_holdings[holding_key]
+
+        applied.append((transaction, holding))
+
+    session.add_all(dict.fromkeys(holding for _, holding in applied))
+    session.flush()
+
+    for transaction, holding in applied:
+        transaction.cumulative_ticker_holding_id = holding.id
+
+    transactions = [transaction for transaction, _ in applied]
+    session.add_all(transactions)
+    session.flush()
+
+    if transactions:
+        bump_data_versions(
+            session,
+            CumulativeTickerHolding.__tablename__,
+            {transaction.investment_account_id for transaction in transactions},
+        )
+
+    for liquid_asset_key, balance_delta in balance_deltas.items():
+        LiquidAssetAccount.add_to_balance(
+            session,
+            LiquidAssetAccount.get_default_id(session, *liquid_asset_key),
+            balance_delta,
+        )
+
+    record_snapshot_deltas(
+        session,
+        holding_day_deltas,
+        {
+            (LiquidAssetAccount.get_default_id(session, *liquid_asset_key), day): delta
+            for (liquid_asset_key, day), delta in balance_day_deltas.items()
+        },
+    )
+
+    return transactions, errors
@@ -0,0 +1,404 @@
+import datetime
+import enum
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+from models import TimeStampedBase
+from models.journal import Transaction
+from models.ledger import apply_transactions
+from settings.database import SessionLocal, is_write_conflict, run_unit_of_work
+from sqlalchemy import JSON, Enum, ForeignKey, String, select
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Mapped, Session, mapped_column, sessionmaker
+
+# most trades applied in one transaction, and how long the worker waits for
+# more trades to join a batch once it has one, in seconds
+LEDGER_BATCH_SIZE = int(os.environ.get("LEDGER_BATCH_SIZE", 500))
+LEDGER_BATCH_WAIT = float(os.environ.get("LEDGER_BATCH_WAIT", 0.005))
+# seconds between looks for pending receipts this process does not have queued
+LEDGER_RECOVER_INTERVAL = float(os.environ.get("LEDGER_RECOVER_INTERVAL", 30))
+
+logger = logging.getLogger(__name__)
+
+
+class TradeReceipt(TimeStampedBase):
+    """A trade accepted for the ledger queue, and what became of it."""
+
+    __tablename__ = "trade_receipt"
+
+    class Status(str, enum.Enum):
+        PENDING = "PENDING"
+        APPLIED = "APPLIED"
+        REJECTED = "REJECTED"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    status: Mapped[Status] = mapped_column(
+        Enum(Status), default=Status.PENDING, index=True
+    )
+    # the transaction fields as JSON, see get_candidate_transaction
+    payload: Mapped[dict] = mapped_column(JSON)
+    transaction_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("transaction.id"), default=None, nullable=True
+    )
+    detail: Mapped[Optional[str]] = mapped_column(String, default=None, nullable=True)
+    applied_at: Mapped[Optional[datetime.datetime]] = mapped_column(
+        default=None, nullable=True
+    )
+    # a receipt is settled once, even if two workers pick it up
+    version_id: Mapped[int] = mapped_column(default=1)
+
+    __mapper_args__ = {"version_id_col": version_id}
+
+    def get_candidate_transaction(self) -> dict:
+        candidate_transaction = dict(self.payload)
+        candidate_transaction["executed_at"] = datetime.datetime.fromisoformat(
+            candidate_transaction["executed_at"]
+        )
+        candidate_transaction["type"] = Transaction.Type(candidate_transaction["type"])
+
+        if candidate_transaction.get("time_frame") is not None:
+            candidate_transaction["time_frame"] = Transaction.TimeFrame(
+                candidate_transaction["time_frame"]
+            )
+
+        return candidate_transaction
+
+
+def apply_trade_receipts(session: Session, receipt_ids: List[int]) -> int:
+    """Apply the pending trades of receipt_ids in one batch and settle them.
+
+    Trades go through apply_transactions in receipt order, which coalesces
+    them per (investment_account_id, ticker_id): every touched holding and
+    liquid asset account is written once for the whole batch. Receipts
+    settled in the meantime are skipped. Nothing is committed. Returns the
+    number of settled receipts.
+    """
+
+    receipts = session.scalars(
+        select(TradeReceipt)
+        .where(TradeReceipt.id.in_(receipt_ids))
+        .where(TradeReceipt.status == TradeReceipt.Status.PENDING)
+        .order_by(TradeReceipt.id)
+    ).all()
+
+    if not receipts:
+        return 0
+
+    candidate_transactions = []
+    errors = {}
+
+    for receipt in receipts:
+        try:
+            candidate_transactions.append(
+                (receipt.id, receipt.get_candidate_transaction())
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            errors[receipt.id] = str(e)
+
+    transactions, apply_errors = apply_transactions(session, candidate_transactions)
+    errors.update((error["index"], error["detail"]) for error in apply_errors)
+
+    # applied transactions keep the order of their candidates
+    applied_transactions = iter(transactions)
+    applied_at = datetime.datetime.utcnow()
+
+    for receipt in receipts:
+        if receipt.id in errors:
+            receipt.status = TradeReceipt.Status.REJECTED
+            receipt.detail = errors[receipt.id]
+        else:
+            receipt.status = TradeReceipt.Status.APPLIED
+            receipt.transaction_id = next(applied_transactions).id
+
+        receipt.applied_at = applied_at
+
+    session.flush()
+
+    return len(receipts)
+
+
+def reject_trade_receipts(session: Session, receipt_ids: List[int], detail: str) -> int:
+    receipts = session.scalars(
+        select(TradeReceipt)
+        .where(TradeReceipt.id.in_(receipt_ids))
+        .where(TradeReceipt.status == TradeReceipt.Status.PENDING)
+    ).all()
+    rejected_at = datetime.datetime.utcnow()
+
+    for receipt in receipts:
+        receipt.status = TradeReceipt.Status.REJECTED
+        receipt.detail = detail
+        receipt.applied_at = rejected_at
+
+    session.flush()
+
+    return len(receipts)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether error says nothing about the receipts, so a later try may pass."""
+
+    return (
+        is_write_conflict(error)
+        or isinstance(error, OperationalError)
+        or (isinstance(error, DBAPIError) and error.connection_invalidated)
+    )
+
+
+class LedgerQueue:
+    """Applies queued trade receipts in batches on a background thread.
+
+    The thread starts with the first submitted receipt and begins with the
+    receipts left pending by an earlier process. Every batch is one unit of
+    work, so a batch that conflicts with another writer is applied again. A
+    batch that fails otherwise is split in halves until the failing receipts
+    are found, and only those are rejected; a batch that fails on a transient
+    error, a write conflict that outlasted its retries or a lost database, is
+    left pending. Every recover_interval the worker queues again the pending
+    receipts it does not hold, so those are retried without a restart.
+    Statistics are per process, like the receipts each process accepted.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        batch_size: int = LEDGER_BATCH_SIZE,
+        batch_wait: float = LEDGER_BATCH_WAIT,
+        recover_interval: float = LEDGER_RECOVER_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.recover_interval = recover_interval
+        self._session_factory = session_factory
+        # (receipt id, enqueued at) pairs, None stops the worker
+        self._queue: "queue.Queue[Optional[Tuple[int, float]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # ids in the queue or in the batch being applied
+        self._queued: Set[int] = set()
+        self.submitted = 0
+        self.dequeued = 0
+        self.settled = 0
+        self.failed = 0
+        self.deferred = 0
+        self.errors = 0
+        self.recoveries = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_apply_seconds = None
+        self.total_apply_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="ledger-queue", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Apply what is queued, then stop the worker."""
+
+        with self._lock:
+            thread = self._thread
+
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, receipt_id: int):
+        # marked before the worker starts, so its recovery skips the receipt
+        with self._lock:
+            self._queued.add(receipt_id)
+            self.submitted += 1
+
+        self.start()
+        self._queue.put((receipt_id, time.monotonic()))
+
+    def join(self):
+        """Block until every submitted receipt is settled."""
+
+        self._queue.join()
+
+    def _get_batch(self, timeout: float) -> Tuple[List[Tuple[int, float]], bool]:
+        batch = []
+
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return batch, False
+
+        if item is None:
+            self._queue.task_done()
+            return batch, True
+
+        batch.append(item)
+        deadline = time.monotonic() + self.batch_wait
+
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+
+            if item is None:
+                self._queue.task_done()
+                return batch, True
+
+            batch.append(item)
+
+        return batch, False
+
+    def _recover(self):
+        with self._session_factory() as session:
+            receipt_ids = session.scalars(
+                select(TradeReceipt.id)
+                .where(TradeReceipt.status == TradeReceipt.Status.PENDING)
+                .order_by(TradeReceipt.id)
+            ).all()
+
+        now = time.monotonic()
+
+        with self._lock:
+            # submitted by this process since, already queued
+            receipt_ids = [
+                receipt_id
+                for receipt_id in receipt_ids
+                if receipt_id not in self._queued
+            ]
+            self._queued.update(receipt_ids)
+
+        for receipt_id in receipt_ids:
+            self._queue.put((receipt_id, now))
+
+        with self._lock:
+            self.recoveries += 1
+
+    def _run(self):
+        is_stopped = False
+        recover_at = time.monotonic()
+
+        with self._session_factory() as session:
+            while not is_stopped:
+                if time.monotonic() >= recover_at:
+                    try:
+                        self._recover()
+                    except Exception:
+                        logger.exception("Failed to recover pending trade receipts")
+
+                    recover_at = time.monotonic() + self.recover_interval
+
+                batch, is_stopped = self._get_batch(
+                    max(0, recover_at - time.monotonic())
+                )
+
+                if batch:
+                    self._apply(session, batch)
+
+    def _settle(self, session: Session, receipt_ids: List[int]) -> Tuple[int, int]:
+        """Apply receipt_ids, rejecting only the receipts that fail to apply.
+
+        Returns the numbers of settled and rejected receipts.
+        """
+
+        try:
+            return run_unit_of_work(session, apply_trade_receipts, receipt_ids), 0
+        except Exception as e:
+            session.rollback()
+            error = e
+
+        if is_transient_error(error):
+            logger.warning(
+                "Left trade receipts %s pending after: %s", receipt_ids, error
+            )
+
+            with self._lock:
+                self.deferred += len(receipt_ids)
+
+            return 0, 0
+
+        if len(receipt_ids) > 1:
+            middle = len(receipt_ids) // 2
+            settled, failed = self._settle(session, receipt_ids[:middle])
+            more_settled, more_failed = self._settle(session, receipt_ids[middle:])
+
+            return settled + more_settled, failed + more_failed
+
+        # settled as rejected, so clients polling a receipt are not left waiting
+        try:
+            return 0, run_unit_of_work(
+                session, reject_trade_receipts, receipt_ids, f"Failed to apply: {error}"
+            )
+        except Exception:
+            # left pending for the next recovery
+            session.rollback()
+            logger.exception(
+                "Failed to reject trade receipts %s after: %s", receipt_ids, error
+            )
+
+            with self._lock:
+                self.errors += 1
+
+            return 0, 0
+
+    def _apply(self, session: Session, batch: List[Tuple[int, float]]):
+        receipt_ids = [receipt_id for receipt_id, _ in batch]
+        start = time.monotonic()
+        settled = failed = 0
+
+        try:
+            settled, failed = self._settle(session, receipt_ids)
+        finally:
+            end = time.monotonic()
+
+            with self._lock:
+                self.settled += settled
+                self.failed += failed
+                self.batches += 1
+                self.dequeued += len(batch)
+                self.last_batch_size = len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+                self.last_apply_seconds = end - start
+                self.total_apply_seconds += end - start
+                self.max_wait_seconds = max(
+                    self.max_wait_seconds,
+                    *(start - enqueued_at for _, enqueued_at in batch),
+                )
+                self._queued.difference_update(receipt_ids)
+
+            for _ in batch:
+                self._queue.task_done()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "is_running": self._thread is not None and self._thread.is_alive(),
+                "depth": self._queue.qsize(),
+                "submitted": self.submitted,
+                "settled": self.settled,
+                "failed": self.failed,
+                "deferred": self.deferred,
+                "errors": self.errors,
+                "recoveries": self.recoveries,
+                "batches": self.batches,
+                "batch_size": self.batch_size,
+                "last_batch_size": self.last_batch_size,
+                "max_batch_size": self.max_batch_size,
+                "mean_batch_size": (
+                    self.dequeued / self.batches if self.batches else None
+                ),
+                "last_apply_seconds": self.last_apply_seconds,
+                "mean_apply_seconds": (
+                    self.total_apply_seconds / self.batches if self.batches else None
+                ),
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+
+ledger_queue = LedgerQueue()
@@ -0,0 +1,247 @@
+import base64
+import binascii
+import datetime
+import json
+import typing
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+)
+
+from pydantic import BaseModel
+from sqlalchemy import and_, asc, inspect, nulls_last, or_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+
+PAGE_MAX_LIMIT = 1000
+
+T = TypeVar("T")
+
+
+class InvalidCursor(ValueError):
+    """A page cursor that was not issued for the sort keys it is used with."""
+
+
+class SortKey(NamedTuple):
+    expression: Any
+    direction: Callable = asc
+    # reads the value of expression from a fetched row, for the next cursor
+    get_value: Optional[Callable[[Any], Any]] = None
+    # nullable keys sort their NULLs last in both directions
+    nullable: bool = False
+
+
+class Page(BaseModel, Generic[T]):
+    results: List[T]
+    next: Optional[str] = None
+
+
+def get_sort_keys(
+    model, ordering_dict: dict, expressions: Optional[dict] = None
+) -> List[SortKey]:
+    """Sort keys for an ordering dict, ending with the primary key.
+
+    expressions maps ordering params that are not plain columns of model to
+    their SortKey.
+    """
+
+    expressions = expressions or {}
+    sort_keys = []
+
+    for param, direction in ordering_dict.items():
+        if param in expressions:
+            sort_keys.append(expressions[param]._replace(direction=direction))
+        else:
+            sort_keys.append(SortKey(getattr(model, param), direction))
+
+    # keeps the order total, equal keys would otherwise be skipped or repeated;
+    # following the last direction lets a single index serve the whole order
+    if "id" not in ordering_dict:
+        sort_keys.append(
+            SortKey(model.id, sort_keys[-1].direction if sort_keys else asc)
+        )
+
+    return sort_keys
+
+
+def _get_value(sort_key: SortKey, row):
+    if sort_key.get_value is not None:
+        return sort_key.get_value(row)
+
+    return getattr(row, sort_key.expression.key)
+
+
+def encode_cursor(sort_keys: Sequence[SortKey], row) -> str:
+    values = [_get_value(sort_key, row) for sort_key in sort_keys]
+    data = json.dumps(values, default=lambda value: value.isoformat()).encode()
+
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(sort_keys: Sequence[SortKey], cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        values = None
+
+    if not isinstance(values, list) or len(values) != len(sort_keys):
+        raise InvalidCursor("Invalid cursor")
+
+    for i, (sort_key, value) in enumerate(zip(sort_keys, values)):
+        python_type = getattr(sort_key.expression.type, "python_type", None)
+
+        if value is not None and python_type in (datetime.datetime, datetime.date):
+            values[i] = python_type.fromisoformat(value)
+
+    return values
+
+
+def _get_after_condition(sort_keys: Sequence[SortKey], values: list):
+    if all(
+        not sort_key.nullable and sort_key.direction is sort_keys[0].direction
+        for sort_key in sort_keys
+    ):
+        # a row value comparison can walk a composite index directly
+        row = tuple_(*(sort_key.expression for sort_key in sort_keys))
+        return (
+            row > tuple_(*values)
+            if sort_keys[0].direction is asc
+            else row < tuple_(*values)
+        )
+
+    conditions = []
+    equalities = []
+
+    for sort_key, value in zip(sort_keys, values):
+        expression = sort_key.expression
+
+        if value is None:
+            # NULLs come last, only the rest of the NULL group is after them
+            equalities.append(expression.is_(None))
+            continue
+
+        beyond = expression > value if sort_key.direction is asc else expression < value
+        if sort_key.nullable:
+            beyond = or_(beyond, expression.is_(None))
+
+        conditions.append(and_(*equalities, beyond))
+        equalities.append(expression == value)
+
+    return or_(*conditions)
+
+
+def order_by_sort_keys(query, sort_keys: Sequence[SortKey]):
+    orders = []
+
+    for sort_key in sort_keys:
+        order = sort_key.direction(sort_key.expression)
+        orders.append(nulls_last(order) if sort_key.nullable else order)
+
+    return query.order_by(*orders)
+
+
+def order_after(query, sort_keys: Sequence[SortKey], after: Optional[str] = None):
+    """Order query by sort_keys, past the row of cursor after when given.
+
+    Rows are located by their sort key values rather than an offset, so every
+    page costs the same as the first one.
+    """
+
+    if after is not None:
+        query = query.where(
+            _get_after_condition(sort_keys, decode_cursor(sort_keys, after))
+        )
+
+    return order_by_sort_keys(query, sort_keys)
+
+
+def paginate(
+    query, sort_keys: Sequence[SortKey], limit: int, after: Optional[str] = None
+):
+    """Order query by sort_keys and select one more row than a page past after."""
+
+    return order_after(query, sort_keys, after).limit(limit + 1)
+
+
+def get_page(rows: Sequence, sort_keys: Sequence[SortKey], limit: int) -> dict:
+    """Page of rows fetched with paginate."""
+
+    next_cursor = (
+        encode_cursor(sort_keys, rows[limit - 1]) if len(rows) > limit else None
+    )
+
+    return {"results": rows[:limit], "next": next_cursor}
+
+
+async def fetch_page(
+    db: AsyncSession,
+    query,
+    sort_keys: Sequence[SortKey],
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+):
+    """Rows of query, a Page of them when limit or after is given."""
+
+    if limit is None and after is None:
+        return (await db.scalars(order_by_sort_keys(query, sort_keys))).all()
+
+    limit = limit or PAGE_MAX_LIMIT
+    rows = (await db.scalars(paginate(query, sort_keys, limit, after))).all()
+
+    return get_page(rows, sort_keys, limit)
+
+
+def _get_nested_schema(annotation) -> Optional[Type[BaseModel]]:
+    # unwraps Optional[...] and List[...]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+
+    for arg in typing.get_args(annotation):
+        if schema := _get_nested_schema(arg):
+            return schema
+
+    return None
+
+
+def get_loader_options(model, schema: Type[BaseModel], joined: Sequence = ()) -> list:
+    """Loader options for every relationship of model that schema serializes.
+
+    Many-to-one relationships are joined into the query and collections are
+    loaded with one SELECT each, so the number of queries does not depend on
+    the number of rows. Relationships in joined are already joined by the
+    query and are populated from that join.
+    """
+
+    relationships = inspect(model).relationships
+    options = []
+
+    for name, field in schema.model_fields.items():
+        nested_schema = _get_nested_schema(field.annotation)
+
+        if nested_schema is None or name not in relationships:
+            continue
+
+        relationship = relationships[name]
+        attribute = getattr(model, name)
+
+        if any(attribute is joined_attribute for joined_attribute in joined):
+            loader = contains_eager(attribute)
+        elif relationship.uselist:
+            loader = selectinload(attribute)
+        else:
+            loader = joinedload(attribute)
+
+        options.append(
+            loader.options(
+                *get_loader_options(relationship.mapper.class_, nested_schema)
+            )
+        )
+
+    return options
@@ -0,0 +1,197 @@
+import datetime
+from typing import Dict, Optional, Tuple
+
+from models import Base
+from sqlalchemy import (
+    ForeignKey,
+    UniqueConstraint,
+    and_,
+    func,
+    insert,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+
+class PortfolioSnapshot(Base):
+    """End of day state of a ticker position in an investment account.
+
+    Rows only exist for days with trades; the state on any other day is the
+    latest row before it.
+
+    Trades are recorded as they arrive. A backdated sell removes cost basis
+    at the average cost of the holding when it is recorded, as
+    apply_transaction does, rather than at the average on its own day. The
+    latest row therefore always matches the holding, while earlier days may
+    not; rebuild_snapshots recomputes every day in execution order.
+    """
+
+    __tablename__ = "portfolio_snapshot"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    investment_account_id: Mapped[int] = mapped_column(
+        ForeignKey("investment_account.id")
+    )
+    ticker_id: Mapped[int] = mapped_column(ForeignKey("ticker.id"), index=True)
+    day: Mapped[datetime.date] = mapped_column()
+    count: Mapped[float] = mapped_column(default=0)
+    cost_basis: Mapped[float] = mapped_column(default=0)
+
+    # the unique index also serves the as-of and range queries
+    __table_args__ = (
+        UniqueConstraint(
+            "investment_account_id",
+            "ticker_id",
+            "day",
+            name="_portfolio_snapshot__investment_account_ticker_day_uc",
+        ),
+    )
+
+    @classmethod
+    def record(
+        cls,
+        session: Session,
+        investment_account_id: int,
+        ticker_id: int,
+        day: datetime.date,
+        count_delta: float,
+        cost_basis_delta: float,
+    ) -> None:
+        """Apply a change on day to its row and every later one."""
+
+        _record(
+            session,
+            cls,
+            dict(investment_account_id=investment_account_id, ticker_id=ticker_id),
+            day,
+            dict(count=count_delta, cost_basis=cost_basis_delta),
+        )
+
+
+class LiquidAssetSnapshot(Base):
+    """End of day balance of a liquid asset account."""
+
+    __tablename__ = "liquid_asset_snapshot"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    liquid_asset_account_id: Mapped[int] = mapped_column(
+        ForeignKey("liquid_asset_account.id")
+    )
+    day: Mapped[datetime.date] = mapped_column()
+    balance: Mapped[float] = mapped_column(default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "liquid_asset_account_id",
+            "day",
+            name="_liquid_asset_snapshot__liquid_asset_account_day_uc",
+        ),
+    )
+
+    @classmethod
+    def record(
+        cls,
+        session: Session,
+        liquid_asset_account_id: int,
+        day: datetime.date,
+        balance_delta: float,
+    ) -> None:
+        """Apply a balance change on day to its row and every later one."""
+
+        _record(
+            session,
+            cls,
+            dict(liquid_asset_account_id=liquid_asset_account_id),
+            day,
+            dict(balance=balance_delta),
+        )
+
+
+def _record(session: Session, model, key: dict, day: datetime.date, deltas: dict):
+    """Add deltas to the row of day and every later one.
+
+    A trade on a day that already has a row costs one UPDATE ... RETURNING;
+    the first one of a day adds an INSERT of the row, from the latest day
+    before it. Dialects without UPDATE ... RETURNING look the row up first.
+    """
+
+    later_days = (
+        update(model)
+        .filter_by(**key)
+        .where(model.day >= day)
+        .values(
+            **{field: getattr(model, field) + delta for field, delta in deltas.items()}
+        )
+    )
+
+    if not session.get_bind().dialect.update_returning:
+        if session.scalar(select(model.id).filter_by(**key, day=day)) is None:
+            _insert_day(session, model, key, day, dict.fromkeys(deltas, 0))
+        session.execute(later_days)
+        return
+
+    if day not in session.scalars(later_days.returning(model.day)).all():
+        _insert_day(session, model, key, day, deltas)
+
+
+def _insert_day(session: Session, model, key: dict, day: datetime.date, deltas: dict):
+    # a new day starts from the state of the latest day before it
+    previous = select(model).filter_by(**key).where(model.day < day)
+    previous = previous.order_by(model.day.desc()).limit(1).subquery()
+
+    session.execute(
+        insert(model).from_select(
+            [*key, "day", *deltas],
+            select(
+                *(literal(value) for value in key.values()),
+                literal(day, model.day.type),
+                *(
+                    func.coalesce(select(previous.c[field]).scalar_subquery(), 0)
+                    + delta
+                    for field, delta in deltas.items()
+                ),
+            ),
+        )
+    )
+
+
+def record_snapshot_deltas(
+    session: Session,
+    holding_deltas: Dict[Tuple[int, int, datetime.date], Tuple[float, float]],
+    balance_deltas: Dict[Tuple[int, datetime.date], float],
+) -> None:
+    """Record deltas summed per (investment_account_id, ticker_id, day) and
+    per (liquid_asset_account_id, day)."""
+
+    for (investment_account_id, ticker_id, day), deltas in sorted(
+        holding_deltas.items()
+    ):
+        PortfolioSnapshot.record(
+            session, investment_account_id, ticker_id, day, *deltas
+        )
+
+    for (liquid_asset_account_id, day), balance_delta in sorted(balance_deltas.items()):
+        LiquidAssetSnapshot.record(session, liquid_asset_account_id, day, balance_delta)
+
+
+def select_snapshots_as_of(model, group_by, day: Optional[datetime.date], *criteria):
+    """Latest row on or before day for every group_by value matching criteria."""
+
+    latest_days = select(group_by.label("group_key"), func.max(model.day).label("day"))
+    latest_days = latest_days.where(*criteria)
+
+    if day is not None:
+        latest_days = latest_days.where(model.day <= day)
+
+    latest_days = latest_days.group_by(group_by).subquery()
+
+    return (
+        select(model)
+        .where(*criteria)
+        .join(
+            latest_days,
+            and_(group_by == latest_days.c.group_key, model.day == latest_days.c.day),
+        )
+    )
@@ -0,0 +1,412 @@
+import asyncio
+import datetime
+import functools
+import logging
+import os
+import socket
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from models.candles import CandleBook, persist_candles
+from models.tick_store import TickStore, get_timestamp, tick_store
+from settings.database import SessionLocal
+from sqlalchemy.orm import sessionmaker
+
+# latest ticks kept in memory per ticker
+PRICE_RING_SIZE = int(os.environ.get("PRICE_RING_SIZE", 4096))
+# pending ticks that trigger a write, and the longest a tick waits for one
+PRICE_PERSIST_BATCH_SIZE = int(os.environ.get("PRICE_PERSIST_BATCH_SIZE", 20000))
+PRICE_PERSIST_INTERVAL = float(os.environ.get("PRICE_PERSIST_INTERVAL", 1.0))
+
+PRICE_FEED_HOST = os.environ.get("PRICE_FEED_HOST", "127.0.0.1")
+PRICE_FEED_PORT = int(os.environ.get("PRICE_FEED_PORT", 9999))
+# datagrams arriving while a packet is ingested wait in the socket buffer
+PRICE_FEED_RECEIVE_BUFFER = int(
+    os.environ.get("PRICE_FEED_RECEIVE_BUFFER", 8 * 1024 * 1024)
+)
+
+# wire and memory layout of a tick, 28 bytes; a feed packet is a run of them
+TICK_DTYPE = np.dtype(
+    [
+        ("ticker_id", "<u4"),
+        # nanoseconds since the epoch, UTC
+        ("timestamp", "<i8"),
+        ("price", "<f8"),
+        ("volume", "<f8"),
+    ]
+)
+# ticks per packet that fit a UDP datagram
+PRICE_PACKET_SIZE = 2048
+
+logger = logging.getLogger(__name__)
+
+
+def decode_ticks(packet: bytes) -> np.ndarray:
+    if len(packet) % TICK_DTYPE.itemsize:
+        raise ValueError(
+            f"Packet length {len(packet)} is not a multiple of {TICK_DTYPE.itemsize}"
+        )
+
+    return np.frombuffer(packet, dtype=TICK_DTYPE)
+
+
+def encode_ticks(ticks: np.ndarray) -> bytes:
+    return np.ascontiguousarray(ticks, dtype=TICK_DTYPE).tobytes()
+
+
+class PriceRing:
+    """The latest ticks of a ticker in fixed size arrays, oldest overwritten."""
+
+    __slots__ = ("timestamps", "prices", "volumes", "count", "_next")
+
+    def __init__(self, size: int = PRICE_RING_SIZE):
+        self.timestamps = np.zeros(size, dtype=np.int64)
+        self.prices = np.zeros(size, dtype=np.float64)
+        self.volumes = np.zeros(size, dtype=np.float64)
+        # ticks ever appended, so min(count, size) are held
+        self.count = 0
+        self._next = 0
+
+    def __len__(self) -> int:
+        return min(self.count, len(self.prices))
+
+    def extend(self, timestamps: np.ndarray, prices: np.ndarray, volumes: np.ndarray):
+        size = len(self.prices)
+        count = len(prices)
+
+        if count > size:
+            # only the newest size ticks would survive anyway
+            self.count += count - size
+            self._next = (self._next + count - size) % size
+            timestamps, prices, volumes = (
+                timestamps[-size:],
+                prices[-size:],
+                volumes[-size:],
+            )
+            count = size
+
+        index = (self._next + np.arange(count)) % size
+        self.timestamps[index] = timestamps
+        self.prices[index] = prices
+        self.volumes[index] = volumes
+        self._next = (self._next + count) % size
+        self.count += count
+
+    def latest(self) -> Optional[Tuple[int, float, float]]:
+        """Timestamp, price and volume of the newest tick."""
+
+        if not self.count:
+            return None
+
+        i = self._next - 1
+
+        return (
+            int(self.timestamps[i]),
+            float(self.prices[i]),
+            float(self.volumes[i]),
+        )
+
+    def get_ticks(self, start: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Held ticks oldest first, from timestamp start on if given."""
+
+        order = np.roll(np.arange(len(self.prices)), -self._next)[-len(self) :]
+        ticks = {
+            "timestamp": self.timestamps[order],
+            "price": self.prices[order],
+            "volume": self.volumes[order],
+        }
+
+        if start is not None:
+            first = np.searchsorted(ticks["timestamp"], start)
+            ticks = {key: values[first:] for key, values in ticks.items()}
+
+        return ticks
+
+
+class PriceFeed:
+    """Latest prices per ticker in memory, appended to the tick store in
+    batches.
+
+    Ticks are expected in time order per ticker. The rings and the pending
+    batch belong to this process; other processes see the ticks once they
+    are written. Every tick also updates the candles, whose closed candles
+    are written to the database with each batch, and the open ones with the
+    last batch before the process stops.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        ring_size: int = PRICE_RING_SIZE,
+        batch_size: int = PRICE_PERSIST_BATCH_SIZE,
+        candles: Optional[CandleBook] = None,
+        store: TickStore = tick_store,
+    ):
+        self.ring_size = ring_size
+        self.batch_size = batch_size
+        self._session_factory = session_factory
+        self.candles = CandleBook() if candles is None else candles
+        self.store = store
+        self._rings: Dict[int, PriceRing] = {}
+        self._pending: List[np.ndarray] = []
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.ticks = 0
+        self.packets = 0
+        self.invalid_packets = 0
+        self.persisted = 0
+        self.flush_errors = 0
+
+    def get_ring(self, ticker_id: int) -> Optional[PriceRing]:
+        return self._rings.get(ticker_id)
+
+    def _get_or_create_ring(self, ticker_id: int) -> PriceRing:
+        ring = self._rings.get(ticker_id)
+
+        if ring is None:
+            ring = self._rings[ticker_id] = PriceRing(self.ring_size)
+
+        return ring
+
+    def ingest(self, ticker_id: int, timestamp: int, price: float, volume: float = 0):
+        self.ingest_ticks(
+            np.array([(ticker_id, timestamp, price, volume)], dtype=TICK_DTYPE)
+        )
+
+    def ingest_ticks(self, ticks: np.ndarray):
+        if not len(ticks):
+            return
+
+        ticker_ids = ticks["ticker_id"]
+
+        if (ticker_ids == ticker_ids[0]).all():
+            groups = [(int(ticker_ids[0]), ticks)]
+        else:
+            # stable, so every ticker keeps its time order
+            ticks = ticks[np.argsort(ticker_ids, kind="stable")]
+            unique_ids, starts = np.unique(ticks["ticker_id"], return_index=True)
+            groups = zip(unique_ids.tolist(), np.split(ticks, starts[1:]))
+
+        with self._lock:
+            for ticker_id, group in groups:
+                self._get_or_create_ring(ticker_id).extend(
+                    group["timestamp"], group["price"], group["volume"]
+                )
+
+            self.candles.update_ticks(
+                ticks["ticker_id"], ticks["timestamp"], ticks["price"], ticks["volume"]
+            )
+
+            # copied, the packet buffer may be reused by the caller
+            self._pending.append(ticks.copy())
+            self._pending_count += len(ticks)
+            self.ticks += len(ticks)
+
+    def ingest_packet(self, packet: bytes):
+        try:
+            ticks = decode_ticks(packet)
+        except ValueError:
+            self.invalid_packets += 1
+            raise
+
+        self.packets += 1
+        self.ingest_ticks(ticks)
+
+    @property
+    def pending(self) -> int:
+        return self._pending_count
+
+    def take_pending(self) -> np.ndarray:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_count = 0
+
+        if not pending:
+            return np.zeros(0, dtype=TICK_DTYPE)
+
+        return np.concatenate(pending)
+
+    def restore_pending(self, ticks: np.ndarray):
+        """Put back ticks taken but not written, ahead of newer ones."""
+
+        if not len(ticks):
+            return
+
+        with self._lock:
+            self._pending.insert(0, ticks)
+            self._pending_count += len(ticks)
+
+    def flush(self, include_open: bool = False) -> int:
+        """Write the pending ticks and closed candles, returns the count of
+        ticks.
+
+        include_open writes the open candles too, for a shutdown. What fails
+        to be written is pending again for the next flush. Ticks of a batch
+        the store took in part are appended twice, which the compaction of
+        the tick store removes.
+        """
+
+        with self._flush_lock:
+            ticks = self.take_pending()
+            candles = self.candles.take_pending()
+
+            if include_open:
+                candles.extend(self.candles.take_open())
+
+            try:
+                self.store.append_ticks(ticks)
+            except Exception:
+                self.restore_pending(ticks)
+                self.candles.restore_pending(candles)
+                self.flush_errors += 1
+                raise
+
+            self.persisted += len(ticks)
+
+            if candles:
+                try:
+                    with self._session_factory() as session:
+                        persist_candles(session, candles)
+                        session.commit()
+                except Exception:
+                    self.candles.restore_pending(candles)
+                    self.flush_errors += 1
+                    raise
+
+        return len(ticks)
+
+    def get_stats(self) -> dict:
+        return {
+            "tickers": len(self._rings),
+            "ring_size": self.ring_size,
+            "ticks": self.ticks,
+            "packets": self.packets,
+            "invalid_packets": self.invalid_packets,
+            "pending": self._pending_count,
+            "persisted": self.persisted,
+            "flush_errors": self.flush_errors,
+            "candles": self.candles.get_stats(),
+        }
+
+
+price_feed = PriceFeed()
+
+
+class PriceFeedProtocol(asyncio.DatagramProtocol):
+    """UDP listener, every datagram is a packet of encoded ticks."""
+
+    def __init__(self, feed: PriceFeed):
+        self.feed = feed
+
+    def datagram_received(self, data: bytes, addr):
+        try:
+            self.feed.ingest_packet(data)
+        except ValueError:
+            # counted by the feed; a bad datagram must not stop the listener
+            return
+
+
+async def persist_periodically(
+    feed: PriceFeed, interval: float = PRICE_PERSIST_INTERVAL
+):
+    """Flush feed every interval, or sooner once a batch is pending."""
+
+    loop = asyncio.get_running_loop()
+    waited = 0.0
+    step = min(interval, 0.05)
+
+    while True:
+        await asyncio.sleep(step)
+        waited += step
+
+        if feed.pending >= feed.batch_size or (feed.pending and waited >= interval):
+            try:
+                await loop.run_in_executor(None, feed.flush)
+            except Exception:
+                # the batch is pending again, tried once more after interval
+                logger.exception("Failed to persist the price feed")
+                await asyncio.sleep(interval)
+
+            waited = 0.0
+
+
+async def serve_price_feed(
+    feed: PriceFeed,
+    host: str = PRICE_FEED_HOST,
+    port: int = PRICE_FEED_PORT,
+    interval: float = PRICE_PERSIST_INTERVAL,
+):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: PriceFeedProtocol(feed), local_addr=(host, port)
+    )
+    transport.get_extra_info("socket").setsockopt(
+        socket.SOL_SOCKET, socket.SO_RCVBUF, PRICE_FEED_RECEIVE_BUFFER
+    )
+
+    try:
+        await persist_periodically(feed, interval)
+    finally:
+        transport.close()
+        await loop.run_in_executor(
+            None, functools.partial(feed.flush, include_open=True)
+        )
+
+
+class PriceSimulator:
+    """Deterministic random walk ticks for a set of tickers.
+
+    The same seed and arguments always give the same ticks, so a feed can
+    be replayed in tests and benchmarks. Ticks come in time order, the
+    tickers taking turns every interval.
+    """
+
+    def __init__(
+        self,
+        ticker_ids: Sequence[int],
+        seed: int = 0,
+        start: datetime.datetime = datetime.datetime(2024, 1, 2, 14, 30),
+        interval: datetime.timedelta = datetime.timedelta(milliseconds=1),
+        start_price: float = 100.0,
+        volatility: float = 0.0005,
+    ):
+        self.ticker_ids = np.asarray(ticker_ids, dtype=np.uint32)
+        self.seed = seed
+        self.start = get_timestamp(start)
+        self.interval = int(interval / datetime.timedelta(microseconds=1)) * 1000
+        self.start_price = start_price
+        self.volatility = volatility
+
+    def ticks(self, count: int, packet_size: int = PRICE_PACKET_SIZE):
+        """count ticks, in arrays of up to packet_size."""
+
+        rng = np.random.default_rng(self.seed)
+        prices = np.full(len(self.ticker_ids), self.start_price)
+
+        for first in range(0, count, packet_size):
+            n = min(packet_size, count - first)
+            positions = np.arange(first, first + n)
+            slots = positions % len(self.ticker_ids)
+
+            ticks = np.zeros(n, dtype=TICK_DTYPE)
+            ticks["ticker_id"] = self.ticker_ids[slots]
+            ticks["timestamp"] = self.start + positions * self.interval
+            ticks["volume"] = rng.integers(1, 500, n)
+
+            returns = np.exp(rng.normal(0, self.volatility, n))
+            for slot in range(len(self.ticker_ids)):
+                mask = slots == slot
+                if mask.any():
+                    path = prices[slot] * np.cumprod(returns[mask])
+                    ticks["price"][mask] = np.round(path, 4)
+                    prices[slot] = path[-1]
+
+            yield ticks
+
+    def packets(
+        self, count: int, packet_size: int = PRICE_PACKET_SIZE
+    ) -> Iterator[bytes]:
+        for ticks in self.ticks(count, packet_size):
+            yield encode_ticks(ticks)
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+REFERENCE_CACHE_SIZE = int(os.environ.get("REFERENCE_CACHE_SIZE", 4096))
+REFERENCE_CACHE_TTL = float(os.environ.get("REFERENCE_CACHE_TTL", 300))
+
+
+class ReferenceCache:
+    """Process-local LRU cache with a TTL, for rows that rarely change.
+
+    Entries are keyed by a tuple starting with the table name, so every entry
+    of a table can be invalidated at once. Other processes only see changes
+    once their entries expire.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = REFERENCE_CACHE_SIZE,
+        ttl: float = REFERENCE_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[
+            Tuple[Hashable, ...], Tuple[float, Any]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[Hashable, ...]) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return True, entry[1]
+
+    def set(self, key: Tuple[Hashable, ...], value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table_name: Optional[str] = None) -> None:
+        """Drop the entries of a table, or every entry."""
+
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+                return
+
+            for key in [key for key in self._entries if key[0] == table_name]:
+                del self._entries[key]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else None,
+            }
+
+
+reference_cache = ReferenceCache()
+
+
+def get_row_dict(row) -> dict:
+    return {
+        attribute.key: getattr(row, attribute.key)
+        for attribute in inspect(row).mapper.column_attrs
+    }
+
+
+async def get_reference(db: AsyncSession, model, **by) -> Optional[dict]:
+    """Columns of the first row of model matching by, read through the cache.
+
+    Rows are cached as plain dicts under the lookup and under their id, since
+    ORM instances are bound to the session that loaded them. Misses are not
+    cached, so a row created later is found without an invalidation.
+    """
+
+    key = (model.__tablename__, *sorted(by.items()))
+    found, value = reference_cache.get(key)
+
+    if found:
+        return value
+
+    row = await db.scalar(select(model).filter_by(**by).order_by(model.id).limit(1))
+
+    if row is None:
+        return None
+
+    value = get_row_dict(row)
+    reference_cache.set(key, value)
+    reference_cache.set((model.__tablename__, ("id", value["id"])), value)
+
+    return value
@@ -0,0 +1,121 @@
+import re
+
+from models import Base
+from models.common import Currency, Market, Platform, Ticker
+from sqlalchemy import column, event, func, literal_column, or_, select, table
+from sqlalchemy.engine import Connection
+
+# searched columns per model, the first one weighs the most in the ranking
+SEARCH_COLUMNS = {
+    Ticker: ("code", "title"),
+    Market: ("code", "title"),
+    Currency: ("code", "title"),
+    Platform: ("title", "url"),
+}
+SEARCH_WEIGHTS = (10.0, 1.0)
+
+SEARCH_TERM_RE = re.compile(r"\w+")
+
+
+def get_search_table_name(model) -> str:
+    return f"{model.__tablename__}_search"
+
+
+def get_search_statements(model) -> list:
+    """FTS5 table over the columns of model and the triggers syncing it."""
+
+    name = get_search_table_name(model)
+    source = model.__tablename__
+    columns = ", ".join(SEARCH_COLUMNS[model])
+    new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS[model])
+    old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS[model])
+
+    insert_new = f"INSERT INTO {name}(rowid, {columns}) VALUES (new.id, {new_values});"
+    delete_old = (
+        f"INSERT INTO {name}({name}, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values});"
+    )
+
+    return [
+        # external content, only the index is stored next to the source table
+        f"CREATE VIRTUAL TABLE {name} USING fts5({columns}, "
+        f"content='{source}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+        f"CREATE TRIGGER {name}_ai AFTER INSERT ON {source} BEGIN {insert_new} END",
+        f"CREATE TRIGGER {name}_ad AFTER DELETE ON {source} BEGIN {delete_old} END",
+        f"CREATE TRIGGER {name}_au AFTER UPDATE ON {source} "
+        f"BEGIN {delete_old} {insert_new} END",
+        # indexes rows that existed before the search table
+        f"INSERT INTO {name}({name}) VALUES ('rebuild')",
+    ]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_search_tables(target, connection: Connection, **kwargs):
+    if connection.dialect.name != "sqlite":
+        return
+
+    existing_tables = set(
+        connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).scalars()
+    )
+
+    for model in SEARCH_COLUMNS:
+        if get_search_table_name(model) in existing_tables:
+            continue
+
+        for statement in get_search_statements(model):
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def drop_search_tables(target, connection: Connection, **kwargs):
+    # the triggers go with their source tables, the search tables do not
+    if connection.dialect.name != "sqlite":
+        return
+
+    for model in SEARCH_COLUMNS:
+        connection.exec_driver_sql(
+            f"DROP TABLE IF EXISTS {get_search_table_name(model)}"
+        )
+
+
+def get_match_query(q: str) -> str:
+    # every term as a quoted prefix, so user input can not inject FTS syntax
+    return " ".join(f'"{term}"*' for term in SEARCH_TERM_RE.findall(q))
+
+
+def select_search(model, q: str, dialect_name: str):
+    """Rows of model with a term starting with each word of q, best first.
+
+    SQLite ranks matches from the FTS5 index with bm25, other databases fall
+    back to a prefix LIKE on the searched columns.
+    """
+
+    columns = SEARCH_COLUMNS[model]
+
+    if dialect_name != "sqlite":
+        return (
+            select(model)
+            .where(or_(*(getattr(model, field).like(f"{q}%") for field in columns)))
+            .order_by(getattr(model, columns[0]), model.id)
+        )
+
+    name = get_search_table_name(model)
+    search_table = table(name, column("rowid"))
+    match_query = get_match_query(q)
+
+    # nothing can match a query without terms
+    if not match_query:
+        return select(model).where(model.id.is_(None))
+
+    return (
+        select(model)
+        .join(search_table, search_table.c.rowid == model.id)
+        .where(literal_column(name).op("MATCH")(match_query))
+        .order_by(
+            func.bm25(literal_column(name), *SEARCH_WEIGHTS[: len(columns)]),
+            model.id,
+        )
+    )
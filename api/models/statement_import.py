@@ -0,0 +1,289 @@
+import codecs
+import csv
+import datetime
+import hashlib
+from itertools import islice
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from models import TimeStampedBase
+from models.common import Currency, Market, Platform, Ticker
+from models.journal import Transaction
+from models.ledger import apply_transactions
+from models.user import InvestmentAccount
+from settings.database import SessionLocal, get_or_create, run_unit_of_work
+from sqlalchemy import ForeignKey, String, UniqueConstraint, select
+from sqlalchemy.orm import Mapped, Session, mapped_column
+
+STATEMENT_CHUNK_SIZE = 500
+
+# ticker, market and platform are codes/titles, resolved through ReferenceLookup
+STATEMENT_COLUMNS = (
+    "ticker",
+    "market",
+    "currency",
+    "platform",
+    "type",
+    "price",
+    "count",
+    "commission",
+    "executed_at",
+    "description",
+    "notes",
+    "time_frame",
+)
+
+
+class StatementImport(TimeStampedBase):
+    __tablename__ = "statement_import"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    digest: Mapped[str] = mapped_column(String(64), index=True)
+    filename: Mapped[Optional[str]] = mapped_column(default=None, nullable=True)
+    investment_account_id: Mapped[int] = mapped_column(
+        ForeignKey("investment_account.id"), index=True
+    )
+    committed_rows: Mapped[int] = mapped_column(default=0)
+    error_count: Mapped[int] = mapped_column(default=0)
+    is_completed: Mapped[bool] = mapped_column(default=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "digest",
+            "investment_account_id",
+            name="_statement_import__digest_investment_account_uc",
+        ),
+    )
+
+
+class ReferenceLookup:
+    """Ticker and platform ids by code, loaded once per import."""
+
+    def __init__(self, session: Session):
+        self._tickers: Dict[Tuple[str, str, str], int] = {}
+        # None marks a (ticker, market) pair listed in more than one currency
+        self._tickers_by_market: Dict[Tuple[str, str], Optional[int]] = {}
+
+        for ticker_id, ticker_code, market_code, currency_code in session.execute(
+            select(Ticker.id, Ticker.code, Market.code, Currency.code)
+            .join(Ticker.market)
+            .join(Market.currency)
+        ):
+            key = (ticker_code.upper(), market_code.upper())
+            self._tickers[(*key, currency_code.upper())] = ticker_id
+            self._tickers_by_market[key] = (
+                None if key in self._tickers_by_market else ticker_id
+            )
+
+        self._platforms: Dict[str, int] = {
+            title.lower(): platform_id
+            for platform_id, title in session.execute(
+                select(Platform.id, Platform.title)
+            )
+        }
+
+    def get_ticker_id(
+        self, ticker_code: str, market_code: str, currency_code: Optional[str] = None
+    ) -> Optional[int]:
+        key = (ticker_code.upper(), market_code.upper())
+
+        if currency_code:
+            return self._tickers.get((*key, currency_code.upper()))
+
+        return self._tickers_by_market.get(key)
+
+    def get_platform_id(self, platform: str) -> Optional[int]:
+        return self._platforms.get(platform.lower())
+
+
+def get_file_digest(file: BinaryIO) -> str:
+    digest = hashlib.sha256()
+
+    for block in iter(lambda: file.read(1 << 16), b""):
+        digest.update(block)
+
+    file.seek(0)
+
+    return digest.hexdigest()
+
+
+def parse_statement_row(
+    row: dict,
+    lookup: ReferenceLookup,
+    investment_account_id: int,
+    executed_by_id: int,
+) -> dict:
+    ticker_id = lookup.get_ticker_id(row["ticker"], row["market"], row.get("currency"))
+    if ticker_id is None:
+        raise ValueError(f"Unknown ticker: {row['ticker']} ({row['market']})")
+
+    platform_id = lookup.get_platform_id(row["platform"])
+    if platform_id is None:
+        raise ValueError(f"Unknown platform: {row['platform']}")
+
+    price = float(row["price"])
+    count = float(row["count"])
+    commission = float(row.get("commission") or 0)
+    if price < 0 or count <= 0 or commission < 0:
+        raise ValueError("Invalid price, count or commission")
+
+    return {
+        "ticker_id": ticker_id,
+        "price": price,
+        "count": count,
+        "commission": commission,
+        "type": Transaction.Type(row["type"].upper()),
+        "investment_account_id": investment_account_id,
+        "platform_id": platform_id,
+        "executed_at": datetime.datetime.fromisoformat(row["executed_at"]),
+        "executed_by_id": executed_by_id,
+        "description": row.get("description") or "",
+        "notes": row.get("notes") or "",
+        "time_frame": (
+            Transaction.TimeFrame(row["time_frame"].upper())
+            if row.get("time_frame")
+            else None
+        ),
+    }
+
+
+def apply_statement_chunk(
+    session: Session,
+    statement_import: StatementImport,
+    candidate_transactions: List[Tuple[int, dict]],
+    row_count: int,
+    parse_error_count: int,
+) -> List[dict]:
+    # the progress is counted in the transaction of the chunk, so a retried
+    # chunk is neither applied nor counted twice
+    _, apply_errors = apply_transactions(session, candidate_transactions)
+
+    statement_import.committed_rows += row_count
+    statement_import.error_count += parse_error_count + len(apply_errors)
+
+    return apply_errors
+
+
+def import_statement(
+    session: Session,
+    file: BinaryIO,
+    investment_account_id: int,
+    executed_by_id: Optional[int] = None,
+    filename: Optional[str] = None,
+    chunk_size: int = STATEMENT_CHUNK_SIZE,
+) -> Iterator[Tuple[StatementImport, List[dict]]]:
+    """Stream a broker statement CSV into the journal.
+
+    Rows are parsed lazily and applied through apply_transactions in chunks of
+    chunk_size, with a commit per chunk. The import progress is committed with
+    each chunk, so importing the same file into the same account again resumes
+    after the last committed chunk. Yields the import and its row errors after
+    every commit. Raises ValueError for an unknown investment account.
+    """
+
+    investment_account = session.get(InvestmentAccount, investment_account_id)
+
+    if investment_account is None:
+        raise ValueError(f"Unknown investment account: {investment_account_id}")
+
+    digest = get_file_digest(file)
+
+    statement_import, _ = get_or_create(
+        session,
+        StatementImport,
+        digest=digest,
+        investment_account_id=investment_account_id,
+    )
+    statement_import.filename = filename or statement_import.filename
+    session.commit()
+
+    if statement_import.is_completed:
+        return
+
+    if executed_by_id is None:
+        executed_by_id = investment_account.owner_id
+
+    lookup = ReferenceLookup(session)
+
+    # decoded line by line rather than through io.TextIOWrapper, which needs
+    # readable() and friends that a SpooledTemporaryFile upload lacks before
+    # Python 3.11; csv joins the lines of a quoted field split across them
+    rows = islice(
+        enumerate(csv.DictReader(codecs.iterdecode(file, "utf-8-sig"))),
+        statement_import.committed_rows,
+        None,
+    )
+
+    while chunk := list(islice(rows, chunk_size)):
+        candidate_transactions = []
+        errors = []
+
+        for index, row in chunk:
+            try:
+                candidate_transactions.append(
+                    (
+                        index,
+                        parse_statement_row(
+                            row, lookup, investment_account_id, executed_by_id
+                        ),
+                    )
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                errors.append({"index": index, "detail": str(e)})
+
+        apply_errors = run_unit_of_work(
+            session,
+            apply_statement_chunk,
+            statement_import,
+            candidate_transactions,
+            len(chunk),
+            len(errors),
+        )
+        errors = sorted(errors + apply_errors, key=lambda error: error["index"])
+
+        yield statement_import, errors
+
+    statement_import.is_completed = True
+    session.commit()
+
+
+def run_statement_import(
+    file: BinaryIO,
+    investment_account_id: int,
+    executed_by_id: Optional[int] = None,
+    filename: Optional[str] = None,
+    chunk_size: int = STATEMENT_CHUNK_SIZE,
+    max_errors: int = 100,
+) -> dict:
+    """Run a whole import on its own session, returning a summary of it."""
+
+    errors = []
+
+    with SessionLocal() as session:
+        statement_import = None
+
+        for statement_import, chunk_errors in import_statement(
+            session,
+            file,
+            investment_account_id,
+            executed_by_id=executed_by_id,
+            filename=filename,
+            chunk_size=chunk_size,
+        ):
+            errors.extend(chunk_errors[: max_errors - len(errors)])
+
+        if statement_import is None:
+            statement_import = session.scalar(
+                select(StatementImport).where(
+                    StatementImport.digest == get_file_digest(file),
+                    StatementImport.investment_account_id == investment_account_id,
+                )
+            )
+
+        return {
+            "id": statement_import.id,
+            "filename": statement_import.filename,
+            "committed_rows": statement_import.committed_rows,
+            "error_count": statement_import.error_count,
+            "is_completed": statement_import.is_completed,
+            "errors": errors,
+        }
@@ -0,0 +1,405 @@
+import datetime
+import fcntl
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# one directory per ticker under it, relative to the api directory
+TICK_STORE_DIR = os.environ.get("TICK_STORE_DIR", "db/ticks")
+# ticks per entry of the sparse time index
+TICK_STORE_INDEX_STRIDE = int(os.environ.get("TICK_STORE_INDEX_STRIDE", 4096))
+
+# a file of fixed-width little-endian values per column
+COLUMNS = {
+    # nanoseconds since the epoch, UTC
+    "timestamp": np.dtype("<i8"),
+    "price": np.dtype("<f8"),
+    "volume": np.dtype("<f8"),
+}
+INDEX_DTYPE = np.dtype("<i8")
+
+
+def get_timestamp(at: datetime.datetime) -> int:
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=datetime.timezone.utc)
+
+    return int(at.timestamp()) * 1_000_000_000 + at.microsecond * 1000
+
+
+def get_datetime(timestamp: int) -> datetime.datetime:
+    # naive UTC, as the rest of the models store datetimes
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        microseconds=timestamp // 1000
+    )
+
+
+class TickColumns(NamedTuple):
+    timestamp: np.ndarray
+    price: np.ndarray
+    volume: np.ndarray
+
+
+class TickStore:
+    """Append-only price history per ticker in memory-mapped column files.
+
+    A ticker's directory holds a generation of column files, a timestamp
+    every index_stride ticks as a sparse index, and a link to the current
+    generation. Appends go to the end of the current generation; compaction
+    writes a new one and switches the link, so readers never see a half
+    written generation. The columns are as long as the shortest of them,
+    which drops the tail of an append cut short.
+
+    Ticks are expected in time order per ticker. A ticker given one out of
+    order is marked unsorted: its reads copy instead of returning views, and
+    use no index, until it is compacted.
+    """
+
+    def __init__(
+        self, root: str = TICK_STORE_DIR, index_stride: int = TICK_STORE_INDEX_STRIDE
+    ):
+        self.root = root
+        self.index_stride = index_stride
+        # appends and compactions of this process; across processes a lock
+        # file per ticker
+        self._lock = threading.Lock()
+        self._maps: Dict[int, Tuple] = {}
+        self.appended = 0
+        self.compactions = 0
+        self.removed = 0
+
+    def _get_path(self, ticker_id: int, *names: str) -> str:
+        return os.path.join(self.root, str(ticker_id), *names)
+
+    def _get_generation(self, ticker_id: int) -> Optional[str]:
+        try:
+            return os.readlink(self._get_path(ticker_id, "current"))
+        except FileNotFoundError:
+            return None
+
+    def _set_generation(self, ticker_id: int, generation: str):
+        link = self._get_path(ticker_id, "current.new")
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(generation, link)
+        os.replace(link, self._get_path(ticker_id, "current"))
+
+    @contextmanager
+    def _locked(self, ticker_id: int):
+        os.makedirs(self._get_path(ticker_id), exist_ok=True)
+
+        with self._lock, open(self._get_path(ticker_id, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _get_count(self, ticker_id: int, generation: str) -> int:
+        return min(
+            os.stat(self._get_path(ticker_id, generation, name)).st_size
+            // dtype.itemsize
+            for name, dtype in COLUMNS.items()
+        )
+
+    def ticker_ids(self) -> List[int]:
+        if not os.path.isdir(self.root):
+            return []
+
+        return sorted(
+            int(name)
+            for name in os.listdir(self.root)
+            if name.isdigit() and self._get_generation(int(name)) is not None
+        )
+
+    def is_sorted(self, ticker_id: int) -> bool:
+        return not os.path.exists(self._get_path(ticker_id, "unsorted"))
+
+    def append(
+        self,
+        ticker_id: int,
+        timestamps: np.ndarray,
+        prices: np.ndarray,
+        volumes: np.ndarray,
+    ):
+        count = len(timestamps)
+
+        if not count:
+            return
+
+        columns = {
+            "timestamp": timestamps,
+            "price": prices,
+            "volume": volumes,
+        }
+
+        with self._locked(ticker_id):
+            generation = self._get_generation(ticker_id)
+
+            if generation is None:
+                generation = "0"
+                os.makedirs(self._get_path(ticker_id, generation), exist_ok=True)
+                for name in (*COLUMNS, "index"):
+                    open(self._get_path(ticker_id, generation, name), "ab").close()
+                self._set_generation(ticker_id, generation)
+
+            stored = self._get_count(ticker_id, generation)
+            timestamps = np.ascontiguousarray(timestamps, dtype=COLUMNS["timestamp"])
+            last = stored and int(
+                np.fromfile(
+                    self._get_path(ticker_id, generation, "timestamp"),
+                    dtype=COLUMNS["timestamp"],
+                    count=1,
+                    offset=(stored - 1) * COLUMNS["timestamp"].itemsize,
+                )[0]
+            )
+
+            # marked before the ticks are seen, so no read takes them as sorted
+            if (stored and timestamps[0] < last) or (np.diff(timestamps) < 0).any():
+                open(self._get_path(ticker_id, "unsorted"), "a").close()
+
+            for name, dtype in COLUMNS.items():
+                fd = os.open(self._get_path(ticker_id, generation, name), os.O_RDWR)
+                try:
+                    # past a torn append, if any
+                    os.ftruncate(fd, stored * dtype.itemsize)
+                    os.pwrite(
+                        fd,
+                        np.ascontiguousarray(columns[name], dtype=dtype).tobytes(),
+                        stored * dtype.itemsize,
+                    )
+                finally:
+                    os.close(fd)
+
+            # the timestamps at positions that are multiples of the stride, from
+            # the first missing one; an append cut short may have left out some
+            index_path = self._get_path(ticker_id, generation, "index")
+            indexed = min(
+                os.stat(index_path).st_size // INDEX_DTYPE.itemsize,
+                -(-stored // self.index_stride),
+            )
+            positions = np.arange(
+                indexed * self.index_stride, stored + count, self.index_stride
+            )
+            entries = np.concatenate(
+                [
+                    np.fromfile(
+                        self._get_path(ticker_id, generation, "timestamp"),
+                        dtype=INDEX_DTYPE,
+                        count=1,
+                        offset=position * COLUMNS["timestamp"].itemsize,
+                    )
+                    for position in positions[positions < stored].tolist()
+                ]
+                + [timestamps[positions[positions >= stored] - stored]]
+            )
+            fd = os.open(index_path, os.O_RDWR)
+            try:
+                os.ftruncate(fd, indexed * INDEX_DTYPE.itemsize)
+                os.pwrite(
+                    fd,
+                    entries.astype(INDEX_DTYPE).tobytes(),
+                    indexed * INDEX_DTYPE.itemsize,
+                )
+            finally:
+                os.close(fd)
+
+            self.appended += count
+
+    def append_ticks(self, ticks: np.ndarray):
+        """append for a structured array of ticks of any tickers, as a feed
+        packet; every ticker keeps the order it has in ticks."""
+
+        if not len(ticks):
+            return
+
+        ticks = ticks[np.argsort(ticks["ticker_id"], kind="stable")]
+        ticker_ids, starts = np.unique(ticks["ticker_id"], return_index=True)
+
+        for ticker_id, group in zip(ticker_ids.tolist(), np.split(ticks, starts[1:])):
+            self.append(ticker_id, group["timestamp"], group["price"], group["volume"])
+
+    def _get_maps(self, ticker_id: int) -> Optional[Tuple]:
+        """Count, columns and index of the current generation, mapped."""
+
+        # compaction may remove the generation between the link and the files
+        for _ in range(3):
+            generation = self._get_generation(ticker_id)
+
+            if generation is None:
+                return None
+
+            try:
+                count = self._get_count(ticker_id, generation)
+                cached = self._maps.get(ticker_id)
+
+                if cached is not None and cached[:2] == (generation, count):
+                    return cached[1:]
+
+                columns = {
+                    name: (
+                        np.memmap(
+                            self._get_path(ticker_id, generation, name),
+                            dtype=dtype,
+                            mode="r",
+                            shape=(count,),
+                        )
+                        if count
+                        else np.zeros(0, dtype=dtype)
+                    )
+                    for name, dtype in COLUMNS.items()
+                }
+                # entries past the columns belong to a torn append
+                entries = min(
+                    os.stat(self._get_path(ticker_id, generation, "index")).st_size
+                    // INDEX_DTYPE.itemsize,
+                    -(-count // self.index_stride),
+                )
+                index = (
+                    np.memmap(
+                        self._get_path(ticker_id, generation, "index"),
+                        dtype=INDEX_DTYPE,
+                        mode="r",
+                        shape=(entries,),
+                    )
+                    if entries
+                    else np.zeros(0, dtype=INDEX_DTYPE)
+                )
+            except FileNotFoundError:
+                continue
+
+            self._maps[ticker_id] = (generation, count, columns, index)
+            return count, columns, index
+
+        raise FileNotFoundError(self._get_path(ticker_id, "current"))
+
+    def _search(self, timestamps: np.ndarray, index: np.ndarray, timestamp: int):
+        """Position of the first tick at or after timestamp, reading the
+        index and one stride of timestamps."""
+
+        block = int(np.searchsorted(index, timestamp)) - 1
+        first = max(block, 0) * self.index_stride
+        last = (
+            (block + 1) * self.index_stride
+            if block + 1 < len(index)
+            else len(timestamps)
+        )
+
+        return first + int(np.searchsorted(timestamps[first:last], timestamp))
+
+    def read(
+        self, ticker_id: int, start: Optional[int] = None, end: Optional[int] = None
+    ) -> TickColumns:
+        """Ticks of ticker in [start, end), in nanoseconds, oldest first.
+
+        Views of the mapped files, valid after later appends and compactions.
+        """
+
+        # before the files; compaction unmarks once the sorted ones are current
+        is_sorted = self.is_sorted(ticker_id)
+        maps = self._get_maps(ticker_id)
+
+        if maps is None:
+            return TickColumns(
+                *(np.zeros(0, dtype=dtype) for dtype in COLUMNS.values())
+            )
+
+        count, columns, index = maps
+        timestamps = columns["timestamp"]
+
+        if not is_sorted:
+            selected = np.ones(count, dtype=bool)
+            if start is not None:
+                selected &= timestamps >= start
+            if end is not None:
+                selected &= timestamps < end
+            positions = np.flatnonzero(selected)
+            positions = positions[np.argsort(timestamps[positions], kind="stable")]
+
+            return TickColumns(*(columns[name][positions] for name in COLUMNS))
+
+        first = 0 if start is None else self._search(timestamps, index, start)
+        last = count if end is None else self._search(timestamps, index, end)
+
+        return TickColumns(*(columns[name][first:last] for name in COLUMNS))
+
+    def latest(self, ticker_id: int) -> Optional[Tuple[int, float, float]]:
+        """Timestamp, price and volume of the newest tick."""
+
+        if self.is_sorted(ticker_id):
+            maps = self._get_maps(ticker_id)
+            ticks = maps and TickColumns(*(maps[1][name][-1:] for name in COLUMNS))
+        else:
+            ticks = self.read(ticker_id)
+
+        if not ticks or not len(ticks.timestamp):
+            return None
+
+        return (
+            int(ticks.timestamp[-1]),
+            float(ticks.price[-1]),
+            float(ticks.volume[-1]),
+        )
+
+    def compact(self, ticker_id: int) -> int:
+        """Rewrite ticker in time order without repeated ticks, as a replayed
+        packet leaves, and rebuild its index. Returns the ticks removed."""
+
+        with self._locked(ticker_id):
+            generation = self._get_generation(ticker_id)
+
+            if generation is None:
+                return 0
+
+            count, columns, _ = self._get_maps(ticker_id)
+            # by every column, so repeats of a tick end up next to each other
+            # even among other ticks of the same timestamp
+            order = np.lexsort(
+                (columns["volume"], columns["price"], columns["timestamp"])
+            )
+            ticks = {name: np.asarray(columns[name][order]) for name in COLUMNS}
+
+            is_new = np.ones(count, dtype=bool)
+            is_new[1:] = np.logical_or.reduce(
+                [values[1:] != values[:-1] for values in ticks.values()]
+            )
+            ticks = {name: values[is_new] for name, values in ticks.items()}
+
+            new_generation = str(int(generation) + 1)
+            path = self._get_path(ticker_id, new_generation)
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+
+            index = ticks["timestamp"][:: self.index_stride]
+            for name, values in (*ticks.items(), ("index", index)):
+                with open(os.path.join(path, name), "wb") as f:
+                    f.write(values.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            self._set_generation(ticker_id, new_generation)
+            # readers holding the old files keep them until they unmap
+            shutil.rmtree(self._get_path(ticker_id, generation))
+            if not self.is_sorted(ticker_id):
+                os.remove(self._get_path(ticker_id, "unsorted"))
+
+            removed = count - int(is_new.sum())
+            self.compactions += 1
+            self.removed += removed
+
+        return removed
+
+    def get_stats(self) -> dict:
+        return {
+            "root": self.root,
+            "index_stride": self.index_stride,
+            "appended": self.appended,
+            "compactions": self.compactions,
+            "removed": self.removed,
+        }
+
+
+tick_store = TickStore()
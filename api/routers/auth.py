@@ -1,6 +1,13 @@
+import asyncio
+import hashlib
+import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Awaitable, Callable, List, Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -8,8 +15,9 @@ from jose import JWTError, jwt
 from models.user import User
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from settings.database import SessionLocal, engine, get_db
-from sqlalchemy.orm import Session
+from settings.database import get_async_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # sys.path.append("..")
 
@@ -27,28 +35,115 @@ class CreateUser(BaseModel):
 
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes ~200 ms of CPU per call and releases the GIL meanwhile, so it
+# runs on its own threads instead of blocking the event loop; one core is
+# left to the event loop by default
+PASSWORD_HASH_WORKERS = int(
+    os.environ.get("PASSWORD_HASH_WORKERS", max(1, min(4, (os.cpu_count() or 1) - 1)))
+)
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", 16))
+
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+# running plus queued calls, past which requests are turned away at once
+password_hash_slots = threading.BoundedSemaphore(
+    PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE
+)
+
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="user/token")
 
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+
+
+class TokenCache:
+    """LRU of verified tokens by digest, each dropped once its exp passes."""
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[bytes, Tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self.get_key(token)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, token: str, expires_at: float, user: dict) -> None:
+        with self._lock:
+            self._entries[self.get_key(token)] = (expires_at, user)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Forget the tokens of a user, so they are verified again."""
+
+        with self._lock:
+            for key in [
+                key for key, (_, user) in self._entries.items() if user["id"] == user_id
+            ]:
+                del self._entries[key]
+
+
+token_cache = TokenCache()
+
+# awaited with the user of a token when it is verified and before it is cached,
+# e.g. for a user status check; raising get_user_exception() rejects the token
+token_checks: List[Callable[[dict], Awaitable[None]]] = []
+
 
 router = APIRouter(
     prefix="/user", tags=["user"], responses={401: {"user": "Not authorized"}}
 )
 
 
-def get_password_hash(password):
-    return bcrypt_context.hash(password)
+async def run_password_hasher(function, *args):
+    if not password_hash_slots.acquire(blocking=False):
+        raise password_hasher_busy_exception()
 
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            password_hash_executor, function, *args
+        )
+    finally:
+        password_hash_slots.release()
 
-def verify_password(plain_password, hashed_password):
-    return bcrypt_context.verify(plain_password, hashed_password)
+
+async def get_password_hash(password):
+    return await run_password_hasher(bcrypt_context.hash, password)
+
+
+async def verify_password(plain_password, hashed_password):
+    return await run_password_hasher(
+        bcrypt_context.verify, plain_password, hashed_password
+    )
 
 
-def authenticate_user(email: str, password: str, db):
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(email: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(User).where(User.email == email).limit(1))
 
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
 
     return user
@@ -67,45 +162,59 @@ def create_access_token(
 
 
 async def get_current_user(token: str = Depends(oauth2_bearer)):
+    if (user := token_cache.get(token)) is not None:
+        return dict(user)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         user_id: int = payload.get("id")
         if email is None or user_id is None:
             raise get_user_exception()
-        return {"email": email, "id": user_id}
     except JWTError:
         raise get_user_exception()
 
+    user = {"email": email, "id": user_id}
+
+    for check in token_checks:
+        await check(user)
+
+    # tokens without an expiry are verified on every request
+    if payload.get("exp") is not None:
+        token_cache.set(token, payload["exp"], user)
+
+    return user
+
 
 @router.post("/create")
 async def create_new_user(
     create_user: CreateUser,
     # user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     create_user_model = User()
     create_user_model.email = create_user.email
     create_user_model.first_name = create_user.first_name
     create_user_model.last_name = create_user.last_name
 
-    hash_password = get_password_hash(create_user.password)
+    hash_password = await get_password_hash(create_user.password)
 
     create_user_model.hashed_password = hash_password
     create_user_model.is_active = True
 
     db.add(create_user_model)
-    db.commit()
-    db.refresh(create_user_model)
+    await db.commit()
+    await db.refresh(create_user_model)
 
     return create_user_model
 
 
 @router.post("/token")
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise token_exception()
     token_expires = timedelta(days=20)
@@ -130,3 +239,11 @@ def token_exception():
         headers={"WWW-Authenticate": "Bearer"},
     )
     return token_exception_response
+
+
+def password_hasher_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many concurrent password checks, try again shortly",
+        headers={"Retry-After": "1"},
+    )
@@ -1,7 +1,18 @@
 import datetime
-from typing import Optional
-
-from fastapi import APIRouter, Depends, Response, status
+from typing import List, Literal, Optional, Union
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from models.candles import Candle, CandleBar, select_candles
 from models.common import (
     Currency,
     LiquidAssetAccount,
@@ -10,12 +21,31 @@ from models.common import (
     Platform,
     Ticker,
 )
-from pydantic import BaseModel, Field
+from models.data_version import bump_data_versions, get_version_keys
+from models.journal import Transaction
+from models.ledger import record_liquid_asset_transaction
+from models.pagination import PAGE_MAX_LIMIT, SortKey, fetch_page
+from models.price_feed import price_feed
+from models.reference_cache import get_reference, reference_cache
+from models.search import select_search
+from models.tick_store import get_datetime, get_timestamp, tick_store
+from pydantic import BaseModel, Field, ValidationError
 from requests import get
 from routers.auth import get_current_user
-from settings.database import SessionLocal, get_db, get_or_create
-from sqlalchemy import null, or_
-from sqlalchemy.orm import Session
+from routers.utils import (
+    get_etag,
+    get_type_adapter,
+    is_not_modified,
+    not_modified_response,
+)
+from settings.database import (
+    get_async_db,
+    get_or_create,
+    get_read_db,
+    run_async_unit_of_work,
+)
+from sqlalchemy import delete, null, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
     prefix="",
@@ -24,6 +54,16 @@ router = APIRouter(
 )
 
 
+async def search_page(db: AsyncSession, model, q: str, limit: Optional[int]):
+    # ranked matches have no stable keyset, so a search is a single page
+    query = select_search(model, q, db.bind.dialect.name)
+
+    if limit is None:
+        return (await db.scalars(query)).all()
+
+    return {"results": (await db.scalars(query.limit(limit))).all(), "next": None}
+
+
 class CurrencyCreateModel(BaseModel):
     title: str
     code: str = Field(min_length=3)
@@ -36,47 +76,67 @@ class CurrencyCreateModel(BaseModel):
 async def create_currency(
     currency: CurrencyCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     created_currency = Currency(**currency.model_dump())
     db.add(created_currency)
-    db.commit()
-    db.refresh(created_currency)
+    await db.run_sync(bump_data_versions, Currency.__tablename__)
+    await db.commit()
+    reference_cache.invalidate(Currency.__tablename__)
+    await db.refresh(created_currency)
     return created_currency
 
 
 @router.get("/currencies")
 async def get_currencies(
+    request: Request,
+    response: Response,
     q: Optional[str] = None,
+    q_mode: Literal["contains", "prefix"] = "contains",
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Currency)
+    etag = await get_etag(db, request, get_version_keys(Currency.__tablename__))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+
+    if q and q_mode == "prefix":
+        return await search_page(db, Currency, q, limit)
+
+    query = select(Currency)
 
     if q:
-        query = query.filter(
+        query = query.where(
             or_(Currency.title.like(f"%{q}%"), Currency.code.like(f"%{q}%"))
         )
 
-    return query.all()
+    return await fetch_page(db, query, [SortKey(Currency.id)], limit, after)
 
 
 @router.get("/currency/{currency_code}")
 async def get_currency(
     currency_code: str,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return db.query(Currency).filter(Currency.code == currency_code.upper()).first()
+    return await get_reference(db, Currency, code=currency_code.upper())
 
 
 @router.delete("/currency/{currency_id}")
 async def delete_currency(
     currency_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    return db.query(Currency).filter(Currency.id == currency_id).delete()
+    result = await db.execute(delete(Currency).where(Currency.id == currency_id))
+    await db.run_sync(bump_data_versions, Currency.__tablename__)
+    await db.commit()
+    reference_cache.invalidate(Currency.__tablename__)
+
+    return result.rowcount
 
 
 class PlatformCreateModel(BaseModel):
@@ -90,47 +150,58 @@ class PlatformCreateModel(BaseModel):
 async def create_platform(
     platform: PlatformCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     created_platform = Platform(**platform.model_dump())
     db.add(created_platform)
-    db.commit()
-    db.refresh(created_platform)
+    await db.commit()
+    reference_cache.invalidate(Platform.__tablename__)
+    await db.refresh(created_platform)
     return created_platform
 
 
 @router.get("/platforms")
 async def get_platforms(
     q: Optional[str] = None,
+    q_mode: Literal["contains", "prefix"] = "contains",
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Platform)
+    if q and q_mode == "prefix":
+        return await search_page(db, Platform, q, limit)
+
+    query = select(Platform)
 
     if q:
-        query = query.filter(
+        query = query.where(
             or_(Platform.title.like(f"%{q}%"), Platform.url.like(f"%{q}%"))
         )
 
-    return query.all()
+    return await fetch_page(db, query, [SortKey(Platform.id)], limit, after)
 
 
 @router.get("/platform/{platform_id}")
 async def get_platform(
     platform_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return db.query(Platform).filter(Platform.id == platform_id).first()
+    return await get_reference(db, Platform, id=platform_id)
 
 
 @router.delete("/platform/{platform_id}")
 async def delete_platform(
     platform_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    return db.query(Platform).filter(Platform.id == platform_id).delete()
+    result = await db.execute(delete(Platform).where(Platform.id == platform_id))
+    await db.commit()
+    reference_cache.invalidate(Platform.__tablename__)
+
+    return result.rowcount
 
 
 class MarketCreateModel(BaseModel):
@@ -144,59 +215,76 @@ class MarketCreateModel(BaseModel):
 async def create_market(
     market: MarketCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     candidate_market = market.model_dump()
 
     candidate_market["currency_id"] = (
-        db.query(Currency)
-        .filter(Currency.code == market.currency_code.upper())
-        .first()
-        .id
-    )
+        await get_reference(db, Currency, code=market.currency_code.upper())
+    )["id"]
     candidate_market.pop("currency_code")
 
     created_market = Market(**candidate_market)
 
     db.add(created_market)
-    db.commit()
-    db.refresh(created_market)
+    await db.run_sync(bump_data_versions, Market.__tablename__)
+    await db.commit()
+    reference_cache.invalidate(Market.__tablename__)
+    await db.refresh(created_market)
 
     return created_market
 
 
 @router.get("/markets")
 async def get_markets(
+    request: Request,
+    response: Response,
     q: Optional[str] = None,
+    q_mode: Literal["contains", "prefix"] = "contains",
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Market)
+    etag = await get_etag(db, request, get_version_keys(Market.__tablename__))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+
+    if q and q_mode == "prefix":
+        return await search_page(db, Market, q, limit)
+
+    query = select(Market)
 
     if q:
-        query = query.filter(
+        query = query.where(
             or_(Market.title.like(f"%{q}%"), Market.code.like(f"%{q}%"))
         )
 
-    return query.all()
+    return await fetch_page(db, query, [SortKey(Market.id)], limit, after)
 
 
 @router.get("/market/{market_code}")
 async def get_market(
-    market_code: int,
+    market_code: str,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return db.query(Market).filter(Market.code == market_code).first()
+    return await get_reference(db, Market, code=market_code)
 
 
 @router.delete("/market/{market_code}")
 async def delete_market(
-    market_code: int,
+    market_code: str,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    return db.query(Market).filter(Market.code == market_code).delete()
+    result = await db.execute(delete(Market).where(Market.code == market_code))
+    await db.run_sync(bump_data_versions, Market.__tablename__)
+    await db.commit()
+    reference_cache.invalidate(Market.__tablename__)
+
+    return result.rowcount
 
 
 class TickerCreateModel(BaseModel):
@@ -213,47 +301,59 @@ class TickerCreateModel(BaseModel):
 async def create_ticker(
     ticker: TickerCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     candidate_ticker = ticker.model_dump()
 
-    currency = db.query(Currency).filter(Currency.code == ticker.currency_code).first()
+    currency = await get_reference(db, Currency, code=ticker.currency_code)
     candidate_ticker.pop("currency_code")
 
     candidate_ticker["market_id"] = (
-        db.query(Market)
-        .filter(
-            Market.code == ticker.market_code.upper(), Market.currency_id == currency.id
+        await get_reference(
+            db, Market, code=ticker.market_code.upper(), currency_id=currency["id"]
         )
-        .first()
-        .id
-    )
+    )["id"]
 
     candidate_ticker.pop("market_code")
 
     created_ticker = Ticker(**candidate_ticker)
 
     db.add(created_ticker)
-    db.commit()
-    db.refresh(created_ticker)
+    await db.run_sync(bump_data_versions, Ticker.__tablename__)
+    await db.commit()
+    reference_cache.invalidate(Ticker.__tablename__)
+    await db.refresh(created_ticker)
 
     return created_ticker
 
 
 @router.get("/tickers")
 async def get_tickers(
+    request: Request,
+    response: Response,
     q: Optional[str] = None,
+    q_mode: Literal["contains", "prefix"] = "contains",
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Ticker)
+    etag = await get_etag(db, request, get_version_keys(Ticker.__tablename__))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers["ETag"] = etag
+
+    if q and q_mode == "prefix":
+        return await search_page(db, Ticker, q, limit)
+
+    query = select(Ticker)
 
     if q:
-        query = query.filter(
+        query = query.where(
             or_(Ticker.title.like(f"%{q}%"), Ticker.code.like(f"%{q}%"))
         )
 
-    return query.all()
+    return await fetch_page(db, query, [SortKey(Ticker.id)], limit, after)
 
 
 @router.get("/ticker/{ticker_code}/{market_code}")
@@ -261,32 +361,224 @@ async def get_ticker(
     ticker_code: str,
     market_code: str,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    market = db.query(Market).filter(Market.code == market_code).first()
+    market = await get_reference(db, Market, code=market_code)
 
-    return (
-        db.query(Ticker)
-        .filter(Ticker.code == ticker_code, Ticker.market_id == market.id)
-        .first()
-    )
+    return await get_reference(db, Ticker, code=ticker_code, market_id=market["id"])
 
 
 @router.delete("/ticker/{ticker_code}/{market_code}")
 async def delete_ticker(
-    ticker_code: int,
-    market_code: int,
+    ticker_code: str,
+    market_code: str,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    market = await get_reference(db, Market, code=market_code)
+
+    result = await db.execute(
+        delete(Ticker).where(
+            Ticker.code == ticker_code, Ticker.market_id == market["id"]
+        )
+    )
+    await db.run_sync(bump_data_versions, Ticker.__tablename__)
+    await db.commit()
+    reference_cache.invalidate(Ticker.__tablename__)
+
+    return result.rowcount
+
+
+@router.get("/reference_cache")
+async def get_reference_cache_stats(user: dict = Depends(get_current_user)):
+    return reference_cache.get_stats()
+
+
+@router.get("/ticker/{ticker_code}/{market_code}/price")
+async def get_ticker_price(
+    ticker_code: str,
+    market_code: str,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    market = db.query(Market).filter(Market.code == market_code).first()
+    market = await get_reference(db, Market, code=market_code)
+    ticker = market and await get_reference(
+        db, Ticker, code=ticker_code, market_id=market["id"]
+    )
+
+    if ticker is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Ticker not found"
+        )
+
+    ring = price_feed.get_ring(ticker["id"])
+    latest = ring and ring.latest()
+
+    if latest is None:
+        # fed to another process, or not since this one started
+        latest = tick_store.latest(ticker["id"])
+
+    if latest is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No price for ticker"
+        )
+
+    timestamp, price, volume = latest
+
+    return {
+        "ticker_id": ticker["id"],
+        "price": price,
+        "volume": volume,
+        "timestamp": timestamp,
+        "at": get_datetime(timestamp),
+    }
+
 
-    return (
-        db.query(Ticker)
-        .filter(Ticker.code == ticker_code, Ticker.market_id == market.id)
-        .delete()
+@router.get("/ticker/{ticker_code}/{market_code}/candles")
+async def get_ticker_candles(
+    ticker_code: str,
+    market_code: str,
+    time_frame: Transaction.TimeFrame,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    limit: int = Query(PAGE_MAX_LIMIT, ge=1, le=PAGE_MAX_LIMIT),
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """The latest limit candles in [start, end), oldest first.
+
+    Recent candles, and the open one, come from memory; older ones from
+    candle, as written by whichever process the ticks were fed to.
+    """
+
+    market = await get_reference(db, Market, code=market_code)
+    ticker = market and await get_reference(
+        db, Ticker, code=ticker_code, market_id=market["id"]
     )
 
+    if ticker is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Ticker not found"
+        )
+
+    start = start and get_timestamp(start)
+    end = end and get_timestamp(end)
+    candles = [
+        candle
+        for candle in price_feed.candles.get_candles(ticker["id"], time_frame)
+        if (start is None or candle.start >= start)
+        and (end is None or candle.start < end)
+    ][-limit:]
+
+    if len(candles) < limit:
+        query = select_candles(
+            ticker["id"], time_frame, start, candles[0].start if candles else end
+        )
+        stored = (
+            await db.scalars(
+                query.order_by(Candle.start.desc()).limit(limit - len(candles))
+            )
+        ).all()
+        candles[:0] = [
+            CandleBar(
+                candle.ticker_id,
+                candle.time_frame,
+                candle.start,
+                candle.open,
+                candle.high,
+                candle.low,
+                candle.close,
+                candle.volume,
+                candle.tick_count,
+            )
+            for candle in reversed(stored)
+        ]
+
+    return [
+        {
+            "start": candle.start,
+            "at": get_datetime(candle.start),
+            "open": candle.open,
+            "high": candle.high,
+            "low": candle.low,
+            "close": candle.close,
+            "volume": candle.volume,
+            "tick_count": candle.tick_count,
+            "is_closed": candle.is_closed,
+        }
+        for candle in candles
+    ]
+
+
+class PriceTickModel(BaseModel):
+    ticker_id: int = Field(gt=0)
+    price: float = Field(gt=0)
+    volume: float = Field(default=0, ge=0)
+    # nanoseconds since the epoch, the time of arrival if not given
+    timestamp: Optional[int] = Field(default=None)
+
+
+@router.websocket("/ticker/feed")
+async def ingest_price_feed(websocket: WebSocket):
+    """Ticks as binary packets of encoded ticks, or as JSON text.
+
+    The token comes as ?token= or an Authorization header, since browsers
+    can not set headers on a WebSocket.
+    """
+
+    token = websocket.query_params.get("token") or websocket.headers.get(
+        "authorization", ""
+    ).removeprefix("Bearer ")
+
+    try:
+        await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+
+    try:
+        while True:
+            message = await websocket.receive()
+
+            if message["type"] == "websocket.disconnect":
+                break
+
+            try:
+                if message.get("bytes") is not None:
+                    price_feed.ingest_packet(message["bytes"])
+                else:
+                    ticks = get_type_adapter(
+                        Union[PriceTickModel, List[PriceTickModel]]
+                    ).validate_json(message["text"])
+                    now = get_timestamp(datetime.datetime.utcnow())
+
+                    for tick in ticks if isinstance(ticks, list) else [ticks]:
+                        price_feed.ingest(
+                            tick.ticker_id,
+                            tick.timestamp or now,
+                            tick.price,
+                            tick.volume,
+                        )
+            except (ValueError, ValidationError) as e:
+                await websocket.send_json({"error": str(e)})
+
+            if price_feed.pending >= price_feed.batch_size:
+                await run_in_threadpool(price_feed.flush)
+    finally:
+        await run_in_threadpool(price_feed.flush)
+
+
+@router.get("/price_feed")
+async def get_price_feed_stats(user: dict = Depends(get_current_user)):
+    return price_feed.get_stats()
+
+
+@router.get("/tick_store")
+async def get_tick_store_stats(user: dict = Depends(get_current_user)):
+    return tick_store.get_stats()
+
 
 class LiquidAssetAccountCreateModel(BaseModel):
     title: str = Field(default=None, nullable=True)
@@ -300,16 +592,16 @@ async def create_liquid_asset_account(
     liquid_asset_account: LiquidAssetAccountCreateModel,
     response: Response,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     liquid_asset_dict = liquid_asset_account.model_dump()
 
-    created_liquid_asset, created = get_or_create(
-        db, LiquidAssetAccount, **liquid_asset_dict
+    created_liquid_asset, created = await db.run_sync(
+        get_or_create, LiquidAssetAccount, **liquid_asset_dict
     )
 
-    db.commit()
-    db.refresh(created_liquid_asset)
+    await db.commit()
+    await db.refresh(created_liquid_asset)
 
     response.status_code = status.HTTP_201_CREATED if created else status.HTTP_200_OK
 
@@ -323,21 +615,21 @@ async def get_liquid_asset_account(
     owner_id: int,
     title: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     query = (
-        db.query(LiquidAssetAccount)
-        .filter(LiquidAssetAccount.platform_id == platform_id)
-        .filter(LiquidAssetAccount.currency_id == currency_id)
-        .filter(LiquidAssetAccount.owner_id == owner_id)
+        select(LiquidAssetAccount)
+        .where(LiquidAssetAccount.platform_id == platform_id)
+        .where(LiquidAssetAccount.currency_id == currency_id)
+        .where(LiquidAssetAccount.owner_id == owner_id)
     )
 
     if title is None:
-        query = query.filter(LiquidAssetAccount.title == title)
+        query = query.where(LiquidAssetAccount.title.is_(None))
     else:
-        query = query.like(f"%{title}%")
+        query = query.where(LiquidAssetAccount.title.like(f"%{title}%"))
 
-    return query.first()
+    return await db.scalar(query.limit(1))
 
 
 class LiquidAssetTransactionCreateModel(BaseModel):
@@ -354,23 +646,12 @@ class LiquidAssetTransactionCreateModel(BaseModel):
 async def create_liquid_asset_transaction(
     liquid_asset_transaction: LiquidAssetTransactionCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     status_code=status.HTTP_201_CREATED,
 ):
-    with db.begin():
-        created_liquid_asset_transaction = LiquidAssetTransaction(
-            **liquid_asset_transaction.model_dump()
-        )
-
-        db.add(created_liquid_asset_transaction)
-        db.flush()
-        db.refresh(created_liquid_asset_transaction)
-
-        created_liquid_asset_transaction.liquid_asset_account.add_transaction(
-            db, created_liquid_asset_transaction
-        )
-
-    db.refresh(created_liquid_asset_transaction)
-    db.refresh(created_liquid_asset_transaction.liquid_asset_account)
+    created_liquid_asset_transaction = await run_async_unit_of_work(
+        db, record_liquid_asset_transaction, liquid_asset_transaction.model_dump()
+    )
+    await db.refresh(created_liquid_asset_transaction)
 
     return created_liquid_asset_transaction
@@ -4,28 +4,66 @@ from audioop import avg
 from calendar import c
 from locale import currency
 from re import M
-from typing import List, Optional
-
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Literal, Optional, Union
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from models.common import Currency, Market, Platform, Ticker
+from models.common import Currency, LiquidAssetAccount, Market, Platform, Ticker
 from models.cumulative_ticker_holding import (
     CumulativeTickerHolding,
     CumulativeTickerHoldingFilter,
     CumulativeTickerHoldingOrderingOptions,
     CumulativeTickerHoldingRepository,
 )
+from models.data_version import ALL_SCOPES
+from models.export import (
+    CUMULATIVE_TICKER_HOLDING_EXPORT_COLUMNS,
+    EXPORT_MEDIA_TYPES,
+    TRANSACTION_EXPORT_COLUMNS,
+    filter_transactions,
+    select_cumulative_ticker_holding_export,
+    select_transaction_export,
+    stream_export,
+)
+from models.holding_replay import rebuild_holdings, rebuild_snapshots
 from models.journal import InvestmentAccount, Transaction
+from models.ledger import apply_transactions, record_transaction
+from models.ledger_queue import TradeReceipt, ledger_queue
+from models.pagination import PAGE_MAX_LIMIT, Page, SortKey, fetch_page, get_sort_keys
+from models.portfolio_snapshot import (
+    LiquidAssetSnapshot,
+    PortfolioSnapshot,
+    select_snapshots_as_of,
+)
+from models.statement_import import STATEMENT_CHUNK_SIZE, run_statement_import
 from models.user import User
 from passlib.context import CryptContext
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from routers.auth import get_current_user
-from routers.utils import generate_ordering_dict
-from settings.database import SessionLocal, engine, get_db
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import Session
+from routers.utils import (
+    generate_ordering_dict,
+    get_etag,
+    is_not_modified,
+    ndjson_response,
+    not_modified_response,
+    schema_response,
+)
+from settings.database import get_async_db, get_read_db, run_async_unit_of_work
+from sqlalchemy import and_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(
     prefix="/journal", tags=["journal"], responses={401: {"user": "Not authorized"}}
@@ -41,40 +79,42 @@ class InvestmentAccountCreateModel(BaseModel):
 async def create_account(
     investment_account: InvestmentAccountCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     status_code=status.HTTP_201_CREATED,
 ):
     created_account = InvestmentAccount(**investment_account.model_dump())
     db.add(created_account)
-    db.commit()
-    db.refresh(created_account)
+    await db.commit()
+    await db.refresh(created_account)
     return created_account
 
 
 @router.get("/accounts")
 async def get_accounts(
     q: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(InvestmentAccount)
+    query = select(InvestmentAccount)
 
     if q:
-        query = query.filter(InvestmentAccount.title.like(f"%{q}%"))
+        query = query.where(InvestmentAccount.title.like(f"%{q}%"))
 
-    return query.all()
+    return await fetch_page(db, query, [SortKey(InvestmentAccount.id)], limit, after)
 
 
 @router.get("/account/{investment_account_id}")
 async def get_currency(
     investment_account_id: str,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return (
-        db.query(InvestmentAccount)
-        .filter(InvestmentAccount.id == investment_account_id)
-        .first()
+    return await db.scalar(
+        select(InvestmentAccount)
+        .where(InvestmentAccount.id == investment_account_id)
+        .limit(1)
     )
 
 
@@ -82,12 +122,14 @@ async def get_currency(
 async def deactivate_account(
     investment_account_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db.query(InvestmentAccount).filter(
-        InvestmentAccount.id == investment_account_id
-    ).update({"is_active": False})
-    db.commit()
+    await db.execute(
+        update(InvestmentAccount)
+        .where(InvestmentAccount.id == investment_account_id)
+        .values(is_active=False)
+    )
+    await db.commit()
 
 
 class TransactionCreateModel(BaseModel):
@@ -105,54 +147,140 @@ class TransactionCreateModel(BaseModel):
     time_frame: Optional[Transaction.TimeFrame] = Field(default=None)
 
 
+def get_candidate_transaction(
+    transaction: TransactionCreateModel, user: dict, mode: str = "python"
+) -> dict:
+    """The fields of transaction, executed by user unless it names someone."""
+
+    candidate_transaction = transaction.model_dump(mode=mode)
+
+    # TODO: if user is admin, permit them to override executed_by_id
+    if candidate_transaction["executed_by_id"] is None:
+        candidate_transaction["executed_by_id"] = user["id"]
+
+    return candidate_transaction
+
+
 @router.post("/transaction", status_code=status.HTTP_201_CREATED)
 async def create_transaction(
     transaction: TransactionCreateModel,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    candidate_transaction = transaction.model_dump()
+    candidate_transaction = get_candidate_transaction(transaction, user)
+    return await run_async_unit_of_work(db, record_transaction, candidate_transaction)
 
-    # TODO: if user is admin, permit them to override executed_by_id
-    if candidate_transaction["executed_by_id"] is None:
-        candidate_transaction["executed_by_id"] = user["id"]
-    with db.begin():
-        cumulative_ticker_holding = (
-            db.query(CumulativeTickerHolding)
-            .filter(
-                CumulativeTickerHolding.ticker_id == candidate_transaction["ticker_id"]
-            )
-            .filter(
-                CumulativeTickerHolding.investment_account_id
-                == candidate_transaction["investment_account_id"]
+
+@router.post("/transactions/bulk", status_code=status.HTTP_201_CREATED)
+async def create_transactions_bulk(
+    transactions: List[dict],
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # rows are validated one by one so that a bad row does not reject the batch
+    candidate_transactions = []
+    errors = []
+
+    for index, transaction in enumerate(transactions):
+        try:
+            candidate_transaction = get_candidate_transaction(
+                TransactionCreateModel.model_validate(transaction), user
             )
-            .filter(CumulativeTickerHolding.is_completed == False)
-            .first()
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors(include_url=False)})
+            continue
+
+        candidate_transactions.append((index, candidate_transaction))
+
+    created_transactions, apply_errors = await run_async_unit_of_work(
+        db, apply_transactions, candidate_transactions
+    )
+
+    errors.extend(apply_errors)
+
+    return {
+        "transactions": created_transactions,
+        "errors": sorted(errors, key=lambda error: error["index"]),
+    }
+
+
+class TradeReceiptSchema(BaseModel):
+    id: int
+    status: TradeReceipt.Status
+    transaction_id: Optional[int]
+    detail: Optional[str]
+    created_at: datetime.datetime
+    applied_at: Optional[datetime.datetime]
+
+    class Config:
+        from_attributes = True
+
+
+@router.post(
+    "/transaction/enqueue",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=TradeReceiptSchema,
+)
+async def enqueue_transaction(
+    transaction: TransactionCreateModel,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # stored before it is queued, so the trade survives a restart
+    candidate_transaction = get_candidate_transaction(transaction, user, mode="json")
+    receipt = TradeReceipt(payload=candidate_transaction)
+    db.add(receipt)
+    await db.commit()
+
+    ledger_queue.submit(receipt.id)
+
+    return receipt
+
+
+@router.get("/transaction_receipt/{receipt_id}", response_model=TradeReceiptSchema)
+async def get_trade_receipt(
+    receipt_id: int,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    receipt = await db.get(TradeReceipt, receipt_id)
+
+    if receipt is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Trade receipt not found",
         )
 
-        if cumulative_ticker_holding is None:
-            cumulative_ticker_holding = CumulativeTickerHolding(
-                ticker_id=candidate_transaction["ticker_id"],
-                investment_account_id=candidate_transaction["investment_account_id"],
-            )
-            db.add(cumulative_ticker_holding)
-            db.flush()
-            db.refresh(cumulative_ticker_holding)
+    return receipt
 
-        candidate_transaction[
-            "cumulative_ticker_holding_id"
-        ] = cumulative_ticker_holding.id
 
-        created_transaction = Transaction(**candidate_transaction)
-        db.add(created_transaction)
-        db.flush()
+@router.get("/ledger_queue")
+async def get_ledger_queue_stats(user: dict = Depends(get_current_user)):
+    return ledger_queue.get_stats()
 
-        cumulative_ticker_holding.add_transaction(db, created_transaction)
 
-    db.refresh(created_transaction)
-    db.refresh(cumulative_ticker_holding)
+@router.post("/transactions/import", status_code=status.HTTP_201_CREATED)
+async def import_transactions(
+    file: UploadFile,
+    investment_account_id: int = Form(gt=0),
+    chunk_size: int = Form(default=STATEMENT_CHUNK_SIZE, gt=0),
+    user: dict = Depends(get_current_user),
+):
+    # the importer is synchronous and commits per chunk on its own session
+    try:
+        return await run_in_threadpool(
+            run_statement_import,
+            file.file,
+            investment_account_id,
+            executed_by_id=user["id"],
+            filename=file.filename,
+            chunk_size=chunk_size,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    return created_transaction
+
+TRANSACTION_ORDERING_PARAMS = ("id", "executed_at", "price", "count")
 
 
 @router.get("/transactions")
@@ -162,44 +290,35 @@ async def get_transactions(
     executed_by: Optional[int] = None,
     is_active: Optional[bool] = None,
     type: Optional[str] = None,
+    ordering: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(Transaction)
-
-    if q:
-        query = query.filter(
-            or_(
-                Transaction.ticker_id == Ticker.code.like(f"%{q}%"),
-                # Transaction.ticker.code.like(f"%{q}%"),
-                # Transaction.ticker.market.code.like(f"%{q}%"),
-                # Transaction.ticker.market.title.like(f"%{q}%"),
-                # Transaction.ticker.market.currency.code.like(f"%{q}%"),
-            )
-        )
-
-    if investment_account:
-        query = query.filter(Transaction.investment_account_id == investment_account)
-
-    if executed_by:
-        query = query.filter(Transaction.executed_by_id == executed_by)
+    query = filter_transactions(
+        select(Transaction), q, investment_account, executed_by, is_active, type
+    )
 
-    if is_active:
-        query = query.filter(Transaction.is_active == is_active)
+    sort_keys = get_sort_keys(
+        Transaction,
+        generate_ordering_dict(ordering, valid_params=TRANSACTION_ORDERING_PARAMS),
+    )
 
-    if type:
-        query = query.filter(Transaction.type == type)
+    if format == "ndjson":
+        return ndjson_response(db, query, sort_keys, limit, after)
 
-    return query.all()
+    return await fetch_page(db, query, sort_keys, limit, after)
 
 
 @router.get("/transaction/{transaction_id}")
 async def get_transaction(
     transaction_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return db.query(Transaction).filter(Transaction.id == transaction_id).first()
+    return await db.get(Transaction, transaction_id)
 
 
 class CumulativeTickerHoldingsSchema(BaseModel):
@@ -270,9 +389,12 @@ class CumulativeTickerHoldingsSchema(BaseModel):
 
 @router.get(
     "/cumulative_ticker_holdings",
-    response_model=List[CumulativeTickerHoldingsSchema],
+    response_model=Union[
+        Page[CumulativeTickerHoldingsSchema], List[CumulativeTickerHoldingsSchema]
+    ],
 )
 async def get_cumulative_ticker_holdings(
+    request: Request,
     investment_account_id: Optional[int] = None,
     ticker_id: Optional[int] = None,
     ticker_code: Optional[str] = None,
@@ -280,9 +402,28 @@ async def get_cumulative_ticker_holdings(
     market_code: Optional[str] = None,
     is_completed: Optional[bool] = None,
     ordering: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    after: Optional[str] = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
+    # holdings embed their ticker, market and currency
+    etag = await get_etag(
+        db,
+        request,
+        [
+            (Ticker.__tablename__, ALL_SCOPES),
+            (Market.__tablename__, ALL_SCOPES),
+            (Currency.__tablename__, ALL_SCOPES),
+            (
+                CumulativeTickerHolding.__tablename__,
+                investment_account_id or ALL_SCOPES,
+            ),
+        ],
+    )
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+
     repo = CumulativeTickerHoldingRepository(db)
 
     ordering_dict = generate_ordering_dict(
@@ -300,7 +441,13 @@ async def get_cumulative_ticker_holdings(
         is_completed=is_completed,
     )
 
-    response = repo.get_all(filter=filter, ordering=ordering_options)
+    response = await repo.get_all(
+        filter=filter,
+        ordering=ordering_options,
+        limit=limit,
+        after=after,
+        schema=CumulativeTickerHoldingsSchema,
+    )
 
     # BEGIN:Reporting purposes only
     yo = {
@@ -309,7 +456,7 @@ async def get_cumulative_ticker_holdings(
     }
     ticker_names = list()
     ticker_counts = list()
-    for item in response:
+    for item in response["results"] if isinstance(response, dict) else response:
         ticker_names.append(item.ticker.code)
         item_count = str(int(item.count))
         if item.ticker.code == "UDMY":
@@ -323,4 +470,208 @@ async def get_cumulative_ticker_holdings(
 
     # END:Reporting purposes only
 
-    return response
+    if isinstance(response, dict):
+        return schema_response(
+            Page[CumulativeTickerHoldingsSchema], response, headers={"ETag": etag}
+        )
+
+    return schema_response(
+        List[CumulativeTickerHoldingsSchema], response, headers={"ETag": etag}
+    )
+
+
+@router.post("/cumulative_ticker_holdings/replay")
+async def replay_cumulative_ticker_holdings(
+    investment_account_id: int,
+    ticker_id: Optional[int] = None,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    holding_count = await run_async_unit_of_work(
+        db, rebuild_holdings, investment_account_id, ticker_id
+    )
+
+    return {"holdings": holding_count}
+
+
+class PortfolioSnapshotSchema(BaseModel):
+    investment_account_id: int
+    ticker_id: int
+    day: datetime.date
+    count: float
+    cost_basis: float
+
+    class Config:
+        from_attributes = True
+
+
+class LiquidAssetSnapshotSchema(BaseModel):
+    liquid_asset_account_id: int
+    day: datetime.date
+    balance: float
+
+    class Config:
+        from_attributes = True
+
+
+class PortfolioAsOfSchema(BaseModel):
+    holdings: List[PortfolioSnapshotSchema]
+    liquid_assets: List[LiquidAssetSnapshotSchema]
+
+
+@router.get("/portfolio_snapshots", response_model=List[PortfolioSnapshotSchema])
+async def get_portfolio_snapshots(
+    investment_account_id: int,
+    ticker_id: Optional[int] = None,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = select(PortfolioSnapshot).where(
+        PortfolioSnapshot.investment_account_id == investment_account_id
+    )
+
+    if ticker_id is not None:
+        query = query.where(PortfolioSnapshot.ticker_id == ticker_id)
+    if start is not None:
+        query = query.where(PortfolioSnapshot.day >= start)
+    if end is not None:
+        query = query.where(PortfolioSnapshot.day <= end)
+
+    query = query.order_by(PortfolioSnapshot.ticker_id, PortfolioSnapshot.day)
+
+    return schema_response(
+        List[PortfolioSnapshotSchema], (await db.scalars(query)).all()
+    )
+
+
+@router.get("/portfolio_snapshots/as_of", response_model=PortfolioAsOfSchema)
+async def get_portfolio_as_of(
+    investment_account_id: int,
+    day: Optional[datetime.date] = None,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    owner_id = await db.scalar(
+        select(InvestmentAccount.owner_id).where(
+            InvestmentAccount.id == investment_account_id
+        )
+    )
+
+    if owner_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Investment account not found",
+        )
+
+    holdings = await db.scalars(
+        select_snapshots_as_of(
+            PortfolioSnapshot,
+            PortfolioSnapshot.ticker_id,
+            day,
+            PortfolioSnapshot.investment_account_id == investment_account_id,
+        ).order_by(PortfolioSnapshot.ticker_id)
+    )
+    liquid_assets = await db.scalars(
+        select_snapshots_as_of(
+            LiquidAssetSnapshot,
+            LiquidAssetSnapshot.liquid_asset_account_id,
+            day,
+            LiquidAssetSnapshot.liquid_asset_account_id.in_(
+                select(LiquidAssetAccount.id).where(
+                    LiquidAssetAccount.owner_id == owner_id
+                )
+            ),
+        ).order_by(LiquidAssetSnapshot.liquid_asset_account_id)
+    )
+
+    return schema_response(
+        PortfolioAsOfSchema,
+        {
+            # closed positions are kept as zero rows so later days stay correct
+            "holdings": [holding for holding in holdings if holding.count != 0],
+            "liquid_assets": liquid_assets.all(),
+        },
+    )
+
+
+@router.post("/portfolio_snapshots/rebuild")
+async def rebuild_portfolio_snapshots(
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    portfolio_count, liquid_asset_count = await run_async_unit_of_work(
+        db, rebuild_snapshots, user["id"]
+    )
+
+    return {
+        "portfolio_snapshots": portfolio_count,
+        "liquid_asset_snapshots": liquid_asset_count,
+    }
+
+
+def export_response(db: AsyncSession, query, columns, name: str, format: str):
+    # FastAPI closes db once the response is sent, after the last chunk
+    return StreamingResponse(
+        stream_export(db, query, columns, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
+
+
+@router.get("/export/transactions")
+async def export_transactions(
+    q: Optional[str] = None,
+    investment_account: Optional[int] = None,
+    executed_by: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    type: Optional[str] = None,
+    format: Literal["arrow", "parquet"] = "parquet",
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = filter_transactions(
+        select_transaction_export(),
+        q,
+        investment_account,
+        executed_by,
+        is_active,
+        type,
+    )
+
+    return export_response(
+        db, query, TRANSACTION_EXPORT_COLUMNS, "transactions", format
+    )
+
+
+@router.get("/export/cumulative_ticker_holdings")
+async def export_cumulative_ticker_holdings(
+    investment_account_id: Optional[int] = None,
+    ticker_id: Optional[int] = None,
+    ticker_code: Optional[str] = None,
+    market_id: Optional[int] = None,
+    market_code: Optional[str] = None,
+    is_completed: Optional[bool] = None,
+    format: Literal["arrow", "parquet"] = "parquet",
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = select_cumulative_ticker_holding_export(
+        CumulativeTickerHoldingFilter(
+            investment_account_id=investment_account_id,
+            ticker_id=ticker_id,
+            ticker_code=ticker_code,
+            market_id=market_id,
+            market_code=market_code,
+            is_completed=is_completed,
+        )
+    )
+
+    return export_response(
+        db,
+        query,
+        CUMULATIVE_TICKER_HOLDING_EXPORT_COLUMNS,
+        "cumulative_ticker_holdings",
+        format,
+    )
@@ -0,0 +1,52 @@
+import models
+import models.cumulative_ticker_holding  # noqa: F401
+import pytest
+from benchmarks.seed import get_owner_and_market
+from models.common import LiquidAssetAccount, Platform, Ticker
+from models.user import InvestmentAccount
+from settings.engine import create_profiled_engine
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # a file, so tests can open sessions from several threads
+    engine = create_profiled_engine(f"sqlite:///{tmp_path / 'db.sqlite3'}")
+    models.Base.metadata.create_all(engine)
+
+    yield engine
+
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def ids(engine) -> dict:
+    """An owner with one investment account, two tickers and a platform."""
+
+    with Session(engine) as session:
+        owner, market = get_owner_and_market()
+        tickers = [
+            Ticker(title="Apple", code="AAPL", market=market),
+            Ticker(title="Nvidia", code="NVDA", market=market),
+        ]
+        platform = Platform(title="test")
+        investment_account = InvestmentAccount(title="test", owner=owner)
+        liquid_asset_account = LiquidAssetAccount(
+            currency=market.currency, owner=owner, platform=platform, balance=0
+        )
+        session.add_all((*tickers, investment_account, liquid_asset_account))
+        session.commit()
+
+        return {
+            "owner_id": owner.id,
+            "ticker_ids": [ticker.id for ticker in tickers],
+            "platform_id": platform.id,
+            "investment_account_id": investment_account.id,
+            "liquid_asset_account_id": liquid_asset_account.id,
+        }
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+from benchmarks.holding_queries import run
+from models.cumulative_ticker_holding import (
+    CumulativeTickerHoldingFilter,
+    CumulativeTickerHoldingOrderingOptions,
+)
+from sqlalchemy import asc, desc
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {
+            "filter": CumulativeTickerHoldingFilter(),
+            "ordering": CumulativeTickerHoldingOrderingOptions(id=asc),
+        },
+        # the ticker join shared by the filter, the ordering and the loader
+        {
+            "filter": CumulativeTickerHoldingFilter(market_code="NASDAQGS"),
+            "ordering": CumulativeTickerHoldingOrderingOptions(ticker_code=asc),
+        },
+        {
+            "filter": CumulativeTickerHoldingFilter(is_completed=False),
+            "ordering": CumulativeTickerHoldingOrderingOptions(total_buy_amount=desc),
+            "limit": 1000,
+        },
+    ],
+)
+def test_get_all_statement_count_does_not_grow_with_rows(tmp_path, kwargs):
+    counts = [
+        asyncio.run(
+            run(f"sqlite+aiosqlite:///{tmp_path / f'{rows}.sqlite3'}", rows, **kwargs)
+        )["queries"]
+        for rows in (2, 50)
+    ]
+
+    assert counts[0] == counts[1]
@@ -0,0 +1,285 @@
+import datetime
+import random
+
+import numpy as np
+import pytest
+from models.cumulative_ticker_holding import CumulativeTickerHolding
+from models.holding_replay import rebuild_holdings, replay_holdings
+from models.journal import Transaction
+from models.ledger import apply_transactions
+from sqlalchemy import select
+
+HOLDING_FIELDS = (
+    "avg_cost",
+    "count",
+    "total_buys",
+    "total_sells",
+    "total_commission_cost",
+    "total_buy_amount",
+    "total_sell_amount",
+    "is_completed",
+    "first_transaction_at",
+    "last_transaction_at",
+)
+COUNTS = (1.0, 2.0, 3.0, 0.5, 0.25, 1.75, 10.0)
+
+
+def get_trades(rng: random.Random, ticker_ids: list, count: int) -> list:
+    """Random trades in id order, executed in another order, a few inactive.
+
+    Sells close the position exactly now and then, and sometimes exceed the
+    open count so apply_transaction rejects them.
+    """
+
+    start = datetime.datetime(2024, 1, 1)
+    minutes = rng.sample(range(count * 10), count)
+    trades = []
+
+    for id, minute in enumerate(minutes, start=1):
+        is_buy = rng.random() < 0.55
+        trades.append(
+            {
+                "id": id,
+                "ticker_id": rng.choice(ticker_ids),
+                "investment_account_id": 1,
+                "type": Transaction.Type.BUY if is_buy else Transaction.Type.SELL,
+                "price": round(rng.uniform(1, 500), 4),
+                "count": rng.choice(COUNTS),
+                "commission": rng.choice((0.0, 0.5, 1.25)),
+                "executed_at": start
+                + datetime.timedelta(minutes=minute, microseconds=rng.randrange(1000)),
+                "is_active": rng.random() < 0.85,
+            }
+        )
+
+    # sells of the whole open count, in execution order, so positions close
+    open_counts = {}
+    for trade in sorted(trades, key=lambda trade: (trade["executed_at"], trade["id"])):
+        if not trade["is_active"]:
+            continue
+
+        open_count = open_counts.get(trade["ticker_id"], 0)
+
+        if trade["type"] == Transaction.Type.BUY:
+            open_counts[trade["ticker_id"]] = open_count + trade["count"]
+        elif open_count and rng.random() < 0.3:
+            trade["count"] = open_count
+            open_counts[trade["ticker_id"]] = 0
+        elif trade["count"] <= open_count:
+            open_counts[trade["ticker_id"]] = open_count - trade["count"]
+
+    return trades
+
+
+def get_columns(trades: list) -> dict:
+    """The columns load_transaction_arrays reads, in its order."""
+
+    trades = sorted(
+        trades,
+        key=lambda trade: (trade["ticker_id"], trade["executed_at"], trade["id"]),
+    )
+
+    return {
+        "id": np.array([trade["id"] for trade in trades], dtype=np.int64),
+        "ticker_id": np.array([trade["ticker_id"] for trade in trades], dtype=np.int64),
+        "is_buy": np.array(
+            [trade["type"] == Transaction.Type.BUY for trade in trades], dtype=bool
+        ),
+        "price": np.array([trade["price"] for trade in trades], dtype=np.float64),
+        "count": np.array([trade["count"] for trade in trades], dtype=np.float64),
+        "commission": np.array(
+            [trade["commission"] for trade in trades], dtype=np.float64
+        ),
+        "executed_at": np.array(
+            [trade["executed_at"] for trade in trades], dtype="datetime64[us]"
+        ),
+        "is_active": np.array([trade["is_active"] for trade in trades], dtype=bool),
+    }
+
+
+def apply_one_by_one(trades: list) -> dict:
+    """Holdings per ticker as apply_transaction builds them, with the ids of
+    the trades applied to each."""
+
+    holdings = {}
+    open_holdings = {}
+
+    for trade in sorted(trades, key=lambda trade: (trade["executed_at"], trade["id"])):
+        if not trade["is_active"]:
+            continue
+
+        holding = open_holdings.get(trade["ticker_id"])
+        is_new = holding is None
+
+        if is_new:
+            holding = CumulativeTickerHolding(
+                ticker_id=trade["ticker_id"], investment_account_id=1
+            )
+
+        transaction = Transaction(
+            **{key: value for key, value in trade.items() if key != "id"}
+        )
+
+        if holding.apply_transaction(transaction) is None:
+            continue
+
+        if is_new:
+            open_holdings[trade["ticker_id"]] = holding
+            holdings.setdefault(trade["ticker_id"], []).append((holding, set()))
+        holdings[trade["ticker_id"]][-1][1].add(trade["id"])
+
+        if holding.is_completed:
+            del open_holdings[trade["ticker_id"]]
+
+    return {
+        ticker_id: [
+            ({field: getattr(holding, field) for field in HOLDING_FIELDS}, ids)
+            for holding, ids in ticker_holdings
+        ]
+        for ticker_id, ticker_holdings in holdings.items()
+    }
+
+
+def get_replayed(trades: list) -> dict:
+    replayed = {}
+
+    for ticker_id, holding, transaction_ids in replay_holdings(get_columns(trades)):
+        replayed.setdefault(ticker_id, []).append(
+            ({field: holding[field] for field in HOLDING_FIELDS}, transaction_ids)
+        )
+
+    return replayed
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_replay_matches_apply_transaction(seed):
+    rng = random.Random(seed)
+    trades = get_trades(rng, [1, 2, 3], rng.randrange(1, 80))
+    expected = apply_one_by_one(trades)
+    replayed = get_replayed(trades)
+    applied_ids = {
+        id for holdings in expected.values() for _, ids in holdings for id in ids
+    }
+
+    for ticker_id, holdings in replayed.items():
+        if ticker_id not in expected:
+            # no trade of the ticker applies, its trades still need a holding
+            assert len(holdings) == 1
+            assert holdings[0][0]["total_buys"] == 0
+            assert not holdings[0][0]["is_completed"]
+            continue
+
+        assert [holding for holding, _ in holdings] == [
+            holding for holding, _ in expected[ticker_id]
+        ]
+        assert [
+            set(transaction_ids.tolist()) & applied_ids
+            for _, transaction_ids in holdings
+        ] == [ids for _, ids in expected[ticker_id]]
+
+    assert set(expected) <= set(replayed)
+    # every trade belongs to exactly one holding
+    replayed_ids = [
+        id
+        for holdings in replayed.values()
+        for _, transaction_ids in holdings
+        for id in transaction_ids.tolist()
+    ]
+    assert sorted(replayed_ids) == [trade["id"] for trade in trades]
+
+
+@pytest.mark.parametrize(
+    "trailing",
+    [
+        {"type": Transaction.Type.BUY, "count": 1.0, "is_active": False},
+        # rejected, there is nothing open to sell from
+        {"type": Transaction.Type.SELL, "count": 1.0, "is_active": True},
+    ],
+)
+def test_trades_not_applied_after_completion_open_no_holding(trailing):
+    start = datetime.datetime(2024, 1, 1)
+    trade = {
+        "ticker_id": 1,
+        "investment_account_id": 1,
+        "price": 10.0,
+        "commission": 0.0,
+        "is_active": True,
+    }
+    trades = [
+        {**trade, "id": 1, "type": Transaction.Type.BUY, "count": 2.0},
+        {**trade, "id": 2, "type": Transaction.Type.SELL, "count": 2.0},
+        {**trade, "id": 3, **trailing},
+    ]
+    for i, trade in enumerate(trades):
+        trade["executed_at"] = start + datetime.timedelta(days=i)
+
+    (holding,) = get_replayed(trades)[1]
+
+    assert holding[0]["is_completed"]
+    assert holding[0]["last_transaction_at"] == trades[1]["executed_at"]
+    assert holding[1].tolist() == [1, 2, 3]
+
+
+def test_rebuild_holdings_matches_recorded_holdings(session, ids):
+    rng = random.Random(7)
+    trades = [
+        trade for trade in get_trades(rng, ids["ticker_ids"], 120) if trade["is_active"]
+    ]
+    open_counts = {}
+
+    for trade in sorted(trades, key=lambda trade: trade["executed_at"]):
+        open_count = open_counts.get(trade["ticker_id"], 0)
+        if trade["type"] == Transaction.Type.SELL and trade["count"] > open_count:
+            # it would open an empty holding
+            continue
+        open_counts[trade["ticker_id"]] = open_count + (
+            trade["count"] if trade["type"] == Transaction.Type.BUY else -trade["count"]
+        )
+
+        # one trade per batch, so every holding is updated trade by trade
+        _, errors = apply_transactions(
+            session,
+            [
+                (
+                    trade["id"],
+                    {
+                        **{key: value for key, value in trade.items() if key != "id"},
+                        "investment_account_id": ids["investment_account_id"],
+                        "platform_id": ids["platform_id"],
+                        "executed_by_id": ids["owner_id"],
+                    },
+                )
+            ],
+        )
+        assert errors == []
+        session.commit()
+
+    def get_holdings():
+        holdings = session.scalars(
+            select(CumulativeTickerHolding).order_by(
+                CumulativeTickerHolding.ticker_id, CumulativeTickerHolding.id
+            )
+        ).all()
+        transaction_ids = {holding.id: set() for holding in holdings}
+        for transaction in session.scalars(select(Transaction)):
+            transaction_ids[transaction.cumulative_ticker_holding_id].add(
+                transaction.id
+            )
+
+        return [
+            (
+                holding.ticker_id,
+                {field: getattr(holding, field) for field in HOLDING_FIELDS},
+                transaction_ids[holding.id],
+            )
+            for holding in holdings
+        ]
+
+    recorded = get_holdings()
+    assert any(holding["is_completed"] for _, holding, _ in recorded)
+
+    assert rebuild_holdings(session, ids["investment_account_id"]) == len(recorded)
+    session.commit()
+    session.expire_all()
+
+    assert get_holdings() == recorded
@@ -0,0 +1,163 @@
+import threading
+import time
+
+import models.ledger_queue
+from models.ledger_queue import LedgerQueue, TradeReceipt
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+
+def add_receipt(engine, ids: dict) -> int:
+    with Session(engine) as session:
+        receipt = TradeReceipt(
+            payload={
+                "ticker_id": ids["ticker_ids"][0],
+                "price": 100.0,
+                "count": 1.0,
+                "commission": 0.0,
+                "type": "BUY",
+                "investment_account_id": ids["investment_account_id"],
+                "platform_id": ids["platform_id"],
+                "executed_at": "2024-01-01T00:00:00",
+                "executed_by_id": ids["owner_id"],
+            }
+        )
+        session.add(receipt)
+        session.commit()
+
+        return receipt.id
+
+
+def get_statuses(engine, receipt_ids: list) -> list:
+    with Session(engine) as session:
+        return [session.get(TradeReceipt, id).status for id in receipt_ids]
+
+
+def join(ledger_queue: LedgerQueue):
+    # a worker that died would leave join blocked for good
+    thread = threading.Thread(target=ledger_queue.join, daemon=True)
+    thread.start()
+    thread.join(10)
+
+    assert not thread.is_alive(), "receipts left unsettled"
+
+
+def test_recovery_skips_submitted_receipts(engine, ids):
+    # left pending by an earlier process
+    receipt_ids = [add_receipt(engine, ids) for _ in range(3)]
+    ledger_queue = LedgerQueue(sessionmaker(engine), batch_wait=0)
+
+    # starts the worker, whose recovery finds this receipt pending too
+    receipt_ids.append(add_receipt(engine, ids))
+    ledger_queue.submit(receipt_ids[-1])
+    join(ledger_queue)
+    ledger_queue.stop()
+
+    assert ledger_queue.dequeued == 4
+    assert ledger_queue.settled == 4
+    assert get_statuses(engine, receipt_ids) == [TradeReceipt.Status.APPLIED] * 4
+
+
+def test_worker_survives_a_failing_reject(engine, ids, monkeypatch):
+    rejects = []
+    reject_trade_receipts = models.ledger_queue.reject_trade_receipts
+
+    def apply_trade_receipts(session, receipt_ids):
+        raise RuntimeError("apply")
+
+    def reject_once(session, receipt_ids, detail):
+        rejects.append(receipt_ids)
+
+        if len(rejects) == 1:
+            raise RuntimeError("reject")
+
+        return reject_trade_receipts(session, receipt_ids, detail)
+
+    monkeypatch.setattr(
+        models.ledger_queue, "apply_trade_receipts", apply_trade_receipts
+    )
+    monkeypatch.setattr(models.ledger_queue, "reject_trade_receipts", reject_once)
+    ledger_queue = LedgerQueue(sessionmaker(engine), batch_wait=0)
+    receipt_ids = [add_receipt(engine, ids)]
+
+    ledger_queue.submit(receipt_ids[0])
+    join(ledger_queue)
+    receipt_ids.append(add_receipt(engine, ids))
+    ledger_queue.submit(receipt_ids[1])
+    join(ledger_queue)
+
+    stats = ledger_queue.get_stats()
+    ledger_queue.stop()
+
+    assert stats["is_running"]
+    assert (stats["settled"], stats["failed"], stats["errors"]) == (0, 1, 1)
+    # the first is left for the next recovery
+    assert get_statuses(engine, receipt_ids) == [
+        TradeReceipt.Status.PENDING,
+        TradeReceipt.Status.REJECTED,
+    ]
+
+
+def test_only_the_failing_receipt_is_rejected(engine, ids, monkeypatch):
+    receipt_ids = [add_receipt(engine, ids) for _ in range(5)]
+    apply_trade_receipts = models.ledger_queue.apply_trade_receipts
+
+    def apply_all_but_one(session, batch):
+        if receipt_ids[2] in batch:
+            raise RuntimeError("apply")
+
+        return apply_trade_receipts(session, batch)
+
+    monkeypatch.setattr(models.ledger_queue, "apply_trade_receipts", apply_all_but_one)
+    ledger_queue = LedgerQueue(sessionmaker(engine), batch_wait=0)
+
+    # the others are recovered, so they share a batch with it
+    ledger_queue.submit(receipt_ids[-1])
+    join(ledger_queue)
+    stats = ledger_queue.get_stats()
+    ledger_queue.stop()
+
+    assert (stats["settled"], stats["failed"], stats["errors"]) == (4, 1, 0)
+    assert get_statuses(engine, receipt_ids) == [
+        TradeReceipt.Status.APPLIED,
+        TradeReceipt.Status.APPLIED,
+        TradeReceipt.Status.REJECTED,
+        TradeReceipt.Status.APPLIED,
+        TradeReceipt.Status.APPLIED,
+    ]
+
+
+def test_transient_failure_is_retried_by_recovery(engine, ids, monkeypatch):
+    failures = [1]
+    apply_trade_receipts = models.ledger_queue.apply_trade_receipts
+
+    def apply_after_a_failure(session, batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise OperationalError("UPDATE", {}, Exception("disk I/O error"))
+
+        return apply_trade_receipts(session, batch)
+
+    monkeypatch.setattr(
+        models.ledger_queue, "apply_trade_receipts", apply_after_a_failure
+    )
+    ledger_queue = LedgerQueue(sessionmaker(engine), batch_wait=0, recover_interval=0.1)
+    receipt_ids = [add_receipt(engine, ids)]
+
+    ledger_queue.submit(receipt_ids[0])
+    join(ledger_queue)
+
+    assert get_statuses(engine, receipt_ids) == [TradeReceipt.Status.PENDING]
+    assert ledger_queue.get_stats()["deferred"] == 1
+
+    for _ in range(100):
+        if get_statuses(engine, receipt_ids) != [TradeReceipt.Status.PENDING]:
+            break
+        time.sleep(0.05)
+
+    stats = ledger_queue.get_stats()
+    ledger_queue.stop()
+
+    assert get_statuses(engine, receipt_ids) == [TradeReceipt.Status.APPLIED]
+    assert (stats["settled"], stats["failed"], stats["errors"]) == (1, 0, 0)
+    assert stats["recoveries"] >= 2
@@ -0,0 +1,48 @@
+import datetime
+import random
+
+import pytest
+from models.portfolio_snapshot import LiquidAssetSnapshot, PortfolioSnapshot
+from sqlalchemy import select
+
+
+@pytest.mark.parametrize("update_returning", [True, False])
+def test_record_applies_deltas_to_the_day_and_later_ones(
+    engine, session, ids, monkeypatch, update_returning
+):
+    monkeypatch.setattr(engine.dialect, "update_returning", update_returning)
+    rng = random.Random(3)
+    start = datetime.date(2024, 1, 1)
+    deltas = [
+        (start + datetime.timedelta(days=rng.randrange(20)), rng.randrange(-5, 10))
+        for _ in range(60)
+    ]
+
+    # out of order, as backdated trades arrive
+    for day, delta in deltas:
+        PortfolioSnapshot.record(
+            session, ids["investment_account_id"], ids["ticker_ids"][0], day, delta, 0
+        )
+        LiquidAssetSnapshot.record(session, ids["liquid_asset_account_id"], day, delta)
+    session.commit()
+
+    expected = {
+        day: sum(delta for other, delta in deltas if other <= day) for day, _ in deltas
+    }
+
+    assert (
+        dict(
+            session.execute(
+                select(PortfolioSnapshot.day, PortfolioSnapshot.count)
+            ).all()
+        )
+        == expected
+    )
+    assert (
+        dict(
+            session.execute(
+                select(LiquidAssetSnapshot.day, LiquidAssetSnapshot.balance)
+            ).all()
+        )
+        == expected
+    )
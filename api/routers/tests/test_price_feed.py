@@ -0,0 +1,174 @@
+import asyncio
+import datetime
+
+import numpy as np
+import pytest
+from models.candles import Candle
+from models.journal import Transaction
+from models.price_feed import PriceFeed, PriceSimulator, persist_periodically
+from models.tick_store import TickStore
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, sessionmaker
+
+TICKER_IDS = [1, 2, 3]
+
+
+class FailingTickStore(TickStore):
+    """A tick store whose next appends fail after the first ticker."""
+
+    def __init__(self, root: str, failures: int):
+        super().__init__(root)
+        self.failures = failures
+
+    def append_ticks(self, ticks: np.ndarray):
+        if self.failures:
+            self.failures -= 1
+            # the store takes part of the batch before it fails
+            first = ticks[ticks["ticker_id"] == ticks["ticker_id"][0]]
+            self.append(
+                int(first["ticker_id"][0]),
+                first["timestamp"],
+                first["price"],
+                first["volume"],
+            )
+            raise OSError("disk full")
+
+        super().append_ticks(ticks)
+
+
+def get_ticks(count: int) -> np.ndarray:
+    # a ticker every minute, so candles close
+    return np.concatenate(
+        list(
+            PriceSimulator(
+                TICKER_IDS, seed=3, interval=datetime.timedelta(seconds=20)
+            ).ticks(count, 64)
+        )
+    )
+
+
+def check_persisted(engine, feed: PriceFeed, ticks: np.ndarray):
+    for ticker_id in TICKER_IDS:
+        feed.store.compact(ticker_id)
+        stored = feed.store.read(ticker_id)
+        expected = ticks[ticks["ticker_id"] == ticker_id]
+
+        assert (stored.timestamp == expected["timestamp"]).all()
+        assert (stored.price == expected["price"]).all()
+
+    with Session(engine) as session:
+        assert session.scalar(select(func.count(Candle.id))) == feed.candles.closed
+
+
+@pytest.mark.parametrize("failing", ["store", "candles"])
+def test_failed_flush_keeps_the_batch(engine, tmp_path, failing):
+    store = FailingTickStore(str(tmp_path / "ticks"), int(failing == "store"))
+    session_factory = sessionmaker(engine)
+    failures = [int(failing == "candles")]
+
+    def get_session():
+        if failures[0]:
+            failures[0] -= 1
+            raise OSError("database gone")
+
+        return session_factory()
+
+    feed = PriceFeed(session_factory=get_session, store=store)
+    ticks = get_ticks(600)
+    feed.ingest_ticks(ticks[:300])
+    closed = feed.candles.pending
+
+    with pytest.raises(OSError):
+        feed.flush()
+
+    assert feed.candles.pending == closed
+    assert feed.pending == (300 if failing == "store" else 0)
+    assert feed.get_stats()["flush_errors"] == 1
+
+    # ahead of the ticks that came in meanwhile
+    feed.ingest_ticks(ticks[300:])
+    feed.flush()
+
+    assert feed.pending == feed.candles.pending == 0
+    assert feed.persisted == 600
+    check_persisted(engine, feed, ticks)
+
+
+def test_persist_periodically_survives_a_failed_flush(engine, tmp_path):
+    feed = PriceFeed(
+        session_factory=sessionmaker(engine),
+        store=FailingTickStore(str(tmp_path / "ticks"), 1),
+    )
+    ticks = get_ticks(300)
+    feed.ingest_ticks(ticks)
+
+    async def run():
+        task = asyncio.create_task(persist_periodically(feed, interval=0.05))
+
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if feed.persisted:
+                break
+
+        task.cancel()
+
+    asyncio.run(run())
+
+    assert feed.get_stats()["flush_errors"] == 1
+    assert feed.persisted == 300
+    check_persisted(engine, feed, ticks)
+
+
+def get_stored_candles(engine) -> dict:
+    with Session(engine) as session:
+        return {
+            (candle.ticker_id, candle.time_frame, candle.start): (
+                candle.open,
+                candle.high,
+                candle.low,
+                candle.close,
+                candle.volume,
+                candle.tick_count,
+            )
+            for candle in session.scalars(select(Candle))
+        }
+
+
+def test_restart_keeps_the_open_candles(engine, tmp_path):
+    ticks = get_ticks(600)
+    uninterrupted = PriceFeed(session_factory=None, store=None)
+    uninterrupted.ingest_ticks(ticks)
+    expected = {
+        (candle.ticker_id, candle.time_frame, candle.start): candle[3:9]
+        for candle in (
+            uninterrupted.candles.take_pending() + uninterrupted.candles.take_open()
+        )
+    }
+
+    # stopped in the middle of a minute, as of every longer time frame
+    for part in (ticks[:301], ticks[301:]):
+        feed = PriceFeed(
+            session_factory=sessionmaker(engine),
+            store=TickStore(str(tmp_path / "ticks")),
+        )
+        feed.ingest_ticks(part)
+        feed.flush(include_open=True)
+
+    stored = get_stored_candles(engine)
+    first = ticks[ticks["ticker_id"] == TICKER_IDS[0]]
+
+    assert stored == expected
+    assert [
+        values
+        for (ticker_id, time_frame, _), values in stored.items()
+        if ticker_id == TICKER_IDS[0] and time_frame == Transaction.TimeFrame.YEARLY
+    ] == [
+        (
+            first["price"][0],
+            first["price"].max(),
+            first["price"].min(),
+            first["price"][-1],
+            first["volume"].sum(),
+            len(first),
+        )
+    ]
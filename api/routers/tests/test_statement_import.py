@@ -0,0 +1,14 @@
+import io
+
+import pytest
+from models.statement_import import StatementImport, import_statement
+from sqlalchemy import func, select
+
+
+def test_unknown_investment_account_is_rejected(session, ids):
+    file = io.BytesIO(b"ticker,market\n")
+
+    with pytest.raises(ValueError, match="Unknown investment account"):
+        list(import_statement(session, file, ids["investment_account_id"] + 1))
+
+    assert session.scalar(select(func.count(StatementImport.id))) == 0
@@ -0,0 +1,21 @@
+import numpy as np
+from models.tick_store import TickStore
+
+
+def test_compact_removes_repeats_among_ticks_of_one_timestamp(tmp_path):
+    store = TickStore(str(tmp_path / "ticks"))
+    timestamps = np.array([1, 1, 2], dtype=np.int64)
+    prices = np.array([10.0, 11.0, 12.0])
+    volumes = np.array([5.0, 5.0, 5.0])
+
+    # a replayed packet
+    for _ in range(2):
+        store.append(1, timestamps, prices, volumes)
+
+    assert store.compact(1) == 3
+
+    ticks = store.read(1)
+    assert ticks.timestamp.tolist() == [1, 1, 2]
+    assert ticks.price.tolist() == [10.0, 11.0, 12.0]
+    assert ticks.volume.tolist() == [5.0, 5.0, 5.0]
+    assert store.is_sorted(1)
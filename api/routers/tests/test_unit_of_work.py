@@ -0,0 +1,189 @@
+import datetime
+import threading
+
+import pytest
+import settings.database
+from models.common import LiquidAssetAccount, LiquidAssetTransaction
+from models.cumulative_ticker_holding import CumulativeTickerHolding
+from models.journal import Transaction
+from models.ledger import record_liquid_asset_transaction, record_transaction
+from settings.database import run_unit_of_work
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+WORKERS = 6
+ROUND_TRIPS = 15
+DEPOSIT = 100.0
+TOP_UP = 7.0
+
+
+def get_trade(ids: dict, type: Transaction.Type, price: float) -> dict:
+    return {
+        "ticker_id": ids["ticker_ids"][0],
+        "price": price,
+        "count": 1.0,
+        "commission": 1.0,
+        "type": type,
+        "investment_account_id": ids["investment_account_id"],
+        "platform_id": ids["platform_id"],
+        "executed_at": datetime.datetime(2024, 1, 1),
+        "executed_by_id": ids["owner_id"],
+    }
+
+
+def get_deposit(ids: dict) -> dict:
+    return {
+        "liquid_asset_account_id": ids["liquid_asset_account_id"],
+        "amount": DEPOSIT,
+        "type": LiquidAssetTransaction.Type.DEPOSIT,
+        "executed_at": datetime.datetime(2024, 1, 1),
+    }
+
+
+def get_account(session: Session, ids: dict) -> LiquidAssetAccount:
+    return session.get(
+        LiquidAssetAccount, ids["liquid_asset_account_id"], populate_existing=True
+    )
+
+
+def test_concurrent_units_of_work_keep_every_update(engine, ids):
+    """Workers trade one position, deposit through the loaded account and add
+    to the balance directly, all on the same account at the same time."""
+
+    errors = []
+    barrier = threading.Barrier(WORKERS)
+
+    def run_worker(worker: int):
+        try:
+            with Session(engine, autoflush=False) as session:
+                barrier.wait()
+
+                for i in range(ROUND_TRIPS):
+                    # bought and sold one apart, so every round trip nets 1 - 2
+                    # of commission
+                    for type, price in (
+                        (Transaction.Type.BUY, 100.0 + worker),
+                        (Transaction.Type.SELL, 101.0 + worker),
+                    ):
+                        run_unit_of_work(
+                            session, record_transaction, get_trade(ids, type, price)
+                        )
+                    run_unit_of_work(
+                        session, record_liquid_asset_transaction, get_deposit(ids)
+                    )
+                    run_unit_of_work(
+                        session,
+                        LiquidAssetAccount.add_to_balance,
+                        ids["liquid_asset_account_id"],
+                        TOP_UP,
+                    )
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=run_worker, args=(worker,)) for worker in range(WORKERS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+    units = WORKERS * ROUND_TRIPS
+
+    with Session(engine) as session:
+        account = get_account(session, ids)
+        holdings = session.scalars(select(CumulativeTickerHolding)).all()
+
+        assert account.balance == units * (1.0 - 2.0 + DEPOSIT + TOP_UP)
+        # every trade, deposit and top up moved the version exactly once
+        assert account.version_id == 1 + units * 4
+
+        assert [holding for holding in holdings if not holding.is_completed] == []
+        assert sum(holding.total_buys for holding in holdings) == units
+        assert sum(holding.total_sells for holding in holdings) == units
+        # inserted, then updated once per trade
+        assert sum(holding.version_id - 1 for holding in holdings) == units * 2
+
+
+@pytest.fixture
+def conflicts(monkeypatch) -> list:
+    """Errors run_unit_of_work checks for a write conflict."""
+
+    conflicts = []
+    is_write_conflict = settings.database.is_write_conflict
+
+    def record(error: Exception) -> bool:
+        conflicts.append(error)
+        return is_write_conflict(error)
+
+    monkeypatch.setattr(settings.database, "is_write_conflict", record)
+
+    return conflicts
+
+
+def test_stale_balance_is_retried(engine, ids, conflicts):
+    attempts = []
+
+    def deposit(session: Session, amount: float):
+        account = get_account(session, ids)
+        attempts.append(account.version_id)
+
+        if len(attempts) == 1:
+            # committed between the read and the write of this unit
+            with Session(engine) as other:
+                LiquidAssetAccount.add_to_balance(
+                    other, ids["liquid_asset_account_id"], TOP_UP
+                )
+                other.commit()
+
+        account.balance += amount
+        session.flush()
+
+    with Session(engine, autoflush=False) as session:
+        run_unit_of_work(session, deposit, DEPOSIT)
+
+        account = get_account(session, ids)
+
+    assert [type(error) for error in conflicts] == [StaleDataError]
+    assert attempts == [1, 2]
+    assert account.balance == TOP_UP + DEPOSIT
+    assert account.version_id == 3
+
+
+def test_stale_holding_is_retried(engine, ids, conflicts):
+    attempts = []
+
+    def trade(session: Session, fields: dict):
+        # loaded before the concurrent trade, as record_transaction loads it
+        holding = session.scalar(
+            select(CumulativeTickerHolding).where(
+                CumulativeTickerHolding.is_completed == False
+            )
+        )
+        attempts.append(holding.version_id)
+
+        if len(attempts) == 1:
+            with Session(engine) as other:
+                record_transaction(other, get_trade(ids, Transaction.Type.BUY, 100.0))
+                other.commit()
+
+        return record_transaction(session, fields)
+
+    with Session(engine, autoflush=False) as session:
+        run_unit_of_work(
+            session, record_transaction, get_trade(ids, Transaction.Type.BUY, 100.0)
+        )
+        run_unit_of_work(session, trade, get_trade(ids, Transaction.Type.SELL, 102.0))
+
+        holding = session.scalars(select(CumulativeTickerHolding)).one()
+        account = get_account(session, ids)
+
+    assert [type(error) for error in conflicts] == [StaleDataError]
+    assert attempts == [2, 3]
+    assert (holding.count, holding.total_buys, holding.total_sells) == (1.0, 2, 1)
+    assert holding.version_id == 4
+    assert account.balance == -101.0 - 101.0 + 101.0
+    assert account.version_id == 4
@@ -1,6 +1,19 @@
-from typing import List, Optional
+import functools
+import hashlib
+import json
+import os
+from typing import List, Optional, Sequence
 
-from sqlalchemy import asc, desc
+from fastapi import Request, Response, status
+from fastapi.responses import StreamingResponse
+from models.data_version import get_data_versions
+from models.pagination import SortKey, order_after
+from pydantic import TypeAdapter
+from sqlalchemy import asc, desc, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# rows fetched per round trip by ndjson responses
+NDJSON_BATCH_SIZE = int(os.environ.get("NDJSON_BATCH_SIZE", 1000))
 
 
 def generate_ordering_dict(param: str, valid_params: Optional[List[str]] = None):
@@ -13,3 +26,109 @@ def generate_ordering_dict(param: str, valid_params: Optional[List[str]] = None)
         for p in params
         if valid_params is None or p.strip("- ") in valid_params
     }
+
+
+def _get_json_row(mapper, row) -> str:
+    return json.dumps(
+        {
+            attribute.key: getattr(row, attribute.key)
+            for attribute in mapper.column_attrs
+        },
+        default=lambda value: value.isoformat(),
+    )
+
+
+async def _stream_ndjson(db: AsyncSession, query, batch_size: int):
+    result = await db.stream_scalars(query.execution_options(yield_per=batch_size))
+
+    async for rows in result.partitions():
+        mapper = inspect(rows[0]).mapper
+        chunk = "".join(f"{_get_json_row(mapper, row)}\n" for row in rows)
+
+        # written rows are not needed again, the identity map stays small
+        for row in rows:
+            db.expunge(row)
+
+        yield chunk.encode()
+
+
+def ndjson_response(
+    db: AsyncSession,
+    query,
+    sort_keys: Sequence[SortKey],
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    batch_size: int = NDJSON_BATCH_SIZE,
+) -> StreamingResponse:
+    """Rows of query as newline delimited JSON, sent batch by batch.
+
+    Rows are read from a server side cursor batch_size at a time, so memory
+    does not grow with the number of rows and the first rows are sent before
+    the last ones are fetched. after continues from a page cursor and limit
+    caps the row count, neither is required.
+    """
+
+    # a bad cursor must fail before the response starts
+    query = order_after(query, sort_keys, after)
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    return StreamingResponse(
+        _stream_ndjson(db, query, batch_size), media_type="application/x-ndjson"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_type_adapter(annotation) -> TypeAdapter:
+    return TypeAdapter(annotation)
+
+
+def schema_response(annotation, content, headers: Optional[dict] = None) -> Response:
+    """content validated once against annotation and dumped to JSON bytes.
+
+    FastAPI returns a Response as is, so a route returning this skips the
+    validation against its response_model and jsonable_encoder, and keeps the
+    response_model for its documentation only.
+    """
+
+    adapter = get_type_adapter(annotation)
+
+    return Response(
+        content=adapter.dump_json(
+            adapter.validate_python(content, from_attributes=True)
+        ),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+async def get_etag(db: AsyncSession, request: Request, keys) -> str:
+    """Strong ETag of the response to request, given the data versions it reads.
+
+    keys are the (table name, scope id) version keys of the rows the response
+    is built from; any change to them, or to the query string, changes the tag.
+    """
+
+    versions = await get_data_versions(db, keys)
+    digest = hashlib.sha256(
+        json.dumps([request.url.path, request.url.query, keys, versions]).encode()
+    ).hexdigest()
+
+    return f'"{digest[:32]}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+
+    if if_none_match is None:
+        return False
+
+    # If-None-Match compares weakly
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+    return etag in tags or "*" in tags
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
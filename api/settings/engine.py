@@ -0,0 +1,100 @@
+import os
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+# "plain": driver defaults, kept as a baseline
+# "sqlite_wal": SQLite tuned for concurrent readers and a single writer
+# "pooled": connection pool knobs for server databases (MySQL, PostgreSQL, ...)
+ENGINE_PROFILES = ("plain", "sqlite_wal", "pooled")
+
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "sqlite_wal")
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 10))
+DATABASE_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", 20))
+DATABASE_POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", 1800))
+DATABASE_POOL_PRE_PING = os.environ.get("DATABASE_POOL_PRE_PING", "1") == "1"
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_url(url: str) -> str:
+    """Swap the driver of a synchronous database URL for its asyncio counterpart."""
+
+    parsed_url = make_url(url)
+
+    return parsed_url.set(
+        drivername=ASYNC_DRIVERS[parsed_url.get_backend_name()]
+    ).render_as_string(hide_password=False)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # PRAGMAs are per connection, so they are applied on every connect
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def set_sqlite_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def create_profiled_engine(
+    url: str,
+    profile: Optional[str] = None,
+    is_async: bool = False,
+    read_only: bool = False,
+):
+    profile = profile or DATABASE_PROFILE
+
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Invalid database profile: {profile}")
+
+    is_sqlite = make_url(url).get_backend_name() == "sqlite"
+
+    if profile == "sqlite_wal" and not is_sqlite:
+        raise ValueError(f"{profile} profile requires a SQLite database URL")
+
+    options = {}
+
+    if is_sqlite and not is_async:
+        options["connect_args"] = {"check_same_thread": False}
+
+    if profile == "pooled":
+        options.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_recycle=DATABASE_POOL_RECYCLE,
+            pool_pre_ping=DATABASE_POOL_PRE_PING,
+        )
+
+    if is_async:
+        created_engine: AsyncEngine = create_async_engine(url, **options)
+        sync_engine: Engine = created_engine.sync_engine
+    else:
+        created_engine = sync_engine = create_engine(url, **options)
+
+    if profile == "sqlite_wal":
+        event.listen(sync_engine, "connect", set_sqlite_pragmas)
+
+    # replicas are read-only by themselves, SQLite connections have to be told
+    if read_only and is_sqlite:
+        event.listen(sync_engine, "connect", set_sqlite_query_only)
+
+    return created_engine